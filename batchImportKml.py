@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterMultipleLayers,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterDefinition,
+    QgsProcessingException,
+    QgsProcessingParameterFeatureSink)
+
+from .importKml import ImportKmlAlgorithm, FeatureSpool, spoolKml, tr, DEFAULT_WKB_TYPES
+from .kmlReader import KmlSource
+from .kmlCache import SPOOL_NAMES
+from .kmlParser import PARSER_BACKENDS, EXPAT_BACKEND, LXML_BACKEND, HAS_LXML
+from .workerProcesses import pythonExecutable
+
+SOURCE_FIELD = 'source_file'
+
+class BatchImportKmlAlgorithm(ImportKmlAlgorithm):
+    """
+    Algorithm to import a folder or list of KML and KMZ files into one set of layers.
+    """
+    PrmInputFiles = 'InputFiles'
+    PrmInputFolder = 'InputFolder'
+    PrmRecursive = 'Recursive'
+    PrmWorkers = 'Workers'
+
+    def initAlgorithm(self, config):
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.PrmInputFiles,
+                tr('Import KML/KMZ files (*.kml, *.txt, or *.kmz)'),
+                QgsProcessing.TypeFile,
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFile(
+                self.PrmInputFolder,
+                tr('Import all KML/KMZ files in folder'),
+                behavior=QgsProcessingParameterFile.Folder,
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.PrmRecursive,
+                tr('Include sub-folders'),
+                False,
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmPointOutputLayer,
+                tr('Output point layer'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmLineOutputLayer,
+                tr('Output line layer'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmPolygonOutputLayer,
+                tr('Output polygon layer'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmTrackOutputLayer,
+                tr('Output track layer (gx:Track as lines with time as M values)'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmTrackPointOutputLayer,
+                tr('Output track point layer (a point for each gx:Track position)'),
+                createByDefault=False,
+                optional=True)
+        )
+        param = QgsProcessingParameterNumber(
+            self.PrmWorkers,
+            tr('Number of worker processes (0 = one for each CPU, 1 = no worker processes)'),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=0,
+            minValue=0,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.PrmImportAllKml,
+            tr('Import all KML documents within a KMZ file (not just doc.kml)'),
+            False,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.PrmBatchSize,
+            tr('Number of features written to the output layers at a time'),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=1000,
+            minValue=1,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.PrmParser,
+            tr('XML parser'),
+            options=[tr(item) for item in PARSER_BACKENDS],
+            defaultValue=EXPAT_BACKEND,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+
+    def processAlgorithm(self, parameters, context, feedback):
+        self.parameters = parameters
+        self.context = context
+        # Styles and typed ExtendedData fields are not imported by the batch import
+        self.styleFields = []
+        self.extTypes = {}
+        self.converters = None
+        self.conversionErrors = 0
+        self.directGpkg = False
+        self.gpkgDatabases = {}
+        self.writeTime = 0.0
+        self.fields = None
+        self.wkbTypes = dict(DEFAULT_WKB_TYPES)
+        self.dropZ = set()
+        files = self.inputFiles(parameters, context)
+        if not files:
+            msg = tr('No KML/KMZ files were found to import.')
+            feedback.reportError(msg)
+            raise QgsProcessingException(msg)
+
+        skipPt = True if self.PrmPointOutputLayer not in parameters or parameters[self.PrmPointOutputLayer] is None else False
+        skipline = True if self.PrmLineOutputLayer not in parameters or parameters[self.PrmLineOutputLayer] is None else False
+        skipPoly = True if self.PrmPolygonOutputLayer not in parameters or parameters[self.PrmPolygonOutputLayer] is None else False
+        skipTrack = True if self.PrmTrackOutputLayer not in parameters or parameters[self.PrmTrackOutputLayer] is None else False
+        skipTrackPt = True if self.PrmTrackPointOutputLayer not in parameters or parameters[self.PrmTrackPointOutputLayer] is None else False
+        self.cntPt = 0
+        self.cntLine = 0
+        self.cntPoly = 0
+        self.cntTrack = 0
+        self.cntTrackPt = 0
+        import_all = self.parameterAsInt(parameters, self.PrmImportAllKml, context)
+        batch_size = self.parameterAsInt(parameters, self.PrmBatchSize, context)
+        if batch_size < 1:
+            batch_size = 1
+        backend = self.parameterAsEnum(parameters, self.PrmParser, context)
+        if backend == LXML_BACKEND and not HAS_LXML:
+            feedback.reportError(tr('lxml is not installed. The Expat parser will be used instead.'))
+            backend = EXPAT_BACKEND
+        workers = self.parameterAsInt(parameters, self.PrmWorkers, context)
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(files))
+        args = (skipPt, skipline, skipPoly, skipTrack, skipTrackPt, import_all, backend, batch_size)
+
+        # Each file is parsed into its own feature spools. These are kept in a dictionary
+        # indexed by the position of the file so the output is in the order of the input.
+        self.results = {}
+        self.feedback = feedback
+        self.numFiles = len(files)
+        try:
+            if workers > 1:
+                self.importParallel(files, args, workers)
+            # Files are imported in this process when worker processes are not used or
+            # could not be started.
+            for index, filename in enumerate(files):
+                if feedback.isCanceled():
+                    break
+                if index not in self.results:
+                    self.addResult(index, importFile(filename, *args))
+
+            # The output layers have the ExtendedData fields of all of the files
+            names = set()
+            for result in self.results.values():
+                names.update(result['extData'])
+            names.discard(SOURCE_FIELD)
+            names = sorted(names)
+            extDataMap = {}
+            for index, item in enumerate(names):
+                extDataMap[item] = index
+            self.extData = [SOURCE_FIELD] + names
+
+            hasGroundOverlay = False
+            feedback.setProgressText(tr('Writing the output layers'))
+            for index in sorted(self.results):
+                result = self.results[index]
+                order = [extDataMap.get(item) for item in result['extData']]
+                self.mergeSpool(result['points'], order, result['filename'], len(names), self.addpoints, batch_size)
+                self.mergeSpool(result['lines'], order, result['filename'], len(names), self.addlines, batch_size)
+                self.mergeSpool(result['polygons'], order, result['filename'], len(names), self.addpolygons, batch_size)
+                self.mergeSpool(result['tracks'], order, result['filename'], len(names), self.addtracks, batch_size)
+                self.mergeSpool(result['trackPoints'], order, result['filename'], len(names), self.addtrackpoints, batch_size)
+                FeatureSpool(*result['overlays']).close()
+                if result['groundOverlay']:
+                    hasGroundOverlay = True
+        finally:
+            # Remove the spools of any file that was not merged into the output layers
+            self.removeSpools()
+
+        if hasGroundOverlay:
+            feedback.pushInfo(tr('NOTICE: Some of these files may contain GroundOverlay images.'))
+            feedback.pushInfo(tr('Run "Raster->KML Tools->Extract KML/KMZ Ground Overlasys" to extract them if embedded.'))
+            feedback.pushInfo('')
+
+        feedback.pushInfo('{} of {} files imported'.format(len(self.results), len(files)))
+        feedback.pushInfo('{} points extracted'.format(self.cntPt))
+        feedback.pushInfo('{} lines extracted'.format(self.cntLine))
+        feedback.pushInfo('{} polygons extracted'.format(self.cntPoly))
+        if self.cntTrack or self.cntTrackPt:
+            feedback.pushInfo('{} tracks extracted'.format(self.cntTrack))
+            feedback.pushInfo('{} track points extracted'.format(self.cntTrackPt))
+
+        r = {}
+        if self.cntPt > 0:
+            r[self.PrmPointOutputLayer] = self.dest_id_pt
+        if self.cntLine > 0:
+            r[self.PrmLineOutputLayer] = self.dest_id_line
+        if self.cntPoly > 0:
+            r[self.PrmPolygonOutputLayer] = self.dest_id_poly
+        if self.cntTrack > 0:
+            r[self.PrmTrackOutputLayer] = self.dest_id_track
+        if self.cntTrackPt > 0:
+            r[self.PrmTrackPointOutputLayer] = self.dest_id_trackpt
+
+        return (r)
+
+    def inputFiles(self, parameters, context):
+        '''Return the list of selected files followed by the KML/KMZ files in the
+        selected folder.'''
+        files = []
+        for filename in self.parameterAsFileList(parameters, self.PrmInputFiles, context):
+            f, extension = os.path.splitext(filename)
+            if extension.lower() in ('.kmz', '.kml', '.txt'):
+                files.append(filename)
+        folder = self.parameterAsFile(parameters, self.PrmInputFolder, context)
+        if folder and os.path.isdir(folder):
+            recursive = self.parameterAsInt(parameters, self.PrmRecursive, context)
+            found = []
+            for root, dirs, names in os.walk(folder):
+                for name in names:
+                    f, extension = os.path.splitext(name)
+                    if extension.lower() in ('.kmz', '.kml'):
+                        found.append(os.path.join(root, name))
+                if not recursive:
+                    break
+            found.sort()
+            files.extend(found)
+        # Remove any file that was selected more than once
+        unique = []
+        paths = set()
+        for filename in files:
+            path = os.path.normcase(os.path.abspath(filename))
+            if path not in paths:
+                paths.add(path)
+                unique.append(filename)
+        return(unique)
+
+    def importParallel(self, files, args, workers):
+        '''Parse the files in worker processes. Any file whose worker fails is left
+        out of self.results so that it is imported in this process instead.'''
+        executable = pythonExecutable()
+        if executable is None:
+            self.feedback.pushInfo(tr('The Python interpreter could not be found so worker processes will not be used.'))
+            return
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            ctx.set_executable(executable)
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        except Exception:
+            self.feedback.pushInfo(tr('Worker processes could not be started.'))
+            return
+        futures = {}
+        with executor:
+            for index, filename in enumerate(files):
+                futures[executor.submit(importFile, filename, *args)] = index
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.feedback.pushInfo(tr('{}: The worker process failed ({!r}). The file will be imported in this process.').format(
+                        files[futures[future]], e))
+                else:
+                    self.addResult(futures[future], result)
+                if self.feedback.isCanceled():
+                    for item in futures:
+                        item.cancel()
+                    break
+        # Keep the results of the files that finished while the workers were shutting down
+        for future, index in futures.items():
+            if index not in self.results and future.done() and not future.cancelled() and future.exception() is None:
+                self.addResult(index, future.result())
+
+    def addResult(self, index, result):
+        self.results[index] = result
+        if result['error']:
+            self.feedback.reportError('{}: {}'.format(result['filename'], result['error']))
+        self.feedback.pushInfo('{}: {} points, {} lines, {} polygons'.format(
+            result['filename'], result['points'][1], result['lines'][1], result['polygons'][1]))
+        self.feedback.setProgress(len(self.results) * 100.0 / self.numFiles)
+
+    def removeSpools(self):
+        '''Remove the spool files of every result. The spools that were merged into the
+        output layers have already been removed.'''
+        for result in self.results.values():
+            for name in SPOOL_NAMES:
+                filename = result[name][0]
+                if filename:
+                    try:
+                        os.remove(filename)
+                    except OSError:
+                        pass
+
+    def mergeSpool(self, spooled, order, source, extDataSize, addfeatures, batch_size):
+        '''Copy the features of one file into the output layer. The ExtendedData attributes
+        of the file are moved to their position in the combined list of fields.'''
+        (filename, count) = spooled
+        self.copySpool(FeatureSpool(filename, count), order, addfeatures, batch_size, extDataSize, [source])
+
+    def name(self):
+        return 'batchimportkml'
+
+    def displayName(self):
+        return tr('Batch import KML/KMZ')
+
+    def createInstance(self):
+        return BatchImportKmlAlgorithm()
+
+def importFile(filename, skipPt, skipLine, skipPoly, skipTrack, skipTrackPt, importAll, backend, batchSize):
+    '''Parse one KML/KMZ file into named feature spools. This runs in a worker process
+    so only picklable values are returned: the spool filenames and feature counts, the
+    ExtendedData names in the order they were found and any error message.'''
+    try:
+        source = KmlSource(filename, importAll)
+    except Exception:
+        result = {
+            'filename': filename,
+            'extData': [],
+            'links': [],
+            'groundOverlay': False,
+            'error': tr('Failed to open file.')
+        }
+        for name in SPOOL_NAMES:
+            result[name] = (None, 0)
+        return(result)
+    # Overlay footprints are not imported by the batch import
+    skip = (skipPt, skipLine, skipPoly, skipTrack, skipTrackPt, True)
+    result = spoolKml(source, skip, backend, batchSize)
+    result['filename'] = filename
+    source.close()
+    return(result)
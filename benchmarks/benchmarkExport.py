@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Times the Export KMZ algorithm on a generated memory layer of polygons.
+
+    python3 benchmarks/benchmarkExport.py [--count 100000] [--vertices 50]
+
+compares the export that builds the whole simplekml document before it is written
+with the streaming export, which writes each feature as it is exported. The peak
+memory includes the memory layer, which is the same in both cases.
+"""
+import os
+import sys
+import json
+import math
+import argparse
+import tempfile
+import benchmarkUtils as bu
+
+def polygonLayer(count, vertices):
+    '''Return a memory layer of count polygons of vertices vertices.'''
+    from qgis.core import QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY
+    layer = QgsVectorLayer('Polygon?crs=EPSG:4326&field=name:string&field=value:double', 'benchmark', 'memory')
+    features = []
+    for i in range(count):
+        x = -170 + (i * 0.37) % 340
+        y = -80 + (i * 0.23) % 160
+        ring = [QgsPointXY(x + 0.01 * math.cos(2 * math.pi * j / vertices), y + 0.01 * math.sin(2 * math.pi * j / vertices))
+            for j in range(vertices)]
+        ring.append(ring[0])
+        feature = QgsFeature(layer.fields())
+        feature.setGeometry(QgsGeometry.fromPolygonXY([ring]))
+        feature.setAttributes(['Feature {}'.format(i), i * 1.5])
+        features.append(feature)
+    layer.dataProvider().addFeatures(features)
+    return(layer)
+
+def runExport(case):
+    '''Run one export in this process. This is the child side of bu.runCase.'''
+    app = bu.startQgis()
+    layer = polygonLayer(case['count'], case['vertices'])
+    parameters = {
+        'InputLayer': layer,
+        'OutputKmz': case['filename'],
+        'NameField': 'name',
+        'DescriptionField': ['name', 'value'],
+        'ExportStyle': False,
+        'Workers': 1
+    }
+    parameters.update(case['options'])
+    (seconds, peak) = bu.runAlgorithm('exportkmz', parameters)
+    print(json.dumps({'seconds': seconds, 'peak': peak, 'size': os.path.getsize(case['filename'])}))
+    app.exitQgis()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the streaming Export KMZ algorithm')
+    parser.add_argument('--count', type=int, default=100000, help='Number of polygons')
+    parser.add_argument('--vertices', type=int, default=50, help='Number of vertices of each polygon')
+    args = parser.parse_args()
+    rows = []
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'benchmark.kmz')
+        for label, options in (('Whole document', {'StreamingExport': False}), ('Streaming', {'StreamingExport': True})):
+            result = bu.runCase(__file__, {
+                'filename': filename, 'count': args.count, 'vertices': args.vertices, 'options': options})
+            results[label] = result
+            rows.append([label, bu.formatNumber(result['seconds']), bu.formatNumber(result['peak'], 1),
+                bu.formatNumber(result['size'] / 1048576.0, 1)])
+    print('{} polygons of {} vertices'.format(args.count, args.vertices))
+    bu.printTable(['Export', 'Seconds', 'Peak MB', 'KMZ MB'], rows)
+    print('Streaming takes {:.0%} of the time of the whole document export'.format(
+        results['Streaming']['seconds'] / results['Whole document']['seconds']))
+
+if __name__ == '__main__':
+    case = bu.caseArgument(sys.argv)
+    if case is None:
+        main()
+    else:
+        runExport(case)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Times the Import KML/KMZ algorithm on generated KML files.
+
+    python3 benchmarks/benchmarkImport.py single-pass [--count 200000] [--kml]
+
+compares the default import, which reads the document once to find the ExtendedData
+fields and again to import the features, with the single pass import.
+
+    python3 benchmarks/benchmarkImport.py backends [--sizes 10000 100000 1000000]
+
+times each XML parser backend on KML files of each number of placemarks. The lxml
+backend is left out if lxml is not installed.
+
+    python3 benchmarks/benchmarkImport.py long-line [--vertices 62500 125000 250000 500000]
+
+imports a single LineString of each number of vertices. The time per vertex stays
+about the same as the line gets longer if the coordinates are parsed in linear time.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import benchmarkUtils as bu
+
+OUTPUTS = ('PointOutputLayer', 'LineOutputLayer', 'PolygonOutputLayer')
+
+def importParameters(filename, options, outputs=OUTPUTS):
+    parameters = {'Input': filename}
+    for name in outputs:
+        parameters[name] = 'TEMPORARY_OUTPUT'
+    parameters.update(options)
+    return(parameters)
+
+def runImport(case):
+    '''Run one import in this process. This is the child side of bu.runCase.'''
+    app = bu.startQgis()
+    (seconds, peak) = bu.runAlgorithm('importkml', importParameters(
+        case['filename'], case['options'], case.get('outputs', OUTPUTS)))
+    print(json.dumps({'seconds': seconds, 'peak': peak}))
+    app.exitQgis()
+
+def singlePass(args, folder):
+    filename = os.path.join(folder, 'benchmark.kml' if args.kml else 'benchmark.kmz')
+    print('Writing {} placemarks to {}'.format(args.count, filename))
+    bu.writeKml(filename, args.count, kmz=not args.kml)
+    rows = []
+    results = {}
+    for label, options in (('Two passes', {'SinglePass': False}), ('Single pass', {'SinglePass': True})):
+        result = bu.runCase(__file__, {'filename': filename, 'options': options})
+        results[label] = result
+        rows.append([label, bu.formatNumber(result['seconds']), bu.formatNumber(result['peak'], 1)])
+    bu.printTable(['Import', 'Seconds', 'Peak MB'], rows)
+    print('Single pass takes {:.0%} of the time of two passes'.format(
+        results['Single pass']['seconds'] / results['Two passes']['seconds']))
+
+def backends(args, folder):
+    kmlParser = bu.pluginModule('kmlParser')
+    parsers = [kmlParser.SAX_BACKEND, kmlParser.EXPAT_BACKEND]
+    if kmlParser.HAS_LXML:
+        parsers.append(kmlParser.LXML_BACKEND)
+    else:
+        print('lxml is not installed so its backend is not timed')
+    rows = []
+    for count in args.sizes:
+        filename = bu.writeKml(os.path.join(folder, 'benchmark{}.kml'.format(count)), count, args.vertices)
+        for parser in parsers:
+            result = bu.runCase(__file__, {'filename': filename, 'options': {'Parser': parser}})
+            rows.append([count, kmlParser.PARSER_BACKENDS[parser], bu.formatNumber(result['seconds']),
+                bu.formatNumber(count / result['seconds'], 0), bu.formatNumber(result['peak'], 1)])
+        os.remove(filename)
+    bu.printTable(['Placemarks', 'Parser', 'Seconds', 'Placemarks/s', 'Peak MB'], rows)
+
+def longLine(args, folder):
+    rows = []
+    for vertices in args.vertices:
+        filename = bu.writeLongLineKml(os.path.join(folder, 'line{}.kml'.format(vertices)), vertices)
+        result = bu.runCase(__file__, {'filename': filename, 'options': {}, 'outputs': ['LineOutputLayer']})
+        rows.append([vertices, bu.formatNumber(result['seconds']),
+            bu.formatNumber(result['seconds'] * 1e6 / vertices), bu.formatNumber(result['peak'], 1)])
+        os.remove(filename)
+    bu.printTable(['Vertices', 'Seconds', 'Microseconds/vertex', 'Peak MB'], rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Import KML/KMZ algorithm')
+    commands = parser.add_subparsers(dest='command')
+    command = commands.add_parser('single-pass', help='Compare the single pass import with the two pass import')
+    command.add_argument('--count', type=int, default=200000, help='Number of placemarks')
+    command.add_argument('--kml', action='store_true', help='Write a KML file instead of a KMZ file')
+    command = commands.add_parser('backends', help='Compare the XML parser backends')
+    command.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+        help='Numbers of placemarks')
+    command.add_argument('--vertices', type=int, default=5, help='Number of vertices of the lines and polygons')
+    command = commands.add_parser('long-line', help='Time a single LineString of more and more vertices')
+    command.add_argument('--vertices', type=int, nargs='+', default=[62500, 125000, 250000, 500000],
+        help='Numbers of vertices')
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        return
+    with tempfile.TemporaryDirectory() as folder:
+        if args.command == 'single-pass':
+            singlePass(args, folder)
+        elif args.command == 'backends':
+            backends(args, folder)
+        elif args.command == 'long-line':
+            longLine(args, folder)
+
+if __name__ == '__main__':
+    case = bu.caseArgument(sys.argv)
+    if case is None:
+        main()
+    else:
+        runImport(case)
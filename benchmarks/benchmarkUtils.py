@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Shared code of the benchmark scripts. The benchmarks run the processing algorithms
+of the plugin in a standalone QGIS, so they need the Python interpreter that QGIS
+uses with the qgis module importable. Set QGIS_PREFIX_PATH if QGIS is not found.
+Each case runs in a process of its own so its peak memory is measured separately.
+"""
+import os
+import sys
+import json
+import time
+import math
+import zipfile
+import importlib
+import subprocess
+from xml.sax.saxutils import escape
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_NAME = os.path.basename(PLUGIN_DIR)
+
+def pluginModule(name):
+    '''Import and return the plugin module name.'''
+    parent = os.path.dirname(PLUGIN_DIR)
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    return(importlib.import_module('{}.{}'.format(PLUGIN_NAME, name)))
+
+def startQgis():
+    '''Start a QGIS application without a GUI and register the KML Tools provider.
+    The application is returned and must be kept until the benchmark is done.'''
+    from qgis.core import QgsApplication
+    prefix = os.environ.get('QGIS_PREFIX_PATH')
+    if prefix:
+        QgsApplication.setPrefixPath(prefix, True)
+    app = QgsApplication([], False)
+    app.initQgis()
+    plugins = os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins')
+    if plugins not in sys.path:
+        sys.path.append(plugins)
+    from processing.core.Processing import Processing
+    Processing.initialize()
+    provider = pluginModule('provider').KmlToolsProvider()
+    QgsApplication.processingRegistry().addProvider(provider)
+    return(app)
+
+def runAlgorithm(name, parameters):
+    '''Run the processing algorithm kmltools:name and return the wall time in seconds
+    and the peak memory of the process in MB.'''
+    import processing
+    start = time.perf_counter()
+    processing.run('kmltools:' + name, parameters)
+    return(time.perf_counter() - start, peakMemoryMB())
+
+def peakMemoryMB():
+    '''Return the peak resident memory of this process in MB or None if it is not
+    available on this platform.'''
+    try:
+        import resource
+    except ImportError:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on macOS, kilobytes elsewhere
+        peak /= 1024.0
+    return(peak / 1024.0)
+
+def runCase(script, case):
+    '''Run one benchmark case in a new process with "script --case <json>" and return
+    the dictionary it prints as JSON on its last line.'''
+    output = subprocess.run(
+        [sys.executable, script, '--case', json.dumps(case)],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return(json.loads(output.strip().splitlines()[-1]))
+
+def caseArgument(argv):
+    '''Return the case of a "--case <json>" command line or None.'''
+    if len(argv) == 3 and argv[1] == '--case':
+        return(json.loads(argv[2]))
+    return(None)
+
+def printTable(headings, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headings, *rows)]
+    for row in [headings] + rows:
+        print('  '.join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+def formatNumber(value, decimals=2):
+    if value is None:
+        return('-')
+    return('{:.{}f}'.format(value, decimals))
+
+def ringCoordinates(x, y, radius, vertices):
+    points = []
+    for i in range(vertices):
+        angle = 2 * math.pi * i / vertices
+        points.append('{:.6f},{:.6f},0'.format(x + radius * math.cos(angle), y + radius * math.sin(angle)))
+    points.append(points[0])
+    return(' '.join(points))
+
+def placemarkKml(i, vertices):
+    '''Return the KML of placemark i. The placemarks cycle through points, lines and
+    polygons. Some ExtendedData fields only appear late in the document so the
+    importer cannot know all of the fields before it has read everything.'''
+    x = -170 + (i * 0.37) % 340
+    y = -80 + (i * 0.23) % 160
+    kind = i % 3
+    if kind == 0:
+        geometry = '<Point><coordinates>{:.6f},{:.6f},0</coordinates></Point>'.format(x, y)
+    elif kind == 1:
+        coords = ' '.join('{:.6f},{:.6f},0'.format(x + j * 0.001, y + math.sin(j) * 0.001) for j in range(vertices))
+        geometry = '<LineString><coordinates>{}</coordinates></LineString>'.format(coords)
+    else:
+        geometry = '<Polygon><outerBoundaryIs><LinearRing><coordinates>{}</coordinates></LinearRing></outerBoundaryIs></Polygon>'.format(
+            ringCoordinates(x, y, 0.01, vertices))
+    data = ['<Data name="index"><value>{}</value></Data>'.format(i),
+            '<Data name="label"><value>{}</value></Data>'.format(escape('feature <{}>'.format(i)))]
+    if i % 1000 == 999:
+        data.append('<Data name="rare_{}"><value>{}</value></Data>'.format(i // 1000, i))
+    return('<Placemark><name>Feature {0}</name><description>Description of feature {0}</description>'
+        '<ExtendedData>{1}</ExtendedData>{2}</Placemark>\n'.format(i, ''.join(data), geometry))
+
+def writeKml(filename, count, vertices=20, kmz=False):
+    '''Write a KML or KMZ file of count placemarks with lines and polygons of vertices
+    vertices and return filename.'''
+    head = ('<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">'
+        '<Document><name>Benchmark</name><Folder><name>Features</name>\n')
+    tail = '</Folder></Document></kml>\n'
+    if kmz:
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as z:
+            with z.open('doc.kml', 'w', force_zip64=True) as f:
+                writePlacemarks(f, head, tail, count, vertices)
+    else:
+        with open(filename, 'wb') as f:
+            writePlacemarks(f, head, tail, count, vertices)
+    return(filename)
+
+def writePlacemarks(f, head, tail, count, vertices):
+    f.write(head.encode('utf-8'))
+    buf = []
+    for i in range(count):
+        buf.append(placemarkKml(i, vertices))
+        if len(buf) >= 1000:
+            f.write(''.join(buf).encode('utf-8'))
+            buf = []
+    f.write(''.join(buf).encode('utf-8'))
+    f.write(tail.encode('utf-8'))
+
+def writeLongLineKml(filename, vertices):
+    '''Write a KML file of a single LineString of vertices vertices and return filename.'''
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<kml xmlns="http://www.opengis.net/kml/2.2">'
+            '<Document><Placemark><name>Long line</name><LineString><coordinates>\n')
+        for start in range(0, vertices, 10000):
+            f.write(' '.join('{:.7f},{:.7f},{:.1f}'.format(-100 + i * 1e-4, 40 + math.sin(i / 100.0), i % 500)
+                for i in range(start, min(start + 10000, vertices))))
+            f.write('\n')
+        f.write('</coordinates></LineString></Placemark></Document></kml>\n')
+    return(filename)
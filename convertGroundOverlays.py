@@ -312,6 +312,8 @@ class GroundOverlayHandler(xml.sax.handler.ContentHandler, QObject):
         self.west = ""
         self.rotation = ""
         self.href = ""
+        # Character data is collected as a list of chunks and joined when the element ends
+        self.buffer = []
 
     def startElement(self, name, attr):
         if name.startswith('kml:'):
@@ -322,36 +324,26 @@ class GroundOverlayHandler(xml.sax.handler.ContentHandler, QObject):
         elif self.inGroundOverlay:
             if name == "north":
                 self.inNorth = True
-                self.north = ""
+                self.buffer = []
             elif name == "south":
                 self.inSouth = True
-                self.south = ""
+                self.buffer = []
             elif name == "east":
                 self.inEast = True
-                self.east = ""
+                self.buffer = []
             elif name == "west":
                 self.inWest = True
-                self.west = ""
+                self.buffer = []
             elif name == "rotation":
                 self.inRotation = True
-                self.rotation = ""
+                self.buffer = []
             elif name == "href":
                 self.inHref = True
-                self.href = ""
+                self.buffer = []
 
     def characters(self, data):
-        if self.inNorth:  # on text within tag
-            self.north += data
-        elif self.inSouth:
-            self.south += data
-        elif self.inEast:
-            self.east += data
-        elif self.inWest:
-            self.west += data
-        elif self.inRotation:
-            self.rotation += data
-        elif self.inHref:
-            self.href += data
+        if self.inNorth or self.inSouth or self.inEast or self.inWest or self.inRotation or self.inHref:
+            self.buffer.append(data)
 
     def endElement(self, name):
         if name.startswith('kml:'):
@@ -359,22 +351,22 @@ class GroundOverlayHandler(xml.sax.handler.ContentHandler, QObject):
         if self.inGroundOverlay:
             if name == "north":
                 self.inNorth = False  # on end title tag
-                self.north = self.north.strip()
+                self.north = "".join(self.buffer).strip()
             elif name == "south":
                 self.inSouth = False
-                self.south = self.south.strip()
+                self.south = "".join(self.buffer).strip()
             elif name == "east":
                 self.inEast = False
-                self.east = self.east.strip()
+                self.east = "".join(self.buffer).strip()
             elif name == "west":
                 self.inWest = False
-                self.west = self.west.strip()
+                self.west = "".join(self.buffer).strip()
             elif name == "rotation":
                 self.inRotation = False
-                self.rotation = self.rotation.strip()
+                self.rotation = "".join(self.buffer).strip()
             elif name == "href":
                 self.inHref = False
-                self.href = self.href.strip()
+                self.href = "".join(self.buffer).strip()
             elif name == 'GroundOverlay':
                 self.inGroundOverlay = False
                 self.groundoverlay.emit(self.north, self.south, self.east, self.west, self.rotation, self.href)
@@ -10,11 +10,14 @@
 """
 import os
 import math
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from qgis.PyQt.QtCore import Qt, QUrl, QTime, QDateTime, QDate, QSize, QPointF
 from qgis.PyQt.QtGui import QIcon
 
 from qgis.core import (
-    QgsCoordinateTransform, QgsCoordinateReferenceSystem, QgsCompoundCurve,
+    QgsCoordinateTransform, QgsCoordinateReferenceSystem,
     QgsProject, QgsRenderContext, QgsWkbTypes, Qgis, QgsExpression, QgsFeatureRequest,
     QgsExpressionContext, QgsExpressionContextUtils)
 
@@ -34,9 +37,15 @@ import dateutil.parser
 import datetime
 from xml.sax.saxutils import escape
 import simplekml
+from simplekml.featgeom import Placemark
 # import traceback
 import tempfile
 from .settings import settings
+from .kmzWriter import KmzWriter
+from .kmzWorkers import (
+    PlacemarkPool, wkbGeometries, kmlCoordinates, labelCoordinates, transformGeometries, wgs84Transformer,
+    HAS_NUMPY, HAS_PYPROJ)
+from .workerProcesses import pythonExecutable
 
 def qcolor2kmlcolor(color, opacity=1):
     return('{:02x}{:02x}{:02x}{:02x}'.format(int(color.alpha()*opacity), color.blue(), color.green(), color.red()))
@@ -44,6 +53,11 @@ def qcolor2kmlcolor(color, opacity=1):
 
 ALTITUDE_MODES = ['clampToGround', 'relativeToGround', 'absolute']
 
+KML_FORMATS = ['Compact when the layer has more features than the limit, otherwise indented', 'Indented', 'Compact']
+FORMAT_AUTOMATIC = 0
+FORMAT_INDENTED = 1
+FORMAT_COMPACT = 2
+
 GOOGLE_ICONS = {
     'Square placemark':'http://maps.google.com/mapfiles/kml/shapes/placemark_square.png',
     'Circle placemark':'http://maps.google.com/mapfiles/kml/shapes/placemark_circle.png',
@@ -89,6 +103,11 @@ class ExportKmzAlgorithm(QgsProcessingAlgorithm):
     PrmPhotoField = 'PhotoField'
     PrmPhotoDir = 'PhotoDir'
     PrmUseDescBR = 'UseDescBR'
+    PrmStreamingExport = 'StreamingExport'
+    PrmKmlFormat = 'KmlFormat'
+    PrmCompactFeatureCount = 'CompactFeatureCount'
+    PrmWorkers = 'Workers'
+    PrmCoordinatePrecision = 'CoordinatePrecision'
     epsg4326 = QgsCoordinateReferenceSystem("EPSG:4326")
     temp_dir = tempfile.gettempdir()
 
@@ -339,6 +358,49 @@ class ExportKmzAlgorithm(QgsProcessingAlgorithm):
         )
         param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
         self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+                self.PrmStreamingExport,
+                'Write features to the KMZ as they are exported (uses less memory)',
+                False,
+                optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.PrmKmlFormat,
+            'KML formatting',
+            options=KML_FORMATS,
+            defaultValue=FORMAT_AUTOMATIC,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.PrmCompactFeatureCount,
+            'Feature limit above which the KML is written compactly',
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=10000,
+            minValue=0,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.PrmWorkers,
+            'Number of worker processes used to create the KML (0 = one for each CPU, 1 = no worker processes)',
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=1,
+            minValue=0,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.PrmCoordinatePrecision,
+            'Number of decimal places of the coordinates (-1 = full precision)',
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=-1,
+            minValue=-1,
+            maxValue=15,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
 
     def processAlgorithm(self, parameters, context, feedback):
         self.parameters = parameters
@@ -348,6 +410,15 @@ class ExportKmzAlgorithm(QgsProcessingAlgorithm):
         layer = self.parameterAsLayer(parameters, self.PrmInputLayer, context)
         selected_features_only = self.parameterAsInt(parameters, self.PrmSelectedFeaturesOnly, context)
         add_line_breaks = self.parameterAsInt(parameters, self.PrmUseDescBR, context)
+        streaming = self.parameterAsInt(parameters, self.PrmStreamingExport, context)
+        kml_format = self.parameterAsEnum(parameters, self.PrmKmlFormat, context)
+        compact_feature_count = self.parameterAsInt(parameters, self.PrmCompactFeatureCount, context)
+        workers = self.parameterAsInt(parameters, self.PrmWorkers, context)
+        if workers < 1:
+            workers = os.cpu_count() or 1
+        precision = self.parameterAsInt(parameters, self.PrmCoordinatePrecision, context)
+        if precision < 0:
+            precision = None
 
         # Before we go further check to make sure we have a valid vector layer
         if not layer:
@@ -407,216 +478,290 @@ class ExportKmzAlgorithm(QgsProcessingAlgorithm):
         elif alt_interpret == 2:
             hasz = False
         src_crs = layer.crs()
+        transform_crs = None
         if src_crs != self.epsg4326:
             geomTo4326 = QgsCoordinateTransform(src_crs, self.epsg4326, QgsProject.instance())
+            transform_crs = self.bulkTransformCrs(src_crs)
 
         self.symcontext = QgsRenderContext.fromMapSettings(settings.canvas.mapSettings())
         self.png_icons = []
         self.cat_styles = {}
         self.default_cat_index = -1
-        kml = simplekml.Kml()
-        kml.resetidcounter()
-        try:
-            self.render = layer.renderer()
-            self.exp_context = QgsExpressionContext()
-            self.exp_context.appendScopes(QgsExpressionContextUtils.globalProjectLayerScopes(layer))
-        except Exception:
-            if export_style:
-                export_style = 0
-                feedback.reportError('Layer style cannot be determined. Processing will continue without symbol style export.')
-        if export_style:
-            render_type = self.render.type()
-            if render_type == 'singleSymbol':
-                export_style = 1
-            elif render_type == 'categorizedSymbol':
-                style_field = self.render.classAttribute()
-                # feedback.pushInfo('style_field: {}'.format(style_field))
-                self.field_exp = QgsExpression('"{}"'.format(style_field))
-                # feedback.pushInfo('field_exp: {}'.format(self.field_exp))
-                export_style = 2
-            elif render_type == 'graduatedSymbol':
-                style_field = self.render.classAttribute()
-                self.field_exp = QgsExpression(style_field)
-                export_style = 3
-            else:
-                feedback.reportError('Only single, categorized, and graduated symbol styles can be exported. Processing will continue without symbol style export.')
-                export_style = 0
-            if export_style:
-                self.initStyles(export_style, google_icon, name_field, poly_hidden_point_label, geomtype, kml)
-        
-        basefolder = folder = kml.newfolder(name=layer.sourceName())
-        altitude = 0
-
-        if group_by_subfolders:
-            request = QgsFeatureRequest()
-            request.addOrderBy('"{}"'.format(group_by_subfolders))
-
         if selected_features_only:
-            if group_by_subfolders:
-                iterator = layer.getSelectedFeatures(request)
-            else:
-                iterator = layer.getSelectedFeatures()
             featureCount = layer.selectedFeatureCount()
         else:
             featureCount = layer.featureCount()
-            if group_by_subfolders:
-                iterator = layer.getFeatures(request)
+        if kml_format == FORMAT_AUTOMATIC:
+            indent = featureCount <= compact_feature_count
+        else:
+            indent = kml_format == FORMAT_INDENTED
+        executor = None
+        writer = None  # KmzWriter of the output file once it is open
+        pool = None
+        try:
+            if workers > 1:
+                executor = self.startWorkers(workers)
+            # The worker processes return the KML of the placemarks so they are written as
+            # they are exported.
+            parallel = executor is not None
+            if parallel:
+                streaming = True
+            if streaming:
+                kml = writer = KmzWriter(filename, indent)
+                kml.startDocument()
             else:
-                iterator = layer.getFeatures()
-        total = 100.0 / featureCount if featureCount else 0
-        num_features = 0
-        last_category = None
-        for cnt, feature in enumerate(iterator):
-            if feedback.isCanceled():
-                break
-            num_features += 1
-            # feedback.pushInfo('Feature {} - {}'.format(num_features, type(feature)))
-            geom = feature.geometry()
-            # Check to see if there is a Null or Empty geometery and skip this feature.
-            if geom.isNull() or geom.isEmpty():
-                continue
-            # Styling can be used as a filter. We check to see if there is an available style
-            # If not we skip the feature.
+                kml = simplekml.Kml()
+                kml.resetidcounter()
+            try:
+                self.render = layer.renderer()
+                self.exp_context = QgsExpressionContext()
+                self.exp_context.appendScopes(QgsExpressionContextUtils.globalProjectLayerScopes(layer))
+            except Exception:
+                if export_style:
+                    export_style = 0
+                    feedback.reportError('Layer style cannot be determined. Processing will continue without symbol style export.')
             if export_style:
-                style = self.getFeatureStyle(feature, export_style, geomtype)
-                if style is None:
-                    continue
-            if src_crs != self.epsg4326:
-                geom.transform(geomTo4326)
+                render_type = self.render.type()
+                if render_type == 'singleSymbol':
+                    export_style = 1
+                elif render_type == 'categorizedSymbol':
+                    style_field = self.render.classAttribute()
+                    # feedback.pushInfo('style_field: {}'.format(style_field))
+                    self.field_exp = QgsExpression('"{}"'.format(style_field))
+                    # feedback.pushInfo('field_exp: {}'.format(self.field_exp))
+                    export_style = 2
+                elif render_type == 'graduatedSymbol':
+                    style_field = self.render.classAttribute()
+                    self.field_exp = QgsExpression(style_field)
+                    export_style = 3
+                else:
+                    feedback.reportError('Only single, categorized, and graduated symbol styles can be exported. Processing will continue without symbol style export.')
+                    export_style = 0
+                if export_style:
+                    self.initStyles(export_style, google_icon, name_field, poly_hidden_point_label, geomtype, kml)
+        
+            if streaming:
+                # The styles are shared by all the features so they are written first
+                if export_style == 1:
+                    kml.writeStyles([self.simple_style])
+                elif export_style:
+                    kml.writeStyles(self.cat_styles.values())
+                kml.startFolder(layer.sourceName())
+            else:
+                basefolder = folder = kml.newfolder(name=layer.sourceName())
+            if parallel:
+                depth = kml.depth()
+                if depth is not None and group_by_subfolders:
+                    depth += 1
+                pool = PlacemarkPool(kml, executor, workers, hasz, altitude_addend, depth, precision, transform_crs)
+            altitude = 0
+            start_time = time.time()
 
-            if altitude_field:
-                try:
-                    altitude = float(feature[altitude_field])
-                except Exception:
-                    altitude = 0
             if group_by_subfolders:
-                current_category = '{}'.format(feature[group_by_subfolders])
-                if current_category == '':
-                    current_category = 'Uncategorized'
-                if current_category != last_category:
-                    last_category = current_category
-                    folder = basefolder.newfolder(name=current_category)
-            if geom.isMultipart() or (name_field and geomtype == QgsWkbTypes.PolygonGeometry and poly_hidden_point_label):
-                kmlgeom = folder.newmultigeometry()
-                kml_item = kmlgeom
+                request = QgsFeatureRequest()
+                request.addOrderBy('"{}"'.format(group_by_subfolders))
+
+            if selected_features_only:
+                if group_by_subfolders:
+                    iterator = layer.getSelectedFeatures(request)
+                else:
+                    iterator = layer.getSelectedFeatures()
             else:
-                kmlgeom = folder
-                kml_item = None
-            if geomtype == QgsWkbTypes.PointGeometry:  # POINTS
-                for pt in geom.parts():
-                    kmlpart = kmlgeom.newpoint()
-                    self.setAltitudeMode(kmlpart, feature, default_alt_mode, alt_mode_field, extend_sides_to_ground)
-                    if kml_item is None:
-                        kml_item = kmlpart
-                    if hasz:
-                        kmlpart.coords = [(pt.x(), pt.y(), pt.z() + altitude_addend)]
-                    else:
-                        kmlpart.coords = [(pt.x(), pt.y(), altitude + altitude_addend)]
-            elif geomtype == QgsWkbTypes.LineGeometry:  # LINES
-                # feedback.pushInfo('geomtype {}'.format(geomtype))
-                for part in geom.parts():
-                    # feedback.pushInfo('part type {}'.format(type(part)))
-                    kmlpart = kmlgeom.newlinestring()
-                    self.setAltitudeMode(kmlpart, feature, default_alt_mode, alt_mode_field, extend_sides_to_ground)
-                    if kml_item is None:
-                        kml_item = kmlpart
-                    if hasz:
-                        kmlpart.coords = [(pt.x(), pt.y(), pt.z() + altitude_addend) for pt in part]
-                    else:
-                        kmlpart.coords = [(pt.x(), pt.y(), altitude + altitude_addend) for pt in part]
-            elif geomtype == QgsWkbTypes.PolygonGeometry:  # POLYGONS
-                if name_field and poly_hidden_point_label:
+                if group_by_subfolders:
+                    iterator = layer.getFeatures(request)
+                else:
+                    iterator = layer.getFeatures()
+            total = 100.0 / featureCount if featureCount else 0
+            num_features = 0
+            last_category = None
+            for cnt, feature in enumerate(iterator):
+                if feedback.isCanceled():
+                    break
+                num_features += 1
+                # feedback.pushInfo('Feature {} - {}'.format(num_features, type(feature)))
+                geom = feature.geometry()
+                # Check to see if there is a Null or Empty geometery and skip this feature.
+                if geom.isNull() or geom.isEmpty():
+                    continue
+                # Styling can be used as a filter. We check to see if there is an available style
+                # If not we skip the feature.
+                if export_style:
+                    style = self.getFeatureStyle(feature, export_style, geomtype)
+                    if style is None:
+                        continue
+                if src_crs != self.epsg4326 and transform_crs is None:
+                    geom.transform(geomTo4326)
+
+                if altitude_field:
                     try:
-                        centroid = geom.centroid().asPoint()
-                        name = '{}'.format(feature[name_field])
-                        labelpart = kmlgeom.newpoint(coords=[(centroid.x(), centroid.y())], name=name)
+                        altitude = float(feature[altitude_field])
                     except Exception:
-                        pass
+                        altitude = 0
+                if group_by_subfolders:
+                    current_category = '{}'.format(feature[group_by_subfolders])
+                    if current_category == '':
+                        current_category = 'Uncategorized'
+                    if current_category != last_category:
+                        if parallel:
+                            pool.startFolder(current_category)
+                        elif streaming:
+                            if last_category is not None:
+                                kml.endFolder()
+                            kml.startFolder(current_category)
+                        else:
+                            folder = basefolder.newfolder(name=current_category)
+                        last_category = current_category
+                if streaming and not parallel:
+                    # Each feature is built in a folder of its own that is written and then dropped
+                    folder = simplekml.Folder()
+                if parallel:
+                    # The worker processes add the geometry to the placemark
+                    kml_item = Placemark()
+                elif geom.isMultipart() or (name_field and geomtype == QgsWkbTypes.PolygonGeometry and poly_hidden_point_label):
+                    kmlgeom = folder.newmultigeometry()
+                    kml_item = kmlgeom
+                else:
+                    kmlgeom = folder
+                    kml_item = None
+                if parallel:
+                    geometry = self.workerGeometry(
+                        geom, feature, name_field, poly_hidden_point_label, geomtype,
+                        default_alt_mode, alt_mode_field, extend_sides_to_ground, altitude, transform_crs)
+                elif geomtype == QgsWkbTypes.PointGeometry:  # POINTS
+                    # The vertices are read in bulk from the WKB rather than one QgsPoint at a time
+                    for (wkbtype, points) in self.featureGeometries(geom, transform_crs):
+                        kmlpart = kmlgeom.newpoint()
+                        self.setAltitudeMode(kmlpart, feature, default_alt_mode, alt_mode_field, extend_sides_to_ground)
+                        if kml_item is None:
+                            kml_item = kmlpart
+                        kmlpart.coords = kmlCoordinates(points, hasz, altitude, altitude_addend, precision)
+                elif geomtype == QgsWkbTypes.LineGeometry:  # LINES
+                    # feedback.pushInfo('geomtype {}'.format(geomtype))
+                    for (wkbtype, points) in self.featureGeometries(geom, transform_crs):
+                        kmlpart = kmlgeom.newlinestring()
+                        self.setAltitudeMode(kmlpart, feature, default_alt_mode, alt_mode_field, extend_sides_to_ground)
+                        if kml_item is None:
+                            kml_item = kmlpart
+                        kmlpart.coords = kmlCoordinates(points, hasz, altitude, altitude_addend, precision)
+                elif geomtype == QgsWkbTypes.PolygonGeometry:  # POLYGONS
+                    if name_field and poly_hidden_point_label:
+                        try:
+                            centroid = self.labelPoint(geom, transform_crs)
+                            name = '{}'.format(feature[name_field])
+                            labelpart = kmlgeom.newpoint(coords=labelCoordinates(centroid, precision), name=name)
+                        except Exception:
+                            pass
 
-                for part in geom.parts():
-                    kmlpart = kmlgeom.newpolygon()
-                    self.setAltitudeMode(kmlpart, feature, default_alt_mode, alt_mode_field, extend_sides_to_ground)
-                    if kml_item is None:
-                        kml_item = kmlpart
-                    num_interior_rings = part.numInteriorRings()
-                    ext_ring = part.exteriorRing()
-                    if isinstance(ext_ring, QgsCompoundCurve):
-                        ext_ring = ext_ring.curveToLine()
-                    # feedback.pushInfo('ext_ring type {}'.format(type(ext_ring)))
-                    
-                    if hasz:
-                        kmlpart.outerboundaryis = [(pt.x(), pt.y(), pt.z() + altitude_addend) for pt in ext_ring]
-                    else:
-                        kmlpart.outerboundaryis = [(pt.x(), pt.y(), altitude + altitude_addend) for pt in ext_ring]
-                    if num_interior_rings:
-                        ib = []
-                        for i in range(num_interior_rings):
-                            ring = part.interiorRing(i)
-                            if isinstance(ring, QgsCompoundCurve):
-                                ring = ring.curveToLine()
-                            if hasz:
-                                ib.append([(pt.x(), pt.y(), pt.z() + altitude_addend) for pt in ring])
-                            else:
-                                ib.append([(pt.x(), pt.y(), altitude + altitude_addend) for pt in ring])
-                        kmlpart.innerboundaryis = ib
+                    for (wkbtype, rings) in self.featureGeometries(geom, transform_crs):
+                        kmlpart = kmlgeom.newpolygon()
+                        self.setAltitudeMode(kmlpart, feature, default_alt_mode, alt_mode_field, extend_sides_to_ground)
+                        if kml_item is None:
+                            kml_item = kmlpart
+                        kmlpart.outerboundaryis = kmlCoordinates(rings[0], hasz, altitude, altitude_addend, precision)
+                        if len(rings) > 1:
+                            kmlpart.innerboundaryis = [
+                                kmlCoordinates(ring, hasz, altitude, altitude_addend, precision) for ring in rings[1:]]
 
-            # If we made it this far and export styles has been requested, there is a valid style and we
-            # attach it to kml_item.
-            if export_style:
-                kml_item.style = style
-            if name_field:
-                self.exportName(kml_item, feature[name_field])
+                # If we made it this far and export styles has been requested, there is a valid style and we
+                # attach it to kml_item.
+                if export_style:
+                    if parallel:
+                        # The style is written at the start of the document
+                        kml_item.styleurl = '#{}'.format(style.id)
+                    else:
+                        kml_item.style = style
+                if name_field:
+                    self.exportName(kml_item, feature[name_field])
 
-            if photo_path_field:
-                photo_path = feature[photo_path_field].strip()
-                if os.path.exists(photo_path):
-                    if not (photo_path in self.photos):
-                        local_path = kml.addfile(photo_path)
-                        self.photos[photo_path] = local_path
+                if photo_path_field:
+                    photo_path = feature[photo_path_field].strip()
+                    if os.path.exists(photo_path):
+                        if not (photo_path in self.photos):
+                            local_path = kml.addfile(photo_path)
+                            self.photos[photo_path] = local_path
+                    else:
+                        photo_path = None
                 else:
                     photo_path = None
-            else:
-                photo_path = None
                     
-            if desc_cnt == 1:
-                self.exportDescription(kml_item, feature[desc_fields[0]], photo_path)
-            elif desc_cnt > 1:
-                self.exportFields(kml_item, desc_fields, feature, add_line_breaks, photo_path)
+                if desc_cnt == 1:
+                    self.exportDescription(kml_item, feature[desc_fields[0]], photo_path)
+                elif desc_cnt > 1:
+                    self.exportFields(kml_item, desc_fields, feature, add_line_breaks, photo_path)
 
-            # Process the first date / time fields
-            date_time_str = self.parseDateTimeValues(
-                feature,
-                date_time_stamp_field,
-                date_stamp_field,
-                time_stamp_field)
-            if date_time_str:
-                kml_item.timestamp.when = date_time_str
-            date_time_str = self.parseDateTimeValues(
-                feature,
-                date_time_begin_field,
-                date_begin_field,
-                time_begin_field)
-            if date_time_str:
-                kml_item.timespan.begin = date_time_str
-            date_time_str = self.parseDateTimeValues(
-                feature,
-                date_time_end_field,
-                date_end_field,
-                time_end_field)
-            if date_time_str:
-                kml_item.timespan.end = date_time_str
+                # Process the first date / time fields
+                date_time_str = self.parseDateTimeValues(
+                    feature,
+                    date_time_stamp_field,
+                    date_stamp_field,
+                    time_stamp_field)
+                if date_time_str:
+                    kml_item.timestamp.when = date_time_str
+                date_time_str = self.parseDateTimeValues(
+                    feature,
+                    date_time_begin_field,
+                    date_begin_field,
+                    time_begin_field)
+                if date_time_str:
+                    kml_item.timespan.begin = date_time_str
+                date_time_str = self.parseDateTimeValues(
+                    feature,
+                    date_time_end_field,
+                    date_end_field,
+                    time_end_field)
+                if date_time_str:
+                    kml_item.timespan.end = date_time_str
+                if parallel:
+                    pool.add(kml_item, *geometry)
+                elif streaming:
+                    kml.writeFeatures(folder)
 
-            if cnt % 100 == 0:
-                feedback.setProgress(int(cnt * total))
-        if num_features == 0:
-            feedback.pushInfo('No features processed')
-        else:
-            kml.savekmz(filename)
+                if cnt % 100 == 0:
+                    feedback.setProgress(int(cnt * total))
+            if parallel:
+                pool.close()
+            if num_features == 0:
+                feedback.pushInfo('No features processed')
+                if streaming:
+                    kml.discard()
+            else:
+                if not streaming:
+                    # Write the document without the DOM based pretty printing of savekmz
+                    writer = KmzWriter(filename, indent)
+                    writer.writeKml(kml)
+                    kml = writer
+                kml.close()
+                feedback.pushInfo('{} features exported in {:.1f} seconds'.format(num_features, time.time() - start_time))
+        except Exception:
+            # Remove the partly written KMZ rather than leave it behind
+            if writer is not None:
+                writer.discard()
+            raise
+        finally:
+            if executor is not None:
+                # After a failure the chunks still waiting are canceled rather than converted
+                if pool is not None:
+                    pool.cancel()
+                executor.shutdown()
 
         self.cleanup()
 
         return({})
 
+    def startWorkers(self, workers):
+        '''Return the pool of worker processes or None if they cannot be started.'''
+        executable = pythonExecutable()
+        if executable is None:
+            self.feedback.pushInfo('The Python interpreter was not found so the features are exported without worker processes')
+            return(None)
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            ctx.set_executable(executable)
+            return(ProcessPoolExecutor(max_workers=workers, mp_context=ctx))
+        except Exception:
+            self.feedback.pushInfo('The worker processes could not be started so the features are exported without them')
+            return(None)
+
     def getFeatureStyle(self, feature, export_style, geomtype):
         # self.feedback.pushInfo(' ')
         # self.feedback.pushInfo('getFeatureStyle')
@@ -940,19 +1085,77 @@ class ExportKmzAlgorithm(QgsProcessingAlgorithm):
         kml_item.description = str
 
     def setAltitudeMode(self, kml_item, f, alt_mode, mode_field, extend_sides_to_ground):
+        if extend_sides_to_ground:
+            kml_item.extrude = 1
+        mode = self.altitudeMode(f, alt_mode, mode_field)
+        if mode:
+            kml_item.altitudemode = mode
+
+    def altitudeMode(self, f, alt_mode, mode_field):
+        '''Return the altitude mode of feature f or None if it has none.'''
         try:
             mode = None
-            if extend_sides_to_ground:
-                kml_item.extrude = 1
             if mode_field:
                 mode = f[mode_field]
-            if mode not in ALTITUDE_MODES and alt_mode:
-                kml_item.altitudemode = alt_mode
-                return
             if mode in ALTITUDE_MODES:
-                kml_item.altitudemode = mode
+                return(mode)
         except Exception:
-            return
+            return(None)
+        return(alt_mode if alt_mode else None)
+
+    def workerGeometry(self, geom, f, name_field, poly_hidden_point_label, geomtype, alt_mode, mode_field, extend_sides_to_ground, altitude, crs):
+        '''Return the geometry arguments of PlacemarkPool.add. The worker processes
+        convert them to the same KML as is created above for the geometry.'''
+        label = None
+        if name_field and geomtype == QgsWkbTypes.PolygonGeometry and poly_hidden_point_label:
+            multi = True
+            try:
+                label = (self.labelPoint(geom, crs), '{}'.format(f[name_field]))
+            except Exception:
+                pass
+        else:
+            multi = geom.isMultipart()
+        extrude = 1 if extend_sides_to_ground else None
+        mode = self.altitudeMode(f, alt_mode, mode_field)
+        return((self.geometryWkb(geom), multi, label, extrude, mode, altitude))
+
+    def geometryWkb(self, geom):
+        '''Return the WKB of geom with any curves converted to line segments.'''
+        if QgsWkbTypes.isCurvedType(geom.wkbType()):
+            geom.convertToStraightSegment()
+        return(bytes(geom.asWkb()))
+
+    def bulkTransformCrs(self, crs):
+        '''Return the definition of crs used to transform the coordinates read from the
+        WKB to WGS 84 with pyproj, or None if each geometry is transformed by QGIS. QGIS
+        is used when NumPy or pyproj is not installed and when the project sets its own
+        coordinate operation for crs, since pyproj would not use that operation.'''
+        if not HAS_NUMPY or not HAS_PYPROJ:
+            return(None)
+        if QgsProject.instance().transformContext().calculateCoordinateOperation(crs, self.epsg4326):
+            return(None)
+        authid = crs.authid()
+        definition = authid if authid.startswith('EPSG:') else crs.toWkt()
+        try:
+            wgs84Transformer(definition)
+        except Exception:
+            return(None)
+        return(definition)
+
+    def featureGeometries(self, geom, crs):
+        '''Return the wkbGeometries of geom with the coordinates transformed from the
+        CRS definition crs to WGS 84 unless it is None.'''
+        geometries = wkbGeometries(self.geometryWkb(geom))
+        if crs is not None:
+            transformGeometries(crs, [geometries])
+        return(geometries)
+
+    def labelPoint(self, geom, crs):
+        '''Return the x and y of the centroid of geom in WGS 84.'''
+        centroid = geom.centroid().asPoint()
+        if crs is None:
+            return((centroid.x(), centroid.y()))
+        return(wgs84Transformer(crs).transform(centroid.x(), centroid.y()))
 
     def parseDateTimeValues(self, feature, dt_field, date_field, time_field):
         if dt_field is None and date_field is None:
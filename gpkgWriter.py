@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import struct
+import sqlite3
+from qgis.PyQt.QtCore import QVariant, QDateTime
+from qgis.core import QgsWkbTypes
+
+# 'GPKG' and version 1.2 of the GeoPackage specification
+APPLICATION_ID = 1196444487
+USER_VERSION = 10200
+SRS_ID = 4326
+WGS84_WKT = (
+    'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,'
+    'AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,'
+    'AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],'
+    'AXIS["Latitude",NORTH],AXIS["Longitude",EAST],AUTHORITY["EPSG","4326"]]')
+GEOMETRY_COLUMN = 'geom'
+FID_COLUMN = 'fid'
+
+COLUMN_TYPES = {
+    QVariant.String: 'TEXT',
+    QVariant.Int: 'MEDIUMINT',
+    QVariant.LongLong: 'INTEGER',
+    QVariant.Double: 'REAL',
+    QVariant.Bool: 'BOOLEAN',
+    QVariant.DateTime: 'DATETIME'
+}
+
+# Little endian GeoPackage geometry headers without and with an xy envelope
+HEADER = struct.Struct('<2sBBi')
+HEADER_ENVELOPE = struct.Struct('<2sBBi4d')
+FLAG_LITTLE_ENDIAN = 1
+FLAG_ENVELOPE_XY = 2
+FLAG_EMPTY = 16
+
+CREATE_METADATA = [
+    '''CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER NOT NULL PRIMARY KEY,
+        organization TEXT NOT NULL, organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL,
+        description TEXT)''',
+    '''CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL,
+        identifier TEXT UNIQUE, description TEXT DEFAULT '',
+        last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))''',
+    '''CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL,
+        geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT uk_gc_table_name UNIQUE (table_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))''',
+    '''CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL,
+        definition TEXT NOT NULL, scope TEXT NOT NULL,
+        CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))'''
+]
+
+# The triggers that keep the spatial index up to date when the layer is edited later
+RTREE_TRIGGERS = [
+    '''CREATE TRIGGER "rtree_{t}_{c}_insert" AFTER INSERT ON "{t}"
+        WHEN (new."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN
+            INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}",
+                ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}"));
+        END''',
+    '''CREATE TRIGGER "rtree_{t}_{c}_update1" AFTER UPDATE OF "{c}" ON "{t}"
+        WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN
+            INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}",
+                ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}"));
+        END''',
+    '''CREATE TRIGGER "rtree_{t}_{c}_update2" AFTER UPDATE OF "{c}" ON "{t}"
+        WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" IS NULL OR ST_IsEmpty(NEW."{c}"))
+        BEGIN
+            DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+        END''',
+    '''CREATE TRIGGER "rtree_{t}_{c}_update3" AFTER UPDATE ON "{t}"
+        WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+        BEGIN
+            DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+            INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (NEW."{i}",
+                ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}"));
+        END''',
+    '''CREATE TRIGGER "rtree_{t}_{c}_update4" AFTER UPDATE ON "{t}"
+        WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" IS NULL OR ST_IsEmpty(NEW."{c}"))
+        BEGIN
+            DELETE FROM "rtree_{t}_{c}" WHERE id IN (OLD."{i}", NEW."{i}");
+        END''',
+    '''CREATE TRIGGER "rtree_{t}_{c}_delete" AFTER DELETE ON "{t}"
+        WHEN old."{c}" NOT NULL
+        BEGIN
+            DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+        END'''
+]
+
+def quote(name):
+    return('"' + name.replace('"', '""') + '"')
+
+def sqlValue(value):
+    '''Return an attribute value as a value sqlite can store.'''
+    if isinstance(value, QVariant):
+        # NULL
+        return(None)
+    if isinstance(value, QDateTime):
+        if not value.isValid():
+            return(None)
+        return(value.toUTC().toString('yyyy-MM-ddTHH:mm:ss.zzzZ'))
+    return(value)
+
+class GpkgDatabase():
+    '''Writes layers directly into a new GeoPackage file. All of the inserts are made
+    in a single transaction and the spatial indexes are built when the file is closed.'''
+    def __init__(self, filename):
+        self.filename = filename
+        if os.path.exists(filename):
+            os.remove(filename)
+        self.db = sqlite3.connect(filename, isolation_level=None)
+        self.layers = []
+        try:
+            self.db.execute('PRAGMA application_id = {}'.format(APPLICATION_ID))
+            self.db.execute('PRAGMA user_version = {}'.format(USER_VERSION))
+            self.db.execute('BEGIN')
+            for sql in CREATE_METADATA:
+                self.db.execute(sql)
+            self.db.executemany(
+                'INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', [
+                    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+                    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+                    ('WGS 84 geodetic', SRS_ID, 'EPSG', SRS_ID, WGS84_WKT, 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid')])
+        except Exception:
+            self.discard()
+            raise
+
+    def createLayer(self, name, fields, wkbType):
+        '''Create a layer with the QgsFields fields and return its GpkgLayer.'''
+        tables = set([layer.table.lower() for layer in self.layers])
+        table = name
+        n = 2
+        while table.lower() in tables:
+            table = '{}_{}'.format(name, n)
+            n += 1
+        layer = GpkgLayer(self.db, table, fields, wkbType)
+        self.layers.append(layer)
+        return(layer)
+
+    def close(self):
+        '''Build the spatial indexes, commit the features and close the file. The file
+        is removed if this fails.'''
+        try:
+            for layer in self.layers:
+                layer.finish()
+            self.db.execute('COMMIT')
+        except Exception:
+            self.discard()
+            raise
+        self.db.close()
+
+    def discard(self):
+        '''Roll back the features, close and remove the file. This is also used after
+        a write failed so errors are ignored.'''
+        try:
+            self.db.execute('ROLLBACK')
+        except sqlite3.Error:
+            pass
+        try:
+            self.db.close()
+        except sqlite3.Error:
+            pass
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+        self.layers = []
+
+class GpkgLayer():
+    '''A feature table of a GpkgDatabase. The bounding boxes of the features are kept
+    in a temporary table and copied into the spatial index by finish().'''
+    def __init__(self, db, table, fields, wkbType):
+        self.db = db
+        self.table = table
+        self.count = 0
+        self.multi = QgsWkbTypes.isMultiType(wkbType)
+        # Column names are unique without regard to case and may not be the fid or geometry
+        used = set([FID_COLUMN, GEOMETRY_COLUMN])
+        columns = []
+        for field in fields:
+            column = field.name()
+            n = 2
+            while column.lower() in used:
+                column = '{}_{}'.format(field.name(), n)
+                n += 1
+            used.add(column.lower())
+            columns.append('{} {}'.format(quote(column), COLUMN_TYPES.get(field.type(), 'TEXT')))
+        geometry_type = QgsWkbTypes.displayString(QgsWkbTypes.flatType(wkbType)).upper()
+        # Like GDAL, points are written without an envelope in their header
+        self.envelope = geometry_type != 'POINT'
+        db.execute('CREATE TABLE {} ({} INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, {} {}{})'.format(
+            quote(table), FID_COLUMN, GEOMETRY_COLUMN, geometry_type,
+            ''.join([', ' + column for column in columns])))
+        db.execute(
+            "INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, 'features', ?, ?)",
+            (table, table, SRS_ID))
+        db.execute(
+            'INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)',
+            (table, GEOMETRY_COLUMN, geometry_type, SRS_ID,
+                int(QgsWkbTypes.hasZ(wkbType)), int(QgsWkbTypes.hasM(wkbType))))
+        self.bounds = 'temp.{}'.format(quote('bounds_' + table))
+        db.execute('CREATE TABLE {} (id INTEGER PRIMARY KEY, minx, maxx, miny, maxy)'.format(self.bounds))
+        self.insert = 'INSERT INTO {} VALUES ({})'.format(quote(table), ', '.join(['?'] * (len(columns) + 2)))
+        self.insertBounds = 'INSERT INTO {} VALUES (?, ?, ?, ?, ?)'.format(self.bounds)
+
+    def addFeatures(self, features):
+        rows = []
+        bounds = []
+        for feature in features:
+            self.count += 1
+            geom = feature.geometry()
+            if self.multi:
+                geom.convertToMultiType()
+            wkb = bytes(geom.asWkb())
+            if geom.isEmpty():
+                blob = HEADER.pack(b'GP', 0, FLAG_LITTLE_ENDIAN | FLAG_EMPTY, SRS_ID) + wkb
+            else:
+                box = geom.boundingBox()
+                (xmin, xmax, ymin, ymax) = (box.xMinimum(), box.xMaximum(), box.yMinimum(), box.yMaximum())
+                if self.envelope:
+                    blob = HEADER_ENVELOPE.pack(
+                        b'GP', 0, FLAG_LITTLE_ENDIAN | FLAG_ENVELOPE_XY, SRS_ID,
+                        xmin, xmax, ymin, ymax) + wkb
+                else:
+                    blob = HEADER.pack(b'GP', 0, FLAG_LITTLE_ENDIAN, SRS_ID) + wkb
+                bounds.append((self.count, xmin, xmax, ymin, ymax))
+            rows.append([self.count, blob] + [sqlValue(value) for value in feature.attributes()])
+        self.db.executemany(self.insert, rows)
+        self.db.executemany(self.insertBounds, bounds)
+        return(True)
+
+    def finish(self):
+        '''Build the spatial index and record the extent of the layer.'''
+        t = self.table
+        rtree = quote('rtree_{}_{}'.format(t, GEOMETRY_COLUMN))
+        self.db.execute('CREATE VIRTUAL TABLE {} USING rtree(id, minx, maxx, miny, maxy)'.format(rtree))
+        self.db.execute('INSERT INTO {} SELECT * FROM {}'.format(rtree, self.bounds))
+        extent = self.db.execute('SELECT min(minx), min(miny), max(maxx), max(maxy) FROM {}'.format(self.bounds)).fetchone()
+        self.db.execute('DROP TABLE {}'.format(self.bounds))
+        for sql in RTREE_TRIGGERS:
+            self.db.execute(sql.format(t=t.replace('"', '""'), c=GEOMETRY_COLUMN, i=FID_COLUMN))
+        self.db.execute(
+            "INSERT INTO gpkg_extensions VALUES (?, ?, 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')",
+            (t, GEOMETRY_COLUMN))
+        self.db.execute(
+            'UPDATE gpkg_contents SET min_x = ?, min_y = ?, max_x = ?, max_y = ? WHERE table_name = ?',
+            tuple(extent) + (t,))
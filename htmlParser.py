@@ -124,8 +124,9 @@ class MyHTMLParser(HTMLParser):
         self.inTD = False
         self.col = -1
         self.mapping = {}
-        self.buffer1 = ""
-        self.buffer2 = ""
+        # Table cell text is collected as a list of chunks and joined at the end of the row
+        self.buffer1 = []
+        self.buffer2 = []
         self.mode = 0
 
     def clearData(self):
@@ -173,8 +174,8 @@ class MyHTMLParser(HTMLParser):
         elif tag == 'tr':
             self.inTR = True
             self.col = -1
-            self.buffer1 = ""
-            self.buffer2 = ""
+            self.buffer1 = []
+            self.buffer2 = []
         elif tag == 'th' or tag == 'td':
             self.col += 1
             self.inTD = True
@@ -184,17 +185,19 @@ class MyHTMLParser(HTMLParser):
         if tag == 'table':
             self.inTable = False
         elif tag == 'tr' and self.col >= 1:
+            name = ''.join(self.buffer1)
+            value = ''.join(self.buffer2)
             if self.mode == 0:
-                if self.buffer1 in self.tableFields:
-                    if self.buffer2 != '':
-                        self.tableFields[self.buffer1] += 1
+                if name in self.tableFields:
+                    if value != '':
+                        self.tableFields[name] += 1
                 else:
-                    if self.buffer2 != '':
-                        self.tableFields[self.buffer1] = 1
+                    if value != '':
+                        self.tableFields[name] = 1
                     else:
-                        self.tableFields[self.buffer1] = 0
+                        self.tableFields[name] = 0
             else:
-                self.tableFields[self.buffer1] = self.buffer2
+                self.tableFields[name] = value
 
             self.col = -1
             self.inTR = False
@@ -206,6 +209,6 @@ class MyHTMLParser(HTMLParser):
         if self.inTable:
             if self.inTD:
                 if self.col == 0:
-                    self.buffer1 += data.strip()
+                    self.buffer1.append(data.strip())
                 elif self.col == 1:
-                    self.buffer2 += data.strip()
+                    self.buffer2.append(data.strip())
@@ -12,6 +12,11 @@
 
 import os
 import re
+import pickle
+import tempfile
+import math
+from functools import partial
+import time
 from qgis.PyQt.QtCore import QObject, QVariant, QCoreApplication, QUrl, pyqtSignal
 from qgis.PyQt.QtGui import QIcon
 
@@ -23,15 +28,50 @@ from qgis.core import (
 from qgis.core import (
     QgsProcessingAlgorithm,
     QgsProcessingParameterFile,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterExtent,
+    QgsProcessingParameterString,
+    QgsProcessingParameterDefinition,
     QgsProcessingException,
+    QgsProcessingContext,
+    QgsProcessingOutputLayerDefinition,
     QgsProcessingParameterFeatureSink)
 
-from zipfile import ZipFile
-import xml.sax
+from .kmlReader import KmlSource, ImportCanceled, peakMemory
+from .kmlNetworkLinks import NetworkLinkResolver
+from .kmlCache import ParseCache, SPOOL_NAMES
+from .kmlFieldTypes import (
+    FieldTypes, FIELD_TYPE_MODES, TYPES_TEXT, converters, fieldType, mergeTypes)
+from .kmlStyles import StyleIndex, StyleReader, StyleRenderer, STYLE_FIELDS, NUMERIC_STYLE_FIELDS
+from .settings import settings
+from .gpkgWriter import GpkgDatabase
+from .kmlParser import parseKml, PARSER_BACKENDS, EXPAT_BACKEND, LXML_BACKEND, HAS_LXML
+from .kmlArrays import (
+    parseTime, coordArrays, CoordinateBuffer, TrackBuffer, trackCoordArrays, trackTimeArray,
+    timeString, timeStrings, pointZMWkb, resize, TRACK_CHUNK_SIZE)
 import xml.sax.handler
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
 # import traceback
 
 epsg4326 = QgsCoordinateReferenceSystem("EPSG:4326")
+# Number of attributes preceding the ExtendedData attributes in every output feature
+BASE_FIELD_COUNT = 8
+# Geometry types of the placemark output layers when the simplest types are not used
+DEFAULT_WKB_TYPES = {
+    'points': QgsWkbTypes.PointZ,
+    'lines': QgsWkbTypes.MultiLineStringZ,
+    'polygons': QgsWkbTypes.MultiPolygonZ,
+    'tracks': QgsWkbTypes.LineStringZM,
+    'trackPoints': QgsWkbTypes.PointZM
+}
+# Overlay elements imported into the overlay footprint layer
+OVERLAY_TYPES = ('GroundOverlay', 'ScreenOverlay', 'PhotoOverlay')
 
 def tr(string):
     return QCoreApplication.translate('Processing', string)
@@ -44,6 +84,24 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
     PrmPointOutputLayer = 'PointOutputLayer'
     PrmLineOutputLayer = 'LineOutputLayer'
     PrmPolygonOutputLayer = 'PolygonOutputLayer'
+    PrmTrackOutputLayer = 'TrackOutputLayer'
+    PrmTrackPointOutputLayer = 'TrackPointOutputLayer'
+    PrmOverlayOutputLayer = 'OverlayOutputLayer'
+    PrmSinglePass = 'SinglePass'
+    PrmImportAllKml = 'ImportAllKml'
+    PrmBatchSize = 'BatchSize'
+    PrmParser = 'Parser'
+    PrmExtent = 'Extent'
+    PrmFolderFilter = 'FolderFilter'
+    PrmTimeStart = 'TimeStart'
+    PrmTimeEnd = 'TimeEnd'
+    PrmNetworkLinkDepth = 'NetworkLinkDepth'
+    PrmUseCache = 'UseCache'
+    PrmCacheImport = 'CacheImport'
+    PrmStyles = 'Styles'
+    PrmFieldTypes = 'FieldTypes'
+    PrmDirectGpkg = 'DirectGpkg'
+    PrmGeometryTypes = 'SimplestGeometryTypes'
 
     def initAlgorithm(self, config):
         self.addParameter(
@@ -51,6 +109,39 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
                 self.PrmInput,
                 tr('Import KML/KMZ file (*.kml, *.txt, or *.kmz)'))
         )
+        self.addParameter(
+            QgsProcessingParameterExtent(
+                self.PrmExtent,
+                tr('Only import features within this extent'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.PrmFolderFilter,
+                tr('Only import features whose folder path matches this regular expression'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.PrmTimeStart,
+                tr('Only import features with a time on or after (e.g. 2020-01-31 or 2020-01-31T12:00:00Z)'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterString(
+                self.PrmTimeEnd,
+                tr('Only import features with a time on or before (e.g. 2020-12-31 or 2020-12-31T12:00:00Z)'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.PrmStyles,
+                tr('Placemark styles'),
+                options=[tr('Do not import styles'), tr('Import style attributes'),
+                    tr('Import style attributes and apply a categorized style')],
+                defaultValue=0,
+                optional=True)
+        )
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.PrmPointOutputLayer,
@@ -69,6 +160,103 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
                 tr('Output polygon layer'),
                 optional=True)
         )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmTrackOutputLayer,
+                tr('Output track layer (gx:Track as lines with time as M values)'),
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmTrackPointOutputLayer,
+                tr('Output track point layer (a point for each gx:Track position)'),
+                createByDefault=False,
+                optional=True)
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.PrmOverlayOutputLayer,
+                tr('Output overlay footprint layer (GroundOverlay, ScreenOverlay and PhotoOverlay)'),
+                createByDefault=False,
+                optional=True)
+        )
+        param = QgsProcessingParameterBoolean(
+            self.PrmSinglePass,
+            tr('Single pass import (buffer features until the ExtendedData fields are known)'),
+            False,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.PrmGeometryTypes,
+            tr('Use the simplest geometry types (2D when all altitudes are 0, single part when there are no multi-part placemarks)'),
+            False,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.PrmImportAllKml,
+            tr('Import all KML documents within a KMZ file (not just doc.kml)'),
+            False,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.PrmBatchSize,
+            tr('Number of features written to the output layers at a time'),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=1000,
+            minValue=1,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.PrmParser,
+            tr('XML parser'),
+            options=[tr(item) for item in PARSER_BACKENDS],
+            defaultValue=EXPAT_BACKEND,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterEnum(
+            self.PrmFieldTypes,
+            tr('ExtendedData field types'),
+            options=[tr(item) for item in FIELD_TYPE_MODES],
+            defaultValue=TYPES_TEXT,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterNumber(
+            self.PrmNetworkLinkDepth,
+            tr('Import NetworkLinks to local KML/KMZ files up to this many links deep (0 = do not import)'),
+            QgsProcessingParameterNumber.Integer,
+            defaultValue=0,
+            minValue=0,
+            maxValue=100,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.PrmUseCache,
+            tr('Cache the features of linked KML/KMZ files so unchanged files are not parsed again'),
+            True,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.PrmCacheImport,
+            tr('Cache the imported features so a later import of the unchanged file is copied from the cache'),
+            False,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
+        param = QgsProcessingParameterBoolean(
+            self.PrmDirectGpkg,
+            tr('Write GeoPackage outputs directly in a single transaction and build the spatial index at the end'),
+            False,
+            optional=True)
+        param.setFlags(param.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+        self.addParameter(param)
 
     def processAlgorithm(self, parameters, context, feedback):
         self.parameters = parameters
@@ -76,32 +264,13 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
         filename = self.parameterAsFile(parameters, self.PrmInput, context)
         f, extension = os.path.splitext(filename)
         extension = extension.lower()
-        kmz_doc_file = 'doc.kml'
+        if extension not in ('.kmz', '.kml', '.txt'):
+            msg = "Invalid extension: Should be *.kml, *.txt, or *.kmz."
+            feedback.reportError(msg)
+            raise QgsProcessingException(msg)
+        import_all = self.parameterAsInt(parameters, self.PrmImportAllKml, context)
         try:
-            if extension == '.kmz':
-                kmz = ZipFile(filename, 'r')
-                try:
-                    kml = kmz.open(kmz_doc_file, 'r')
-                except Exception:
-                    # there was not a doc.kml file, lets see if there another kml file
-                    files = kmz.namelist()
-                    kmz_doc_file = None
-                    for f in files:
-                        if f.endswith('.kml'):
-                            kmz_doc_file = f
-                            break
-                    if kmz_doc_file:
-                        kml = kmz.open(kmz_doc_file, 'r')
-                    else:
-                        msg = "Couldn't find kml document in kmz file"
-                        raise QgsProcessingException(msg)
-                       
-            elif extension == '.kml' or extension == '.txt':
-                kml = open(filename, encoding="utf-8", errors="backslashreplace")
-            else:
-                msg = "Invalid extension: Should be *.kml, *.txt, or *.kmz."
-                feedback.reportError(msg)
-                raise QgsProcessingException(msg)
+            source = KmlSource(filename, import_all)
         except Exception:
             msg = "Failed to open file."
             raise QgsProcessingException(msg)
@@ -109,62 +278,112 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
         skipPt = True if self.PrmPointOutputLayer not in parameters or parameters[self.PrmPointOutputLayer] is None else False
         skipline = True if self.PrmLineOutputLayer not in parameters or parameters[self.PrmLineOutputLayer] is None else False
         skipPoly = True if self.PrmPolygonOutputLayer not in parameters or parameters[self.PrmPolygonOutputLayer] is None else False
+        skipTrack = True if self.PrmTrackOutputLayer not in parameters or parameters[self.PrmTrackOutputLayer] is None else False
+        skipTrackPt = True if self.PrmTrackPointOutputLayer not in parameters or parameters[self.PrmTrackPointOutputLayer] is None else False
+        skipOverlay = True if self.PrmOverlayOutputLayer not in parameters or parameters[self.PrmOverlayOutputLayer] is None else False
         self.cntPt = 0
         self.cntLine = 0
         self.cntPoly = 0
-        parser = xml.sax.make_parser()
-        # Do a pre-pass through the KML to see if there are any extended data fields
-        preprocess = PreProcessHandler()
-        parser.setContentHandler(preprocess)
-        try:
-            input_source = xml.sax.xmlreader.InputSource()
-            input_source.setByteStream(kml)
-            input_source.setEncoding('utf-8')
-            parser.parse(input_source)
-        except Exception:
-            preprocess.endDocument()
-        # Reset the KML/KMZ file to the beginning. The handler seems to automatically close the file
-        # which is why we are reopening it.
-        if extension == '.kmz':
-            kmz.close()
-        else:
-            kml.close()
-        if extension == '.kmz':
-            kmz = ZipFile(filename, 'r')
-            kml = kmz.open(kmz_doc_file, 'r')
-        else:
-            kml = open(filename, encoding="utf-8", errors="backslashreplace")
-
-        # Set up the handler for doing the main processing
-        self.extData = preprocess.getExtendedDataFields()
-        self.extData.sort()
-        self.extDataMap = {}
-        index = 0
-        for item in self.extData:
-            self.extDataMap[item] = index
-            index += 1
-        handler = PlacemarkHandler(skipPt, skipline, skipPoly, self.extDataMap, feedback)
-        handler.addpoint.connect(self.addpoint)
-        handler.addline.connect(self.addline)
-        handler.addpolygon.connect(self.addpolygon)
-        parser.setContentHandler(handler)
+        self.cntTrack = 0
+        self.cntTrackPt = 0
+        self.cntOverlay = 0
+        self.fields = None
+        self.wkbTypes = dict(DEFAULT_WKB_TYPES)
+        self.dropZ = set()
+        self.directGpkg = self.parameterAsInt(parameters, self.PrmDirectGpkg, context)
+        self.gpkgDatabases = {}
+        self.writeTime = 0.0
+        single_pass = self.parameterAsInt(parameters, self.PrmSinglePass, context)
+        geometry_types = self.parameterAsInt(parameters, self.PrmGeometryTypes, context)
+        if geometry_types:
+            # The geometry types are known once every feature has been read so the
+            # features are buffered as in a single pass import.
+            single_pass = True
+        batch_size = self.parameterAsInt(parameters, self.PrmBatchSize, context)
+        if batch_size < 1:
+            batch_size = 1
+        backend = self.parameterAsEnum(parameters, self.PrmParser, context)
+        if backend == LXML_BACKEND and not HAS_LXML:
+            feedback.reportError(tr('lxml is not installed. The Expat parser will be used instead.'))
+            backend = EXPAT_BACKEND
+        filters = self.filters(parameters, context, feedback)
+        skip = (skipPt, skipline, skipPoly, skipTrack, skipTrackPt, skipOverlay)
+        style_mode = self.parameterAsEnum(parameters, self.PrmStyles, context)
+        styles = style_mode != 0
+        self.styleFields = []
+        if styles:
+            for item in STYLE_FIELDS:
+                self.styleFields.append(QgsField(item, QVariant.Double if item in NUMERIC_STYLE_FIELDS else QVariant.String))
+        field_mode = self.parameterAsEnum(parameters, self.PrmFieldTypes, context)
+        self.extTypes = {}
+        self.converters = None
+        self.conversionErrors = {}  # ExtendedData field name to the number of values set to NULL
+        # The import options that change the parsed features are part of the cache key
+        options = repr((skip, filters, styles, field_mode, geometry_types))
+        link_depth = self.parameterAsInt(parameters, self.PrmNetworkLinkDepth, context)
+        cache_import = self.parameterAsInt(parameters, self.PrmCacheImport, context)
+        cache_links = link_depth > 0 and self.parameterAsInt(parameters, self.PrmUseCache, context)
+        cache = None
+        if cache_import or cache_links:
+            cache_dir = settings.cacheDirectory()
+            try:
+                cache = ParseCache(cache_dir)
+            except OSError as e:
+                feedback.reportError(tr('Unable to use the cache folder {}: {}').format(cache_dir, e))
+        resolver = None
+        linked = []
+        if link_depth > 0:
+            resolver = NetworkLinkResolver(
+                partial(
+                    spoolKml, skip=skip, backend=backend, batchSize=batch_size, filters=filters,
+                    styles=styles, fieldTypes=field_mode, geometryTypes=geometry_types),
+                options, link_depth, cache if cache_links else None, feedback)
         try:
-            input_source = xml.sax.xmlreader.InputSource()
-            input_source.setByteStream(kml)
-            input_source.setEncoding('utf-8')
-            parser.parse(input_source)
+            if cache_import and cache:
+                result = self.cachedImport(
+                    source, cache, options, skip, backend, batch_size, filters, styles, field_mode, geometry_types, feedback)
+                networkLinks = result['links']
+                if resolver and not feedback.isCanceled():
+                    linked = resolver.resolve(source, networkLinks)
+                source.close()
+                self.extData = self.linkedFields(result['extData'], linked)
+                if field_mode != TYPES_TEXT:
+                    self.setFieldTypes(result['extTypes'], linked)
+                if geometry_types:
+                    self.setGeometryTypes(result['geometry'], linked, feedback)
+                hasGroundOverlay = self.copyResults([result] + linked, batch_size)
+            else:
+                (hasGroundOverlay, networkLinks, linked) = self.parseSource(
+                    source, skip, filters, styles, field_mode, single_pass, geometry_types, backend, batch_size,
+                    resolver, feedback)
+                hasGroundOverlay = self.copyResults(linked, batch_size) or hasGroundOverlay
+
+            self.closeOutputs(feedback)
         except Exception:
-            '''s = traceback.format_exc()
-            feedback.pushInfo(s)'''
-            feedback.pushInfo(tr('Failure in kml extraction - May return partial results.'))
-            handler.endDocument()
+            # Remove the partly written GeoPackages rather than leave them behind
+            self.discardOutputs()
+            raise
+        if resolver:
+            feedback.pushInfo('{} linked KML/KMZ documents imported ({} from the cache)'.format(len(linked), resolver.numCached))
+            for item in resolver.missing:
+                feedback.reportError(tr('Unable to open linked file: {}').format(item))
+            for item in resolver.cacheErrors:
+                feedback.reportError(tr('Unable to add a linked file to the import cache: {}').format(item))
+            if resolver.numRemote:
+                feedback.pushInfo(tr('{} NetworkLinks to remote files were not imported').format(resolver.numRemote))
+        elif networkLinks:
+            feedback.pushInfo(tr('NOTICE: This file has {} NetworkLinks. Increase the advanced NetworkLink depth parameter to import them.').format(len(networkLinks)))
+        for name, count in sorted(self.conversionErrors.items()):
+            feedback.reportError(tr('{} values of the ExtendedData field {} did not match its type and were set to NULL').format(count, name))
+        if cache:
+            removed = cache.evict(settings.cacheSize())
+            if removed:
+                feedback.pushInfo('{} old entries removed from the import cache'.format(removed))
+        peak = peakMemory()
+        if peak:
+            feedback.pushInfo(peak)
 
-        if extension == '.kmz':
-            kmz.close()
-        else:
-            kml.close()
-        
-        if handler.hasGoundOverlay:
+        if hasGroundOverlay:
             feedback.pushInfo(tr('NOTICE: This file may contain GroundOverlay images.'))
             feedback.pushInfo(tr('Run "Raster->KML Tools->Extract KML/KMZ Ground Overlasys" to extract them if embedded.'))
             feedback.pushInfo('')
@@ -172,6 +391,11 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
         feedback.pushInfo('{} points extracted'.format(self.cntPt))
         feedback.pushInfo('{} lines extracted'.format(self.cntLine))
         feedback.pushInfo('{} polygons extracted'.format(self.cntPoly))
+        if self.cntTrack or self.cntTrackPt:
+            feedback.pushInfo('{} tracks extracted'.format(self.cntTrack))
+            feedback.pushInfo('{} track points extracted'.format(self.cntTrackPt))
+        if self.cntOverlay:
+            feedback.pushInfo('{} overlays extracted'.format(self.cntOverlay))
 
         r = {}
         if self.cntPt > 0:
@@ -180,32 +404,350 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
             r[self.PrmLineOutputLayer] = self.dest_id_line
         if self.cntPoly > 0:
             r[self.PrmPolygonOutputLayer] = self.dest_id_poly
+        if self.cntTrack > 0:
+            r[self.PrmTrackOutputLayer] = self.dest_id_track
+        if self.cntTrackPt > 0:
+            r[self.PrmTrackPointOutputLayer] = self.dest_id_trackpt
+        if self.cntOverlay > 0:
+            r[self.PrmOverlayOutputLayer] = self.dest_id_overlay
+
+        if style_mode == 2:
+            for dest_id in r.values():
+                if context.willLoadLayerOnCompletion(dest_id):
+                    context.layerToLoadOnCompletionDetails(dest_id).setPostProcessor(StyleRenderer.create(dest_id))
 
         return (r)
 
-    def addpoint(self, feature):
-        if self.cntPt == 0:
-            f = QgsFields()
-            f.append(QgsField("name", QVariant.String))
-            f.append(QgsField("folders", QVariant.String))
-            f.append(QgsField("description", QVariant.String))
-            f.append(QgsField("altitude", QVariant.Double))
-            f.append(QgsField("alt_mode", QVariant.String))
-            f.append(QgsField("time_begin", QVariant.String))
-            f.append(QgsField("time_end", QVariant.String))
-            f.append(QgsField("time_when", QVariant.String))
+    def parseSource(self, source, skip, filters, styles, field_mode, single_pass, geometry_types, backend, batch_size,
+            resolver, feedback):
+        '''Parse the documents of source into the output layers. The ExtendedData fields
+        are either found by a pre-pass or, with single_pass, the features are buffered
+        until they are known. With geometry_types the simplest geometry types are found
+        while parsing. Return whether there are ground overlays, the NetworkLink hrefs
+        and the results of the linked documents.'''
+        (skipPt, skipLine, skipPoly, skipTrack, skipTrackPt, skipOverlay) = skip
+        linked = []
+        fieldTypes = FieldTypes(field_mode) if field_mode != TYPES_TEXT else None
+        if single_pass:
+            # The ExtendedData fields are collected while parsing and the features are
+            # buffered until the output layer schema is known.
+            self.extDataMap = {}
+            handler = PlacemarkHandler(
+                skipPt, skipLine, skipPoly, self.extDataMap, feedback, batch_size, lateBinding=True,
+                skipTrack=skipTrack, skipTrackPt=skipTrackPt, styles=StyleIndex() if styles else None,
+                fieldTypes=fieldTypes, skipOverlay=skipOverlay, geometryTypes=geometry_types)
+            self.spoolPt = FeatureSpool()
+            self.spoolLine = FeatureSpool()
+            self.spoolPoly = FeatureSpool()
+            self.spoolTrack = FeatureSpool()
+            self.spoolTrackPt = FeatureSpool()
+            handler.addpoints.connect(self.spoolPt.addFeatures)
+            handler.addlines.connect(self.spoolLine.addFeatures)
+            handler.addpolygons.connect(self.spoolPoly.addFeatures)
+            handler.addtracks.connect(self.spoolTrack.addFeatures)
+            handler.addtrackpointrecords.connect(self.spoolTrackPt.addRecords)
+        else:
+            # Do a pre-pass through the KML to see if there are any extended data fields.
+            # The parser closes the stream when it finishes so each pass gets a new one.
+            preprocess = PreProcessHandler(fieldTypes, StyleIndex() if styles else None)
+            source.setFeedback(feedback, 2)
+            for kml in source.streams(keep=True):
+                try:
+                    parseKml(kml, preprocess, backend)
+                except ImportCanceled:
+                    break
+                except Exception:
+                    preprocess.endDocument()
+
+            # The linked documents are imported first so their ExtendedData fields are known
+            if resolver:
+                linked = resolver.resolve(source, preprocess.networkLinks)
+
+            # Set up the handler for doing the main processing
+            self.extData = self.linkedFields(preprocess.getExtendedDataFields(), linked)
+            self.extDataMap = {}
+            index = 0
             for item in self.extData:
-                f.append(QgsField(item, QVariant.String))
-            (self.sinkPt, self.dest_id_pt) = self.parameterAsSink(
-                self.parameters,
-                self.PrmPointOutputLayer, self.context, f,
-                QgsWkbTypes.PointZ, epsg4326)
+                self.extDataMap[item] = index
+                index += 1
+            # The styles found by the pre-pass resolve the styles defined after their placemarks
+            handler = PlacemarkHandler(
+                skipPt, skipLine, skipPoly, self.extDataMap, feedback, batch_size,
+                skipTrack=skipTrack, skipTrackPt=skipTrackPt, styles=preprocess.styles,
+                skipOverlay=skipOverlay)
+            if fieldTypes is not None:
+                self.setFieldTypes(fieldTypes.types(), linked)
+                handler.setConverters(self.converters)
+            handler.addpoints.connect(self.addpoints)
+            handler.addlines.connect(self.addlines)
+            handler.addpolygons.connect(self.addpolygons)
+            handler.addtracks.connect(self.addtracks)
+            handler.addtrackpoints.connect(self.addtrackpoints)
+        # The overlay fields do not depend on the ExtendedData so they are written directly
+        handler.addoverlays.connect(self.addoverlays)
+        handler.setFilters(*filters)
+        if single_pass:
+            source.setFeedback(feedback)
+        for kml in source.streams():
+            try:
+                parseKml(kml, handler, backend)
+            except ImportCanceled:
+                feedback.pushInfo(tr('Import canceled - The features read so far are kept.'))
+                break
+            except Exception:
+                '''s = traceback.format_exc()
+                feedback.pushInfo(s)'''
+                feedback.pushInfo(tr('Failure in kml extraction - May return partial results.'))
+                handler.endDocument()
+            if feedback.isCanceled():
+                break
+        # Write out any features still waiting in a partial batch
+        handler.flush()
+        source.setFeedback(None)
+        if single_pass and resolver and not feedback.isCanceled():
+            linked = resolver.resolve(source, handler.networkLinks)
+        feedback.pushInfo(source.throughput())
+        source.close()
 
-        self.cntPt += 1
-        self.sinkPt.addFeature(feature)
+        if single_pass:
+            # The schema is now final so create the output layers and copy the buffered features.
+            feedback.setProgressText(tr('Writing the output layers'))
+            self.extData = self.linkedFields(self.extDataMap, linked)
+            if fieldTypes is not None:
+                self.setFieldTypes(fieldTypes.types(), linked)
+            if geometry_types:
+                self.setGeometryTypes(handler.geometryStats, linked, feedback)
+            order = [self.extData.index(item) for item in self.extDataMap]
+            extDataSize = len(self.extData)
+            lateStyles = handler.styles.lateAttributes() if handler.styles is not None else None
+            self.copySpool(self.spoolPt, order, self.addpoints, batch_size, extDataSize, styles=lateStyles)
+            self.copySpool(self.spoolLine, order, self.addlines, batch_size, extDataSize, styles=lateStyles)
+            self.copySpool(self.spoolPoly, order, self.addpolygons, batch_size, extDataSize, styles=lateStyles)
+            self.copySpool(self.spoolTrack, order, self.addtracks, batch_size, extDataSize, styles=lateStyles)
+            self.copySpool(self.spoolTrackPt, order, self.addtrackpoints, batch_size, extDataSize,
+                styles=lateStyles)
 
-    def addline(self, feature):
-        if self.cntLine == 0:
+        for name, count in handler.conversionErrors.items():
+            self.conversionErrors[name] = self.conversionErrors.get(name, 0) + count
+        return(handler.hasGoundOverlay, handler.networkLinks, linked)
+
+    def cachedImport(self, source, cache, options, skip, backend, batch_size, filters, styles, field_mode,
+            geometry_types, feedback):
+        '''Return the spoolKml result of source from the cache. If source is not in the
+        cache, then it is parsed and added to the cache unless parsing fails.'''
+        key = cache.key(source, options)
+        result = cache.get(key)
+        if result is not None:
+            feedback.pushInfo(tr('Features copied from the import cache'))
+            return(result)
+        source.setFeedback(feedback)
+        result = spoolKml(source, skip, backend, batch_size, filters, styles, field_mode, feedback, geometry_types)
+        source.setFeedback(None)
+        feedback.pushInfo(source.throughput())
+        if result['error']:
+            feedback.pushInfo(result['error'])
+            return(result)
+        try:
+            return(cache.put(key, result))
+        except OSError as e:
+            # The spools of the result were left in place so it is used uncached
+            feedback.reportError(tr('Unable to add the file to the import cache: {}').format(e))
+            return(result)
+
+    def filters(self, parameters, context, feedback):
+        '''Return the extent, compiled folder regular expression and start and end times
+        used to filter the placemarks. Each is None if it was not given.'''
+        extent = None
+        if self.PrmExtent in parameters and parameters[self.PrmExtent] is not None:
+            rect = self.parameterAsExtent(parameters, self.PrmExtent, context, epsg4326)
+            if not rect.isNull():
+                extent = (rect.xMinimum(), rect.yMinimum(), rect.xMaximum(), rect.yMaximum())
+        folder_regex = None
+        pattern = self.parameterAsString(parameters, self.PrmFolderFilter, context)
+        if pattern:
+            try:
+                folder_regex = re.compile(pattern)
+            except re.error:
+                msg = tr('Invalid folder regular expression: {}').format(pattern)
+                feedback.reportError(msg)
+                raise QgsProcessingException(msg)
+        times = []
+        for prm in (self.PrmTimeStart, self.PrmTimeEnd):
+            value = self.parameterAsString(parameters, prm, context).strip()
+            t = parseTime(value, prm == self.PrmTimeEnd)
+            if value and t is None:
+                msg = tr('Invalid time: {}').format(value)
+                feedback.reportError(msg)
+                raise QgsProcessingException(msg)
+            times.append(t)
+        return(extent, folder_regex, times[0], times[1])
+
+    def linkedFields(self, names, linked):
+        '''Return the sorted ExtendedData field names of the main document and the
+        results of its linked documents.'''
+        names = set(names)
+        for result in linked:
+            names.update(result['extData'])
+        return(sorted(names))
+
+    def setFieldTypes(self, types, linked):
+        '''Set the ExtendedData field types from the types of the main document and the
+        results of its linked documents and choose the converter of each field.'''
+        self.extTypes = dict(types)
+        for result in linked:
+            mergeTypes(self.extTypes, result['extTypes'])
+        self.converters = converters(self.extTypes, self.extData)
+
+    def setGeometryTypes(self, stats, linked, feedback):
+        '''Choose the geometry type of each output layer from the geometry statistics
+        of the main document and the results of its linked documents.'''
+        stats = {'z': set(stats['z']), 'multi': set(stats['multi'])}
+        for result in linked:
+            for key in ('z', 'multi'):
+                stats[key].update(result['geometry'][key])
+        self.wkbTypes = simplestWkbTypes(stats)
+        # The Z values of the features are removed when they are all 0
+        self.dropZ = set([name for name in SPOOL_NAMES if name not in stats['z']])
+        feedback.pushInfo('Geometry types: {}'.format(', '.join([
+            '{} {}'.format(name, QgsWkbTypes.displayString(self.wkbTypes[name])) for name in DEFAULT_WKB_TYPES])))
+
+    def copyResults(self, results, batch_size):
+        '''Copy the features of the spoolKml results into the output layers and return
+        True if any of them have ground overlays.'''
+        index = {}
+        for i, item in enumerate(self.extData):
+            index[item] = i
+        addfeatures = {
+            'points': self.addpoints,
+            'lines': self.addlines,
+            'polygons': self.addpolygons,
+            'tracks': self.addtracks,
+            'trackPoints': self.addtrackpoints
+        }
+        hasGroundOverlay = False
+        for result in results:
+            order = [index[item] for item in result['extData']]
+            # Cached spools belong to the cache and must not be removed
+            remove = not result.get('cached')
+            for name in SPOOL_NAMES:
+                (filename, count) = result[name]
+                spool = FeatureSpool(filename, count, remove=remove)
+                if name == 'overlays':
+                    self.copyOverlays(spool, batch_size)
+                else:
+                    self.copySpool(spool, order, addfeatures[name], batch_size, len(self.extData),
+                        styles=result.get('styles'))
+            if result['groundOverlay']:
+                hasGroundOverlay = True
+        return(hasGroundOverlay)
+
+    def copySpool(self, spool, order, addfeatures, batch_size, extDataSize=None, extra=[], styles=None):
+        '''Copy the buffered features into the output layer. ExtendedData attributes were
+        buffered in the order they were discovered and are moved here to their position
+        in the sorted output fields. An order of None drops the attribute. The values in
+        extra are inserted before the ExtendedData attributes. styles maps the style_id
+        of the features whose style was defined after them to their style attributes.'''
+        if extDataSize is None:
+            extDataSize = len(order)
+        # The style attributes stay with the standard attributes
+        base = BASE_FIELD_COUNT + len(self.styleFields)
+        if not self.styleFields:
+            styles = None
+        convert = self.converters
+        if convert is None:
+            empty = [''] * extDataSize
+        else:
+            empty = ['' if item is None else None for item in convert]
+        features = []
+        for feature in spool.features():
+            attr = feature.attributes()
+            if styles:
+                styleAttr = styles.get(attr[BASE_FIELD_COUNT])
+                if styleAttr is not None:
+                    attr[BASE_FIELD_COUNT:base] = styleAttr
+            extAttr = list(empty)
+            for index, value in enumerate(attr[base:]):
+                i = order[index]
+                if i is None:
+                    continue
+                if convert is None or convert[i] is None:
+                    extAttr[i] = value
+                elif value:
+                    extAttr[i] = convert[i](value)
+                    if extAttr[i] is None:
+                        name = self.extData[i]
+                        self.conversionErrors[name] = self.conversionErrors.get(name, 0) + 1
+            feature.setAttributes(attr[:base] + extra + extAttr)
+            features.append(feature)
+            if len(features) >= batch_size:
+                addfeatures(features)
+                features = []
+        if features:
+            addfeatures(features)
+        spool.close()
+
+    def copyOverlays(self, spool, batch_size):
+        '''Copy the buffered overlay footprints, which have no ExtendedData, into the
+        output layer.'''
+        features = []
+        for feature in spool.features():
+            features.append(feature)
+            if len(features) >= batch_size:
+                self.addoverlays(features)
+                features = []
+        if features:
+            self.addoverlays(features)
+        spool.close()
+
+    def createSink(self, name, fields, wkbType):
+        '''Return the sink and destination id of the output name. With the direct
+        GeoPackage option a .gpkg output file is written by a GpkgDatabase.'''
+        if self.directGpkg:
+            filename = self.parameterAsOutputLayer(self.parameters, name, self.context)
+            if filename and filename.lower().endswith('.gpkg'):
+                db = self.gpkgDatabases.get(filename)
+                if db is None:
+                    db = GpkgDatabase(filename)
+                    self.gpkgDatabases[filename] = db
+                layer = db.createLayer(os.path.splitext(os.path.basename(filename))[0], fields, wkbType)
+                dest_id = '{}|layername={}'.format(filename, layer.table)
+                definition = self.parameters.get(name)
+                if isinstance(definition, QgsProcessingOutputLayerDefinition) and definition.destinationProject:
+                    details = QgsProcessingContext.LayerDetails(
+                        definition.destinationName or self.parameterDefinition(name).description(),
+                        definition.destinationProject, name)
+                    self.context.addLayerToLoadOnCompletion(dest_id, details)
+                return(layer, dest_id)
+        return(self.parameterAsSink(self.parameters, name, self.context, fields, wkbType, epsg4326))
+
+    def writeFeatures(self, sink, features):
+        start = time.perf_counter()
+        sink.addFeatures(features)
+        self.writeTime += time.perf_counter() - start
+
+    def closeOutputs(self, feedback):
+        '''Finish the direct GeoPackage outputs and report the write throughput.'''
+        start = time.perf_counter()
+        for db in self.gpkgDatabases.values():
+            feedback.setProgressText(tr('Building the spatial index of {}').format(os.path.basename(db.filename)))
+            db.close()
+        self.gpkgDatabases = {}
+        self.writeTime += time.perf_counter() - start
+        total = self.cntPt + self.cntLine + self.cntPoly + self.cntTrack + self.cntTrackPt + self.cntOverlay
+        if total and self.writeTime > 0:
+            feedback.pushInfo('{} features written in {:.2f} seconds ({:.0f} features/sec)'.format(
+                total, self.writeTime, total / self.writeTime))
+
+    def discardOutputs(self):
+        '''Roll back and remove the direct GeoPackage outputs after the import failed.'''
+        for db in self.gpkgDatabases.values():
+            db.discard()
+        self.gpkgDatabases = {}
+
+    def placemarkFields(self):
+        '''Return the fields of the placemark output layers. They are built once the
+        ExtendedData fields are known and shared by all of the layers.'''
+        if self.fields is None:
             f = QgsFields()
             f.append(QgsField("name", QVariant.String))
             f.append(QgsField("folders", QVariant.String))
@@ -215,35 +757,71 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
             f.append(QgsField("time_begin", QVariant.String))
             f.append(QgsField("time_end", QVariant.String))
             f.append(QgsField("time_when", QVariant.String))
+            for field in self.styleFields:
+                f.append(field)
             for item in self.extData:
-                f.append(QgsField(item, QVariant.String))
-            (self.sinkLine, self.dest_id_line) = self.parameterAsSink(
-                self.parameters,
-                self.PrmLineOutputLayer, self.context, f,
-                QgsWkbTypes.MultiLineStringZ, epsg4326)
+                f.append(QgsField(item, fieldType(self.extTypes, item)))
+            self.fields = f
+        return(self.fields)
+
+    def addpoints(self, features):
+        if self.cntPt == 0:
+            (self.sinkPt, self.dest_id_pt) = self.createSink(self.PrmPointOutputLayer, self.placemarkFields(), self.wkbTypes['points'])
 
-        self.cntLine += 1
-        self.sinkLine.addFeature(feature)
+        if 'points' in self.dropZ:
+            dropZValues(features)
+        self.cntPt += len(features)
+        self.writeFeatures(self.sinkPt, features)
+
+    def addlines(self, features):
+        if self.cntLine == 0:
+            (self.sinkLine, self.dest_id_line) = self.createSink(self.PrmLineOutputLayer, self.placemarkFields(), self.wkbTypes['lines'])
 
-    def addpolygon(self, feature):
+        if 'lines' in self.dropZ:
+            dropZValues(features)
+        self.cntLine += len(features)
+        self.writeFeatures(self.sinkLine, features)
+
+    def addpolygons(self, features):
         if self.cntPoly == 0:
+            (self.sinkPoly, self.dest_id_poly) = self.createSink(self.PrmPolygonOutputLayer, self.placemarkFields(), self.wkbTypes['polygons'])
+        if 'polygons' in self.dropZ:
+            dropZValues(features)
+        self.cntPoly += len(features)
+        self.writeFeatures(self.sinkPoly, features)
+
+    def addtracks(self, features):
+        if self.cntTrack == 0:
+            (self.sinkTrack, self.dest_id_track) = self.createSink(self.PrmTrackOutputLayer, self.placemarkFields(), self.wkbTypes['tracks'])
+        if 'tracks' in self.dropZ:
+            dropZValues(features)
+        self.cntTrack += len(features)
+        self.writeFeatures(self.sinkTrack, features)
+
+    def addtrackpoints(self, features):
+        if self.cntTrackPt == 0:
+            (self.sinkTrackPt, self.dest_id_trackpt) = self.createSink(self.PrmTrackPointOutputLayer, self.placemarkFields(), self.wkbTypes['trackPoints'])
+        if 'trackPoints' in self.dropZ:
+            dropZValues(features)
+        self.cntTrackPt += len(features)
+        self.writeFeatures(self.sinkTrackPt, features)
+
+    def addoverlays(self, features):
+        if self.cntOverlay == 0:
             f = QgsFields()
             f.append(QgsField("name", QVariant.String))
             f.append(QgsField("folders", QVariant.String))
             f.append(QgsField("description", QVariant.String))
-            f.append(QgsField("altitude", QVariant.Double))
-            f.append(QgsField("alt_mode", QVariant.String))
+            f.append(QgsField("overlay_type", QVariant.String))
+            f.append(QgsField("href", QVariant.String))
+            f.append(QgsField("draw_order", QVariant.Int))
+            f.append(QgsField("rotation", QVariant.Double))
             f.append(QgsField("time_begin", QVariant.String))
             f.append(QgsField("time_end", QVariant.String))
             f.append(QgsField("time_when", QVariant.String))
-            for item in self.extData:
-                f.append(QgsField(item, QVariant.String))
-            (self.sinkPoly, self.dest_id_poly) = self.parameterAsSink(
-                self.parameters,
-                self.PrmPolygonOutputLayer, self.context, f,
-                QgsWkbTypes.MultiPolygonZ, epsg4326)
-        self.cntPoly += 1
-        self.sinkPoly.addFeature(feature)
+            (self.sinkOverlay, self.dest_id_overlay) = self.createSink(self.PrmOverlayOutputLayer, f, QgsWkbTypes.Polygon)
+        self.cntOverlay += len(features)
+        self.writeFeatures(self.sinkOverlay, features)
 
     def name(self):
         return 'importkml'
@@ -270,61 +848,99 @@ class ImportKmlAlgorithm(QgsProcessingAlgorithm):
         return ImportKmlAlgorithm()
 
 class PlacemarkHandler(xml.sax.handler.ContentHandler, QObject):
-    addpoint = pyqtSignal(QgsFeature)
-    addline = pyqtSignal(QgsFeature)
-    addpolygon = pyqtSignal(QgsFeature)
+    addpoints = pyqtSignal(list)
+    addlines = pyqtSignal(list)
+    addpolygons = pyqtSignal(list)
+    addtracks = pyqtSignal(list)
+    addtrackpoints = pyqtSignal(list)
+    # With late binding the track points are sent as (WKB, attributes) records for a spool
+    addtrackpointrecords = pyqtSignal(list)
+    addoverlays = pyqtSignal(list)
 
-    def __init__(self, skipPt, skipLine, skipPoly, extDataMap, feedback):
+    def __init__(self, skipPt, skipLine, skipPoly, extDataMap, feedback, batchSize=1000, lateBinding=False,
+            skipTrack=True, skipTrackPt=True, styles=None, fieldTypes=None, skipOverlay=True, geometryTypes=False):
         QObject.__init__(self)
         xml.sax.handler.ContentHandler.__init__(self)
         self.schema = {}
         self.skipPt = skipPt
         self.skipLine = skipLine
         self.skipPoly = skipPoly
+        self.skipTrack = skipTrack
+        self.skipTrackPt = skipTrackPt
+        self.skipOverlay = skipOverlay
+        # The names of the outputs with non-zero Z values or multi-part features if they are tracked
+        self.geometryStats = {'z': set(), 'multi': set()} if geometryTypes else None
         self.extDataMap = extDataMap
+        # With late binding new ExtendedData names are added to extDataMap as they are found
+        self.lateBinding = lateBinding
         self.feedback = feedback
         self.extDataSize = len(extDataMap)
+        # FieldTypes collecting the ExtendedData field types while parsing or None
+        self.fieldTypes = fieldTypes
+        # Functions converting the ExtendedData values to their field types
+        self.converters = None
+        self.conversionErrors = {}  # ExtendedData field name to the number of values set to NULL
         self.hasGoundOverlay = False
+        # StyleIndex used to add the style attributes or None
+        self.styles = styles
+        self.styleReader = None  # StyleReader of the current Style or StyleMap
+        self.inNetworkLink = False
+        self.networkLinks = []  # The href of each NetworkLink
+        # Features are sent to the output layers in batches
+        self.batchSize = batchSize
+        self.ptFeatures = []
+        self.lineFeatures = []
+        self.polyFeatures = []
+        self.trackFeatures = []
+        self.trackPtFeatures = []
+        self.overlayFeatures = []
+
+        self.factory = FeatureFactory()
 
         self.inPlacemark = False
+        self.setFilters()
         self.resetSettings()
+        self.initDispatch()
         self.folders = []
+        self.folderPath = ""  # The joined folders or None when they have changed
+
+    def setFilters(self, extent=None, folderRegex=None, timeStart=None, timeEnd=None):
+        '''Only import placemarks that intersect extent (xmin, ymin, xmax, ymax), whose folder
+        path matches the compiled folderRegex, and whose time overlaps timeStart to timeEnd.
+        The times are datetime values and either one may be None for an open ended window.'''
+        self.extent = extent
+        self.folderRegex = folderRegex
+        self.timeStart = timeStart
+        self.timeEnd = timeEnd
+        self.timeFilter = timeStart is not None or timeEnd is not None
 
     def resetSettings(self):
         '''Set all settings to a default new placemark.'''
         self.inFolder = False
-        self.inName = False
-        self.inDescription = False
-        self.inCoordinates = False
-        self.inLatitude = False
-        self.inLongitude = False
-        self.inAltitude = False
-        self.inAltitudeMode = False
         self.inLocation = False
         self.inOuterBoundary = False
         self.inInnerBoundary = False
         self.inTimeSpan = False
-        self.inBegin = False
-        self.inEnd = False
         self.inTimeStamp = False
-        self.inWhen = False
         self.inExtendedData = False
         self.inData = False
-        self.inSimpleData = False
-        self.inDataValue = False
-        self.inPoint = False
-        self.inLineString = False
         self.inPolygon = False
-        self.lineStrings = []  # List of QgsLineString
-        self.ptPts = []
+        # Geometry is kept as parsed coordinates until the placemark passes the filters
+        self.excluded = False
+        self.lineStrings = []  # List of (x, y, z) coordinate arrays
+        self.ptPts = []  # List of (lon, lat, altitude)
         self.ptAltitude = []
-        self.polygons = []
-        self.innerPoly = []
-        self.outerPoly = ""
+        self.polygons = []  # List of (outer ring, list of inner rings) coordinate arrays
+        self.inTrack = False
+        self.trackCoords = None  # TrackBuffer of the gx:coord values of the current track
+        self.trackWhens = None  # TrackBuffer of the when values of the current track
+        self.tracks = []  # List of (x, y, z, m) arrays
+        self.innerRings = []  # Coordinate arrays of the inner rings of the current polygon
+        self.outerRing = None
         self.folder = ""
         self.name = ""
         self.description = ""
-        self.coord = ""
+        self.coord = None  # CoordinateBuffer of the last coordinates outside of a polygon
         self.lon = ""
         self.lat = ""
         self.altitude = ""
@@ -335,20 +951,155 @@ class PlacemarkHandler(xml.sax.handler.ContentHandler, QObject):
         self.dataName = None
         self.dataValue = ""
         self.extendedData = {}
+        self.styleUrl = ""
+        self.inlineStyle = None
+        # An overlay is parsed like a placemark with these added values
+        self.overlayType = None
+        self.overlayValues = {}
+        self.inLatLonBox = False
+
+    def initDispatch(self):
+        '''Build the tables used to dispatch the SAX events. There is one table of start
+        element handlers for use outside of a Placemark and one for use within a Placemark.
+        Start handlers of elements with text content return the text state to be restored
+        when the element ends. The endText table is keyed by the current text target.'''
+        self.tags = {}  # Cache of the raw element name to its base name
+        self.stack = []  # Saved text state of each open element
+        self.textTarget = None
+        self.text = []  # Chunks of character data joined when the element ends
+        self.documentStart = {
+            'Folder': self.startFolder,
+            'name': self.startFolderName,
+            'Placemark': self.startPlacemark,
+            'GroundOverlay': self.startGroundOverlay,
+            'NetworkLink': self.startNetworkLink,
+            'href': self.startHref
+        }
+        self.placemarkStart = {
+            'Folder': self.startFolder,
+            'Placemark': self.startPlacemark,
+            'Polygon': self.startPolygon,
+            'Location': self.startLocation,
+            'gx:Track': self.startTrack,
+            'Track': self.startTrack,
+            'gx:coord': self.startTrackCoord,
+            'coord': self.startTrackCoord,
+            'name': self.startName,
+            'description': self.startDescription,
+            'coordinates': self.startCoordinates,
+            'outerBoundaryIs': self.startOuterBoundary,
+            'innerBoundaryIs': self.startInnerBoundary,
+            'TimeSpan': self.startTimeSpan,
+            'TimeStamp': self.startTimeStamp,
+            'begin': self.startBegin,
+            'end': self.startEnd,
+            'when': self.startWhen,
+            'longitude': self.startLongitude,
+            'latitude': self.startLatitude,
+            'altitude': self.startAltitude,
+            'altitudeMode': self.startAltitudeMode,
+            'Data': self.startData,
+            'SimpleData': self.startSimpleData,
+            'value': self.startValue,
+            'ExtendedData': self.startExtendedData
+        }
+        self.documentEnd = {
+            'Folder': self.endFolder,
+            'NetworkLink': self.endNetworkLink
+        }
+        self.placemarkEnd = {
+            'Point': self.endPoint,
+            'LineString': self.endLineString,
+            'Location': self.endLocation,
+            'Polygon': self.endPolygon,
+            'gx:Track': self.endTrack,
+            'Track': self.endTrack,
+            'outerBoundaryIs': self.endOuterBoundary,
+            'innerBoundaryIs': self.endInnerBoundary,
+            'TimeSpan': self.endTimeSpan,
+            'TimeStamp': self.endTimeStamp,
+            'Placemark': self.endPlacemark,
+            'Data': self.endData,
+            'ExtendedData': self.endExtendedData
+        }
+        self.endText = {
+            'folderName': self.endFolderName,
+            'name': self.endName,
+            'description': self.endDescription,
+            'coordinates': self.endCoordinates,
+            'longitude': self.endLongitude,
+            'latitude': self.endLatitude,
+            'altitude': self.endAltitude,
+            'begin': self.endBegin,
+            'end': self.endEnd,
+            'when': self.endWhen,
+            'altitudeMode': self.endAltitudeMode,
+            'simpleData': self.endSimpleData,
+            'value': self.endValue,
+            'href': self.endHref
+        }
+        if self.styles is not None:
+            for table in (self.documentStart, self.placemarkStart):
+                table['Style'] = self.startStyle
+                table['StyleMap'] = self.startStyleMap
+            self.placemarkStart['styleUrl'] = self.startStyleUrl
+            self.endText['styleUrl'] = self.endStyleUrl
+        if self.fieldTypes is not None:
+            self.documentStart['SimpleField'] = self.startSimpleField
+        if not self.skipOverlay:
+            self.documentStart['ScreenOverlay'] = self.startScreenOverlay
+            self.documentStart['PhotoOverlay'] = self.startPhotoOverlay
+            for tag in OVERLAY_TYPES:
+                self.placemarkEnd[tag] = self.endOverlay
+            for tag in ('north', 'south', 'east', 'west', 'rotation'):
+                self.placemarkStart[tag] = partial(self.startBoxValue, tag)
+            for tag in ('href', 'drawOrder'):
+                self.placemarkStart[tag] = partial(self.startOverlayValue, tag)
+            self.placemarkStart['LatLonBox'] = self.startLatLonBox
+            self.placemarkEnd['LatLonBox'] = self.endLatLonBox
+            self.endText['overlayValue'] = self.endOverlayValue
 
     def schemaBaseLookup(self, name):
         if name in self.schema:
             return(self.schema[name])
         return(name)
 
+    def setConverters(self, converters):
+        '''Convert the ExtendedData values with the list of functions in the order
+        of extDataMap. A value of None leaves the text unchanged.'''
+        self.converters = converters
+        self.emptyExtAttr = ['' if convert is None else None for convert in converters]
+
+    def addExtendedDataName(self, name):
+        if name and name not in self.extDataMap:
+            self.extDataMap[name] = self.extDataSize
+            self.extDataSize += 1
+
     def addSchema(self, name, parent):
         parent = self.schemaBaseLookup(parent)
         self.schema[name] = parent
+        self.tags.clear()
+
+    def tagName(self, name):
+        '''Return the base element name of name without the kml: prefix.'''
+        tag = self.tags.get(name)
+        if tag is None:
+            if name.startswith('kml:'):
+                tag = name[4:]
+            else:
+                tag = name
+            tag = self.schemaBaseLookup(tag)
+            self.tags[name] = tag
+        return(tag)
 
     def startElement(self, name, attr):
-        if name.startswith('kml:'):
-            name = name[4:]
-        if name == "Schema":
+        tag = self.tags.get(name)
+        if tag is None:
+            tag = self.tagName(name)
+        if self.styleReader is not None:
+            self.styleReader.startElement(tag, attr)
+            return
+        if tag == "Schema":
             n = None
             p = None
             for (k, v) in list(attr.items()):
@@ -358,221 +1109,401 @@ class PlacemarkHandler(xml.sax.handler.ContentHandler, QObject):
                     p = v
                 if n and p:
                     self.addSchema(n, p)
+        if self.inPlacemark:
+            handler = self.placemarkStart.get(tag)
+        else:
+            handler = self.documentStart.get(tag)
+        if handler is None:
+            self.stack.append(None)
+        else:
+            self.stack.append(handler(attr))
 
-        name = self.schemaBaseLookup(name)
+    def characters(self, data):
+        if self.textTarget is not None:
+            self.text.append(data)
+        elif self.styleReader is not None:
+            self.styleReader.characters(data)
 
-        if name == "Folder":
-            self.inFolder = True
-            self.name = ""
+    def endElement(self, name):
+        tag = self.tags.get(name)
+        if tag is None:
+            tag = self.tagName(name)
+        if self.styleReader is not None:
+            if not self.styleReader.endElement(tag):
+                return
+            self.endStyle()
+        if self.stack:
+            saved = self.stack.pop()
+        else:
+            saved = None
+        if saved is not None:
+            # This element collected text
+            self.endText[self.textTarget]()
+            (self.textTarget, self.text) = saved
+        if self.inPlacemark:
+            handler = self.placemarkEnd.get(tag)
+        else:
+            handler = self.documentEnd.get(tag)
+        if handler is not None:
+            handler()
 
-        elif self.inFolder and not self.inPlacemark and name == "name":
-            self.inName = True
-            self.name = ""
+    def startText(self, target):
+        '''Start collecting the text of an element and return the text state
+        it replaces.'''
+        saved = (self.textTarget, self.text)
+        self.textTarget = target
+        self.text = []
+        return(saved)
 
-        elif name == "Placemark":
-            self.inPlacemark = True
-            self.resetSettings()
-
-        elif self.inPlacemark:
-            if name == "Point":
-                self.inPoint = True
-            elif name == "LineString":
-                self.inLineString = True
-            elif name == "Polygon":
-                self.inPolygon = True
-            elif name == "Location":
-                self.inLocation = True
-            elif name == "name":
-                self.inName = True
-                self.name = ""
-            elif name == "description":
-                self.inDescription = True
-                self.description = ""
-            elif name == "coordinates":
-                self.inCoordinates = True
-                self.coord = ""
-            elif name == "outerBoundaryIs":
-                self.inOuterBoundary = True
-                self.coord = ""
-            elif name == "innerBoundaryIs":
-                self.inInnerBoundary = True
-                self.coord = ""
-            elif name == "TimeSpan":
-                self.inTimeSpan = True
-            elif name == "TimeStamp":
-                self.inTimeStamp = True
-            elif name == "begin":
-                self.inBegin = True
-            elif name == "end":
-                self.inEnd = True
-            elif name == "when":
-                self.inWhen = True
-            elif name == "longitude" and self.inLocation:
-                self.inLongitude = True
-                self.lon = ""
-            elif name == "latitude" and self.inLocation:
-                self.inLatitude = True
-                self.lat = ""
-            elif name == "altitude" and self.inLocation:
-                self.inAltitude = True
-                self.altitude = ""
-            elif name == "altitudeMode":
-                self.inAltitudeMode = True
-                self.altitudeMode = ""
-            elif name == "Data" and self.inExtendedData:
-                self.inData = True
-                self.dataName = None
-                for (k, v) in list(attr.items()):
-                    if k == 'name':
-                        self.dataName = v
-            elif name == "SimpleData" and self.inExtendedData:
-                self.inSimpleData = True
-                self.dataName = None
-                for (k, v) in list(attr.items()):
-                    if k == 'name':
-                        self.dataName = v
-            elif name == 'value' and self.inData:
-                self.inDataValue = True
-            elif name == "ExtendedData":
-                self.inExtendedData = True
+    def textValue(self):
+        return("".join(self.text))
 
-        elif name == 'GroundOverlay':
-            self.hasGoundOverlay = True
+    def startFolder(self, attr):
+        self.inFolder = True
+        self.name = ""
 
-    def characters(self, data):
-        if self.inName:  # on text within tag
-            self.name += data  # save text if in title
-        elif self.inDescription:
-            self.description += data
-        elif self.inCoordinates:
-            self.coord += data
-        elif self.inLongitude and self.inLocation:
-            self.lon += data
-        elif self.inLatitude and self.inLocation:
-            self.lat += data
-        elif self.inAltitude and self.inLocation:
-            self.altitude += data
-        elif self.inBegin and self.inTimeSpan:
-            self.begin += data
-        elif self.inEnd and self.inTimeSpan:
-            self.end += data
-        elif self.inWhen and self.inTimeStamp:
-            self.when += data
-        elif self.inAltitudeMode:
-            self.altitudeMode += data
-        elif self.inDataValue:
-            self.dataValue += data
-        elif self.inSimpleData:
-            self.dataValue += data
+    def startFolderName(self, attr):
+        if self.inFolder:
+            return(self.startText('folderName'))
 
-    def endElement(self, name):
-        if name.startswith('kml:'):
-            name = name[4:]
-        name = self.schemaBaseLookup(name)
-        if self.inPlacemark:
-            if name == "name":
-                self.inName = False  # on end title tag
-                self.name = self.name.strip()
-            elif name == "description":
-                self.inDescription = False
-                self.description = self.description.strip()
-            elif name == "Point":
-                self.processPoint(self.coord)
-                self.inPoint = False
-            elif name == "LineString":
-                self.processLineString(self.coord)
-                self.inLineString = False
-            elif name == "coordinates":
-                self.inCoordinates = False
-                if self.inPolygon:
-                    if self.inOuterBoundary:
-                        self.outerPoly = self.coord.strip()
-                    elif self.inInnerBoundary:
-                        self.innerPoly.append(self.coord.strip())
-                else:
-                    self.coord = self.coord.strip()
-            elif name == "longitude" and self.inLocation:
-                self.inLongitude = False
-                self.lon = self.lon.strip()
-            elif name == "latitude" and self.inLocation:
-                self.inLatitude = False
-                self.lat = self.lat.strip()
-            elif name == "altitude" and self.inLocation:
-                self.inAltitude = False
-                self.altitude = self.altitude.strip()
-            elif name == "Location":
-                self.processLocation(self.lon, self.lat, self.altitude)
-                self.inLocation = False
-                self.inLongitude = False
-                self.inLatitude = False
-                self.inAltitude = False
-            elif name == "Polygon":
-                self.processPolygon()
-                self.inPolygon = False
-                self.inOuterBoundary = False
-                self.inInnerBoundary = False
-                self.outerPoly = ""
-                self.innerPoly = []
-            elif name == "outerBoundaryIs":
-                self.inOuterBoundary = False
-            elif name == "innerBoundaryIs":
-                self.inInnerBoundary = False
-            elif name == "TimeSpan":
-                self.inTimeSpan = False
-            elif name == "TimeStamp":
-                self.inTimeStamp = False
-            elif name == "begin":
-                self.inBegin = False
-            elif name == "end":
-                self.inEnd = False
-            elif name == "when":
-                self.inWhen = False
-            elif name == "altitudeMode":
-                self.inAltitudeMode = False
-            elif name == "Placemark":
-                self.process(self.name, self.description, self.altitudeMode, self.begin, self.end, self.when)
-                self.inPlacemark = False
-                self.resetSettings()
-            elif name == 'Data' and self.inExtendedData:
-                self.inData = False
-            elif name == 'SimpleData' and self.inExtendedData:
-                self.inSimpleData = False
-                if self.dataName:
-                    self.extendedData[self.dataName] = self.dataValue.strip()
-                self.dataValue = ''
-            elif name == 'value' and self.inData:
-                if self.dataName:
-                    self.extendedData[self.dataName] = self.dataValue.strip()
-                self.inDataValue = False
-                self.dataValue = ''
-            elif name == 'ExtendedData':
-                self.inExtendedData = False
-                self.inData = False
-        elif name == 'Folder':
-            self.inFolder = False
-            if len(self.folders) > 0:
-                del self.folders[-1]
-        elif self.inFolder:
-            if name == 'name':
-                self.inName = False  # on end title tag
-                self.inFolder = False
-                self.name = self.name.strip()
-                self.folders.append(self.name)
+    def endFolderName(self):
+        self.inFolder = False
+        self.name = self.textValue().strip()
+        self.folders.append(self.name)
+        self.folderPath = None
 
-    def folderString(self):
+    def endFolder(self):
+        self.inFolder = False
         if len(self.folders) > 0:
-            return(u"; ".join(self.folders))
+            del self.folders[-1]
+            self.folderPath = None
+
+    def startPlacemark(self, attr):
+        self.inPlacemark = True
+        self.resetSettings()
+        if self.folderRegex is not None and not self.folderRegex.search(self.folderString()):
+            # The coordinates of excluded placemarks are not parsed
+            self.excluded = True
+
+    def endPlacemark(self):
+        self.process(self.name, self.description, self.altitudeMode, self.begin, self.end, self.when)
+        self.inPlacemark = False
+        self.resetSettings()
+
+    def startStyle(self, attr):
+        self.styleReader = StyleReader('Style', attr)
+
+    def startStyleMap(self, attr):
+        self.styleReader = StyleReader('StyleMap', attr)
+
+    def endStyle(self):
+        reader = self.styleReader
+        self.styleReader = None
+        if self.inPlacemark and not reader.isMap:
+            self.inlineStyle = reader.values
         else:
-            return("")
+            self.styles.add(reader)
+
+    def startStyleUrl(self, attr):
+        return(self.startText('styleUrl'))
+
+    def endStyleUrl(self):
+        self.styleUrl = self.textValue().strip()
+
+    def startGroundOverlay(self, attr):
+        self.hasGoundOverlay = True
+        if not self.skipOverlay:
+            self.startOverlay('GroundOverlay', attr)
+
+    def startScreenOverlay(self, attr):
+        self.startOverlay('ScreenOverlay', attr)
+
+    def startPhotoOverlay(self, attr):
+        self.startOverlay('PhotoOverlay', attr)
+
+    def startOverlay(self, overlayType, attr):
+        # The name, description, time and folder filter are handled as in a placemark
+        self.startPlacemark(attr)
+        self.overlayType = overlayType
+
+    def endOverlay(self):
+        self.processOverlay()
+        self.inPlacemark = False
+        self.resetSettings()
+
+    def startLatLonBox(self, attr):
+        self.inLatLonBox = True
+
+    def endLatLonBox(self):
+        self.inLatLonBox = False
+
+    def startBoxValue(self, key, attr):
+        if self.inLatLonBox:
+            return(self.startOverlayValue(key, attr))
+
+    def startOverlayValue(self, key, attr):
+        if self.overlayType is not None:
+            self.overlayKey = key
+            return(self.startText('overlayValue'))
+
+    def endOverlayValue(self):
+        self.overlayValues[self.overlayKey] = self.textValue().strip()
+
+    def startNetworkLink(self, attr):
+        self.inNetworkLink = True
+
+    def endNetworkLink(self):
+        self.inNetworkLink = False
+
+    def startHref(self, attr):
+        if self.inNetworkLink:
+            return(self.startText('href'))
+
+    def endHref(self):
+        href = self.textValue().strip()
+        if href:
+            self.networkLinks.append(href)
+
+    def endPoint(self):
+        if self.coord is None:
+            self.processPoint("")
+        else:
+            self.processPoint(self.coord.value().strip())
+
+    def endLineString(self):
+        self.processLineString(self.coord)
+
+    def startPolygon(self, attr):
+        self.inPolygon = True
+
+    def endPolygon(self):
+        self.processPolygon()
+        self.inPolygon = False
+        self.inOuterBoundary = False
+        self.inInnerBoundary = False
+        self.outerRing = None
+        self.innerRings = []
+
+    def startOuterBoundary(self, attr):
+        self.inOuterBoundary = True
+
+    def endOuterBoundary(self):
+        self.inOuterBoundary = False
+
+    def startInnerBoundary(self, attr):
+        self.inInnerBoundary = True
+
+    def endInnerBoundary(self):
+        self.inInnerBoundary = False
+
+    def startCoordinates(self, attr):
+        if self.excluded or (self.inPolygon and self.skipPoly):
+            return
+        saved = self.startText('coordinates')
+        self.text = CoordinateBuffer()
+        return(saved)
+
+    def endCoordinates(self):
+        if self.inPolygon:
+            # Each ring is converted as soon as it ends so the text of the rings is not kept
+            if self.inOuterBoundary:
+                self.outerRing = self.text.arrays()
+            elif self.inInnerBoundary:
+                self.innerRings.append(self.text.arrays())
+        else:
+            self.coord = self.text
+
+    def startTrack(self, attr):
+        if (self.skipTrack and self.skipTrackPt) or self.excluded:
+            return
+        self.trackCoords = TrackBuffer(trackCoordArrays)
+        self.trackWhens = TrackBuffer(trackTimeArray)
+        # Tracks can have millions of values so their end handlers are bound directly
+        self.endText['trackCoord'] = self.trackCoords.endValue
+        self.endText['trackWhen'] = self.trackWhens.endValue
+
+    def endTrack(self):
+        if self.trackCoords is None:
+            return
+        (x, y, z) = self.trackCoords.arrays()
+        (m,) = self.trackWhens.arrays()
+        self.trackCoords = None
+        self.trackWhens = None
+        if len(m) != len(x):
+            # Every gx:coord should have a when. Missing times are NaN.
+            m = resize(m, len(x))
+        if len(x):
+            self.tracks.append((x, y, z, m))
+
+    def startTrackCoord(self, attr):
+        if self.trackCoords is not None:
+            return(self.startTrackValue('trackCoord', self.trackCoords))
+
+    def startTrackValue(self, target, buffer):
+        '''The text of the gx:coord and when elements of a track goes directly into
+        its TrackBuffer.'''
+        saved = (self.textTarget, self.text)
+        self.textTarget = target
+        self.text = buffer
+        return(saved)
+
+    def startLocation(self, attr):
+        self.inLocation = True
+
+    def endLocation(self):
+        self.processLocation(self.lon, self.lat, self.altitude)
+        self.inLocation = False
+
+    def startLongitude(self, attr):
+        if self.inLocation:
+            return(self.startText('longitude'))
+
+    def endLongitude(self):
+        self.lon = self.textValue().strip()
+
+    def startLatitude(self, attr):
+        if self.inLocation:
+            return(self.startText('latitude'))
+
+    def endLatitude(self):
+        self.lat = self.textValue().strip()
+
+    def startAltitude(self, attr):
+        if self.inLocation:
+            return(self.startText('altitude'))
+
+    def endAltitude(self):
+        self.altitude = self.textValue().strip()
+
+    def startName(self, attr):
+        return(self.startText('name'))
+
+    def endName(self):
+        self.name = self.textValue().strip()
+
+    def startDescription(self, attr):
+        return(self.startText('description'))
+
+    def endDescription(self):
+        self.description = self.textValue().strip()
+
+    def startTimeSpan(self, attr):
+        self.inTimeSpan = True
+
+    def endTimeSpan(self):
+        self.inTimeSpan = False
+
+    def startTimeStamp(self, attr):
+        self.inTimeStamp = True
+
+    def endTimeStamp(self):
+        self.inTimeStamp = False
+
+    def startBegin(self, attr):
+        if self.inTimeSpan:
+            return(self.startText('begin'))
+
+    def endBegin(self):
+        self.begin += self.textValue()
+
+    def startEnd(self, attr):
+        if self.inTimeSpan:
+            return(self.startText('end'))
+
+    def endEnd(self):
+        self.end += self.textValue()
+
+    def startWhen(self, attr):
+        if self.inTimeStamp:
+            return(self.startText('when'))
+        if self.trackWhens is not None:
+            return(self.startTrackValue('trackWhen', self.trackWhens))
+
+    def endWhen(self):
+        self.when += self.textValue()
+
+    def startAltitudeMode(self, attr):
+        return(self.startText('altitudeMode'))
+
+    def endAltitudeMode(self):
+        self.altitudeMode = self.textValue()
+
+    def startExtendedData(self, attr):
+        self.inExtendedData = True
+
+    def endExtendedData(self):
+        self.inExtendedData = False
+        self.inData = False
+
+    def startData(self, attr):
+        if self.inExtendedData:
+            self.inData = True
+            self.dataName = attr.get('name')
+            if self.lateBinding:
+                self.addExtendedDataName(self.dataName)
+
+    def endData(self):
+        self.inData = False
+
+    def startValue(self, attr):
+        if self.inData:
+            return(self.startText('value'))
+
+    def endValue(self):
+        if self.dataName:
+            value = self.textValue().strip()
+            self.extendedData[self.dataName] = value
+            if self.fieldTypes is not None:
+                self.fieldTypes.sample(self.dataName, value)
+
+    def startSimpleData(self, attr):
+        if self.inExtendedData:
+            self.dataName = attr.get('name')
+            if self.lateBinding:
+                self.addExtendedDataName(self.dataName)
+            return(self.startText('simpleData'))
+
+    def endSimpleData(self):
+        if self.dataName:
+            value = self.textValue().strip()
+            self.extendedData[self.dataName] = value
+            if self.fieldTypes is not None:
+                self.fieldTypes.sample(self.dataName, value)
+
+    def startSimpleField(self, attr):
+        self.fieldTypes.declare(attr.get('name'), attr.get('type'))
+
+    def convertExtendedData(self):
+        '''Return the ExtendedData attributes converted to their field types.'''
+        extAttr = list(self.emptyExtAttr)
+        for key, value in self.extendedData.items():
+            index = self.extDataMap.get(key)
+            if index is None:
+                continue
+            convert = self.converters[index]
+            if convert is None:
+                extAttr[index] = value
+            elif value:
+                extAttr[index] = convert(value)
+                if extAttr[index] is None:
+                    self.conversionErrors[key] = self.conversionErrors.get(key, 0) + 1
+        return(extAttr)
+
+    def folderString(self):
+        if self.folderPath is None:
+            self.folderPath = u"; ".join(self.folders)
+        return(self.folderPath)
 
     def processLineString(self, coord):
-        if self.skipLine:
+        if self.skipLine or self.excluded:
             return
-        lineStr = coord2ptsZ(coord)
-        self.lineStrings.append(lineStr)
+        if coord is None:
+            self.lineStrings.append(coordArrays(""))
+        else:
+            self.lineStrings.append(coord.arrays())
 
     def processPoint(self, coord):
-        if self.skipPt:
+        if self.skipPt or self.excluded:
             return
 
         c = coord.split(',')
@@ -586,12 +1517,11 @@ class PlacemarkHandler(xml.sax.handler.ContentHandler, QObject):
                 altitude = float(c[2])
         except Exception:
             return
-        pt = QgsPoint(lon, lat, altitude)
-        self.ptPts.append(pt)
+        self.ptPts.append((lon, lat, altitude))
         self.ptAltitude.append(altitude)
 
     def processLocation(self, lon, lat, altitude):
-        if self.skipPt:
+        if self.skipPt or self.excluded:
             return
 
         try:
@@ -605,142 +1535,611 @@ class PlacemarkHandler(xml.sax.handler.ContentHandler, QObject):
                 altitude = float(altitude)
         except Exception:
             pass
-        pt = QgsPoint(lon, lat, altitude)
-        self.ptPts.append(pt)
+        self.ptPts.append((lon, lat, altitude))
         self.ptAltitude.append(altitude)
 
     def processPolygon(self):
-        if self.skipPoly:
+        if self.skipPoly or self.excluded:
             return
-        interior_ring = []
-        poly = QgsPolygon()
-        outerLineStr = coord2ptsZ(self.outerPoly)
-        poly.setExteriorRing(outerLineStr)
-        if len(self.innerPoly) > 0:
-            for p in self.innerPoly:
-                innerLineStr = coord2ptsZ(p)
-                interior_ring.append(innerLineStr)
-            poly.setInteriorRings(interior_ring)
-        self.polygons.append(poly)
+        outer = self.outerRing
+        if outer is None:
+            outer = coordArrays("")
+        self.polygons.append((outer, self.innerRings))
+
+    def inExtent(self, coords):
+        '''Return True if the bounding box of the (x, y, z) coordinate arrays intersects
+        the extent.'''
+        (x, y, z) = coords
+        if len(x) == 0:
+            return(False)
+        (xmin, ymin, xmax, ymax) = self.extent
+        if HAS_NUMPY:
+            return(x.min() <= xmax and x.max() >= xmin and y.min() <= ymax and y.max() >= ymin)
+        return(min(x) <= xmax and max(x) >= xmin and min(y) <= ymax and max(y) >= ymin)
+
+    def inTimeWindow(self, begin, end, when):
+        '''Return True if the TimeStamp or TimeSpan of the placemark overlaps the time
+        window. Placemarks without a valid time are excluded.'''
+        if when.strip():
+            begin = parseTime(when)
+            end = parseTime(when, True)
+            if begin is None:
+                return(False)
+        else:
+            begin = parseTime(begin)
+            end = parseTime(end, True)
+            if begin is None and end is None:
+                return(False)
+        if self.timeEnd is not None and begin is not None and begin > self.timeEnd:
+            return(False)
+        if self.timeStart is not None and end is not None and end < self.timeStart:
+            return(False)
+        return(True)
 
     def process(self, name, desc, alt_mode, begin, end, when):
-        if self.extDataSize > 0:
+        if self.excluded:
+            return
+        if self.timeFilter:
+            # Tracks are filtered by the time of their positions
+            if self.tracks:
+                self.tracks = [track for track in self.tracks if self.trackInTimeWindow(track[3])]
+            if not self.inTimeWindow(begin, end, when):
+                if not self.tracks:
+                    return
+                self.ptPts = []
+                self.lineStrings = []
+                self.polygons = []
+        if self.extent is not None:
+            # Only the geometry within the extent is turned into features
+            pts = []
+            ptAltitude = []
+            (xmin, ymin, xmax, ymax) = self.extent
+            for x, pt in enumerate(self.ptPts):
+                if xmin <= pt[0] <= xmax and ymin <= pt[1] <= ymax:
+                    pts.append(pt)
+                    ptAltitude.append(self.ptAltitude[x])
+            self.ptPts = pts
+            self.ptAltitude = ptAltitude
+            if not any(self.inExtent(line) for line in self.lineStrings):
+                self.lineStrings = []
+            if not any(self.inExtent(poly[0]) for poly in self.polygons):
+                self.polygons = []
+            self.tracks = [track for track in self.tracks if self.inExtent(track[:3])]
+        if self.converters is None:
             extAttr = [''] * self.extDataSize
-        for key in self.extendedData.keys():
-            if key in self.extDataMap:
-                extAttr[self.extDataMap[key]] = self.extendedData[key]
+            for key in self.extendedData.keys():
+                if key in self.extDataMap:
+                    extAttr[self.extDataMap[key]] = self.extendedData[key]
+        else:
+            extAttr = self.convertExtendedData()
+        if self.styles is not None:
+            # The style attributes come before the ExtendedData
+            extAttr = self.styles.attributes(self.styleUrl, self.inlineStyle) + extAttr
+        if self.geometryStats is not None:
+            self.updateGeometryStats()
+        factory = self.factory
+        factory.setPlacemark(name, self.folderString(), desc, alt_mode, begin, end, when, extAttr)
         # POINTS
         if len(self.ptPts) != 0:
             for x, pt in enumerate(self.ptPts):
-                feature = QgsFeature()
-                feature.setGeometry(QgsGeometry(pt))
-                attr = [name, self.folderString(), desc, self.ptAltitude[x], alt_mode, begin, end, when]
-                if self.extDataSize > 0:
-                    attr.extend(extAttr)
-                feature.setAttributes(attr)
-                self.addpoint.emit(feature)
-
-        # LINES - lineStrings is a list of QgsLineString
+                self.ptFeatures.append(factory.feature(QgsGeometry(QgsPoint(pt[0], pt[1], pt[2])), self.ptAltitude[x]))
+
+        # LINES - lineStrings is a list of coordinate arrays
         if len(self.lineStrings) != 0:
-            feature = QgsFeature()
             if len(self.lineStrings) == 1:
-                feature.setGeometry(QgsGeometry(self.lineStrings[0]))
+                g = lineString(self.lineStrings[0])
             else:
                 g = QgsMultiLineString()
-                for lineStr in self.lineStrings:
-                    g.addGeometry(lineStr)
-                feature.setGeometry(QgsGeometry(g))
-            attr = [name, self.folderString(), desc, 0, alt_mode, begin, end, when]
-            if self.extDataSize > 0:
-                attr.extend(extAttr)
-            feature.setAttributes(attr)
-            self.addline.emit(feature)
+                for coords in self.lineStrings:
+                    g.addGeometry(lineString(coords))
+            self.lineFeatures.append(factory.feature(QgsGeometry(g)))
 
         # POLYGONS
         if len(self.polygons) != 0:
-            feature = QgsFeature()
             if len(self.polygons) == 1:
-                feature.setGeometry(QgsGeometry(self.polygons[0]))
+                g = polygon(self.polygons[0])
             else:
                 g = QgsMultiPolygon()
-                for poly in self.polygons:
-                    g.addGeometry(poly)
-                feature.setGeometry(QgsGeometry(g))
-            attr = [name, self.folderString(), desc, 0, alt_mode, begin, end, when]
-            if self.extDataSize > 0:
-                attr.extend(extAttr)
-            feature.setAttributes(attr)
-            self.addpolygon.emit(feature)
-
-def coord2ptsZ(coords):
-    lineStr = QgsLineString()
-    coords = coords.strip()
-    clist = re.split('\s+', coords)
-
-    for pt in clist:
-        c = pt.split(',')
-        if len(c) >= 6:
-            '''This is invalid KML syntax, but given some KMLs have been formatted
-            this way the invalid exception is looked for. There should be a space
-            between line string coordinates. This looks for a comma between them and
-            also assumes it is formatted as lat,lon,altitude,lat,lon,altitude...'''
-            i = 0
-            while i < len(c) - 1:
-                try:
-                    lon = float(c[i])
-                    lat = float(c[i + 1])
-                except Exception:
-                    lon = 0.0
-                    lat = 0.0
-                try:
-                    altitude = float(c[i + 2])
-                except Exception:
-                    altitude = 0
-                lineStr.addVertex(QgsPoint(lon, lat, altitude))
-                i += 3
+                for coords in self.polygons:
+                    g.addGeometry(polygon(coords))
+            self.polyFeatures.append(factory.feature(QgsGeometry(g)))
+
+        # TRACKS - tracks is a list of (x, y, z, m) arrays where m is the time in seconds
+        for track in self.tracks:
+            if not self.skipTrack:
+                self.processTrack(track, begin, end, when)
+            if not self.skipTrackPt:
+                self.processTrackPoints(track, begin, end)
+
+        if len(self.ptFeatures) >= self.batchSize or len(self.lineFeatures) >= self.batchSize or len(self.polyFeatures) >= self.batchSize or len(self.trackFeatures) >= self.batchSize:
+            self.flush()
+
+    def overlayFootprint(self):
+        '''Return the (x, y) corner lists of the gx:LatLonQuad or rotated LatLonBox of
+        a GroundOverlay or None if it has neither.'''
+        if self.overlayType != 'GroundOverlay':
+            return(None)
+        if self.coord is not None:
+            # gx:LatLonQuad has the lower left, lower right, upper right and upper left corners
+            (x, y, z) = self.coord.arrays()
+            if len(x) < 4:
+                return(None)
+            return([float(v) for v in x[:4]], [float(v) for v in y[:4]])
+        values = self.overlayValues
+        try:
+            north = float(values['north'])
+            south = float(values['south'])
+            east = float(values['east'])
+            west = float(values['west'])
+        except (KeyError, ValueError):
+            return(None)
+        x = [west, east, east, west]
+        y = [south, south, north, north]
+        rotation = overlayRotation(values)
+        if rotation:
+            # The box is rotated counterclockwise about its center
+            cx = (east + west) / 2.0
+            cy = (north + south) / 2.0
+            r = math.radians(rotation)
+            (c, s) = (math.cos(r), math.sin(r))
+            (x, y) = (
+                [cx + (px - cx) * c - (py - cy) * s for px, py in zip(x, y)],
+                [cy + (px - cx) * s + (py - cy) * c for px, py in zip(x, y)])
+        return(x, y)
+
+    def processOverlay(self):
+        if self.excluded:
+            return
+        if self.timeFilter and not self.inTimeWindow(self.begin, self.end, self.when):
+            return
+        footprint = self.overlayFootprint()
+        if self.extent is not None:
+            if footprint is None:
+                return
+            (x, y) = footprint
+            (xmin, ymin, xmax, ymax) = self.extent
+            if min(x) > xmax or max(x) < xmin or min(y) > ymax or max(y) < ymin:
+                return
+        feature = QgsFeature()
+        if footprint is not None:
+            (x, y) = footprint
+            g = QgsPolygon()
+            g.setExteriorRing(QgsLineString(x + x[:1], y + y[:1]))
+            feature.setGeometry(QgsGeometry(g))
+        try:
+            draw_order = int(self.overlayValues.get('drawOrder', ''))
+        except ValueError:
+            draw_order = None
+        rotation = overlayRotation(self.overlayValues) if self.overlayType == 'GroundOverlay' else None
+        feature.setAttributes([
+            self.name, self.folderString(), self.description, self.overlayType,
+            self.overlayValues.get('href', ''), draw_order, rotation, self.begin, self.end, self.when])
+        self.overlayFeatures.append(feature)
+        if len(self.overlayFeatures) >= self.batchSize:
+            self.addoverlays.emit(self.overlayFeatures)
+            self.overlayFeatures = []
+
+    def updateGeometryStats(self):
+        '''Record whether the geometry of the placemark has Z values or multiple parts.'''
+        z = self.geometryStats['z']
+        multi = self.geometryStats['multi']
+        if self.ptPts and 'points' not in z and any(pt[2] for pt in self.ptPts):
+            z.add('points')
+        if self.lineStrings:
+            if len(self.lineStrings) > 1:
+                multi.add('lines')
+            if 'lines' not in z and any(hasValues(line[2]) for line in self.lineStrings):
+                z.add('lines')
+        if self.polygons:
+            if len(self.polygons) > 1:
+                multi.add('polygons')
+            if 'polygons' not in z:
+                for (outer, inner) in self.polygons:
+                    if hasValues(outer[2]) or any(hasValues(ring[2]) for ring in inner):
+                        z.add('polygons')
+                        break
+        if self.tracks and 'tracks' not in z and any(hasValues(track[2]) for track in self.tracks):
+            z.add('tracks')
+            z.add('trackPoints')
+
+    def trackInTimeWindow(self, m):
+        '''Return True if any of the track times in m are within the time window.'''
+        if HAS_NUMPY:
+            valid = m[~np.isnan(m)]
+            if len(valid) == 0:
+                return(False)
+            (first, last) = (valid.min(), valid.max())
         else:
-            altitude = 0
-            try:
-                lon = float(c[0])
-                lat = float(c[1])
-                if len(c) >= 3:
-                    altitude = float(c[2])
-            except Exception:
-                lon = 0.0
-                lat = 0.0
+            valid = [t for t in m if not math.isnan(t)]
+            if len(valid) == 0:
+                return(False)
+            (first, last) = (min(valid), max(valid))
+        if self.timeEnd is not None and first > self.timeEnd.timestamp():
+            return(False)
+        if self.timeStart is not None and last < self.timeStart.timestamp():
+            return(False)
+        return(True)
+
+    def processTrack(self, track, begin, end, when):
+        (x, y, z, m) = track
+        times = None
+        if not begin and not end and not when:
+            # Use the time of the first and last positions
+            times = (timeString(m[0]), timeString(m[-1]), when)
+        if HAS_NUMPY:
+            line = QgsLineString(x.tolist(), y.tolist(), z.tolist(), m.tolist())
+        else:
+            line = QgsLineString(x, y, z, m)
+        self.trackFeatures.append(self.factory.feature(QgsGeometry(line), times=times))
 
-            lineStr.addVertex(QgsPoint(lon, lat, altitude))
+    def processTrackPoints(self, track, begin, end):
+        (x, y, z, m) = track
+        if self.extent is not None:
+            (xmin, ymin, xmax, ymax) = self.extent
+            if HAS_NUMPY:
+                keep = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+                (x, y, z, m) = (x[keep], y[keep], z[keep], m[keep])
+            else:
+                keep = [i for i in range(len(x)) if xmin <= x[i] <= xmax and ymin <= y[i] <= ymax]
+                (x, y, z, m) = ([x[i] for i in keep], [y[i] for i in keep], [z[i] for i in keep], [m[i] for i in keep])
+        factory = self.factory
+        size = TRACK_CHUNK_SIZE
+        # The times and, with late binding, the WKB of a chunk of fixes are created in one call
+        for start in range(0, len(x), size):
+            stop = start + size
+            whens = timeStrings(m[start:stop])
+            altitudes = z[start:stop].tolist() if HAS_NUMPY else z[start:stop]
+            if self.lateBinding:
+                self.trackPtFeatures.extend(factory.records(
+                    pointZMWkb(x[start:stop], y[start:stop], z[start:stop], m[start:stop]), altitudes, begin, end, whens))
+            else:
+                if HAS_NUMPY:
+                    (xs, ys, ms) = (x[start:stop].tolist(), y[start:stop].tolist(), m[start:stop].tolist())
+                else:
+                    (xs, ys, ms) = (x[start:stop], y[start:stop], m[start:stop])
+                for i in range(len(xs)):
+                    self.trackPtFeatures.append(factory.feature(
+                        QgsGeometry(QgsPoint(xs[i], ys[i], altitudes[i], ms[i])), altitudes[i], (begin, end, whens[i])))
+            if len(self.trackPtFeatures) >= self.batchSize:
+                self.emitTrackPoints()
 
-    return(lineStr)
+    def emitTrackPoints(self):
+        if self.lateBinding:
+            self.addtrackpointrecords.emit(self.trackPtFeatures)
+        else:
+            self.addtrackpoints.emit(self.trackPtFeatures)
+        self.trackPtFeatures = []
 
-class PreProcessHandler(xml.sax.handler.ContentHandler, QObject):
+    def flush(self):
+        '''Send any pending features to the output layers.'''
+        if self.ptFeatures:
+            self.addpoints.emit(self.ptFeatures)
+            self.ptFeatures = []
+        if self.lineFeatures:
+            self.addlines.emit(self.lineFeatures)
+            self.lineFeatures = []
+        if self.polyFeatures:
+            self.addpolygons.emit(self.polyFeatures)
+            self.polyFeatures = []
+        if self.trackFeatures:
+            self.addtracks.emit(self.trackFeatures)
+            self.trackFeatures = []
+        if self.trackPtFeatures:
+            self.emitTrackPoints()
+        if self.overlayFeatures:
+            self.addoverlays.emit(self.overlayFeatures)
+            self.overlayFeatures = []
+
+    def endDocument(self):
+        self.flush()
+
+def hasValues(values):
+    '''Return True if any of the values of an array is not 0.'''
+    if HAS_NUMPY:
+        return(bool(values.any()))
+    return(any(values))
+
+def simplestWkbTypes(stats):
+    '''Return the geometry type of each placemark output from the names of the outputs
+    with Z values and with multi-part features.'''
+    z = stats['z']
+    multi = stats['multi']
+    types = {}
+    types['points'] = QgsWkbTypes.PointZ if 'points' in z else QgsWkbTypes.Point
+    if 'lines' in multi:
+        types['lines'] = QgsWkbTypes.MultiLineStringZ if 'lines' in z else QgsWkbTypes.MultiLineString
+    else:
+        types['lines'] = QgsWkbTypes.LineStringZ if 'lines' in z else QgsWkbTypes.LineString
+    if 'polygons' in multi:
+        types['polygons'] = QgsWkbTypes.MultiPolygonZ if 'polygons' in z else QgsWkbTypes.MultiPolygon
+    else:
+        types['polygons'] = QgsWkbTypes.PolygonZ if 'polygons' in z else QgsWkbTypes.Polygon
+    # Tracks always have their times as M values
+    types['tracks'] = QgsWkbTypes.LineStringZM if 'tracks' in z else QgsWkbTypes.LineStringM
+    types['trackPoints'] = QgsWkbTypes.PointZM if 'trackPoints' in z else QgsWkbTypes.PointM
+    return(types)
+
+def dropZValues(features):
+    '''Remove the Z values from the geometry of the features.'''
+    for feature in features:
+        geom = feature.geometry()
+        geom.get().dropZValue()
+        feature.setGeometry(geom)
+
+class FeatureFactory():
+    '''Creates the output features of a placemark. The attributes shared by the
+    features of the placemark are set once by setPlacemark and the same attribute
+    list is reused for each feature since QgsFeature.setAttributes copies it. Only
+    the altitude and times are changed for each feature.'''
     def __init__(self):
+        self.attr = [None] * BASE_FIELD_COUNT
+        self.times = ('', '', '')
+
+    def setPlacemark(self, name, folders, desc, alt_mode, begin, end, when, extAttr):
+        attr = self.attr
+        if len(attr) != BASE_FIELD_COUNT + len(extAttr):
+            # The number of ExtendedData attributes grows with late binding
+            attr = [None] * (BASE_FIELD_COUNT + len(extAttr))
+            self.attr = attr
+        attr[0] = name
+        attr[1] = folders
+        attr[2] = desc
+        attr[4] = alt_mode
+        attr[BASE_FIELD_COUNT:] = extAttr
+        self.times = (begin, end, when)
+
+    def feature(self, geometry, altitude=0, times=None):
+        '''Return a feature with geometry and the attributes of the placemark. times is
+        the begin, end and when of the feature if they differ from the placemark.'''
+        attr = self.attr
+        attr[3] = altitude
+        (attr[5], attr[6], attr[7]) = self.times if times is None else times
+        feature = QgsFeature()
+        feature.setGeometry(geometry)
+        feature.setAttributes(attr)
+        return(feature)
+
+    def records(self, wkbs, altitudes, begin, end, whens):
+        '''Return the (WKB, attributes) records of point features with the WKB, altitude
+        and when of each point, as they are stored in a FeatureSpool. No QgsFeature is
+        created for the points.'''
+        attr = self.attr
+        (attr[5], attr[6]) = (begin, end)
+        records = []
+        for wkb, altitude, when in zip(wkbs, altitudes, whens):
+            attr[3] = altitude
+            attr[7] = when
+            records.append((wkb, list(attr)))
+        return(records)
+
+def overlayRotation(values):
+    '''Return the LatLonBox rotation in degrees of the overlay values.'''
+    try:
+        return(float(values.get('rotation', 0)))
+    except ValueError:
+        return(0.0)
+
+def lineString(coords):
+    '''Create a QgsLineString from the (x, y, z) arrays returned by coordArrays.'''
+    (x, y, z) = coords
+    if HAS_NUMPY:
+        return(QgsLineString(x.tolist(), y.tolist(), z.tolist()))
+    return(QgsLineString(x, y, z))
+
+def polygon(coords):
+    '''Create a QgsPolygon from the outer ring and the list of inner rings
+    saved by processPolygon.'''
+    (outer, inner) = coords
+    poly = QgsPolygon()
+    poly.setExteriorRing(lineString(outer))
+    if len(inner) > 0:
+        poly.setInteriorRings([lineString(ring) for ring in inner])
+    return(poly)
+
+def spoolKml(source, skip, backend=EXPAT_BACKEND, batchSize=1000, filters=None, styles=False,
+        fieldTypes=TYPES_TEXT, feedback=None, geometryTypes=False):
+    '''Parse the documents of the KmlSource source into named feature spools. skip is
+    the tuple of skipPt, skipLine, skipPoly, skipTrack, skipTrackPt and skipOverlay. Only picklable
+    values are returned so this can be run in another process: the filename and feature
+    count of each spool, the ExtendedData names in the order they were found, the
+    NetworkLink hrefs and any error message. A canceled import is reported as an error.
+    If styles is True, then the style attributes are added and 'styles' has the
+    attributes of the styles defined after their placemarks. The 'extTypes' of the
+    ExtendedData fields are found as given by the fieldTypes mode. If geometryTypes is
+    True, then 'geometry' has the names of the spools with Z values and with multi-part
+    features.'''
+    result = {
+        'filename': source.filename,
+        'extData': [],
+        'links': [],
+        'extTypes': {},
+        'groundOverlay': False,
+        'geometry': None,
+        'styles': {},
+        'error': None
+    }
+    (skipPt, skipLine, skipPoly, skipTrack, skipTrackPt, skipOverlay) = skip
+    extDataMap = {}
+    types = FieldTypes(fieldTypes) if fieldTypes != TYPES_TEXT else None
+    handler = PlacemarkHandler(
+        skipPt, skipLine, skipPoly, extDataMap, None, batchSize, lateBinding=True,
+        skipTrack=skipTrack, skipTrackPt=skipTrackPt, styles=StyleIndex() if styles else None,
+        fieldTypes=types, skipOverlay=skipOverlay, geometryTypes=geometryTypes)
+    if filters:
+        handler.setFilters(*filters)
+    signals = (
+        handler.addpoints, handler.addlines, handler.addpolygons, handler.addtracks, handler.addtrackpointrecords,
+        handler.addoverlays)
+    spools = []
+    for name, signal in zip(SPOOL_NAMES, signals):
+        spool = FeatureSpool(named=True)
+        if name == 'trackPoints':
+            signal.connect(spool.addRecords)
+        else:
+            signal.connect(spool.addFeatures)
+        spools.append(spool)
+    for kml in source.streams():
+        try:
+            parseKml(kml, handler, backend)
+        except ImportCanceled:
+            result['error'] = tr('Import canceled - The features read so far are kept.')
+            break
+        except Exception:
+            result['error'] = tr('Failure in kml extraction - May return partial results.')
+            handler.endDocument()
+        if feedback and feedback.isCanceled():
+            result['error'] = tr('Import canceled - The features read so far are kept.')
+            break
+    handler.flush()
+    result['extData'] = list(extDataMap)
+    if types is not None:
+        result['extTypes'] = types.types()
+    result['links'] = handler.networkLinks
+    result['groundOverlay'] = handler.hasGoundOverlay
+    result['geometry'] = handler.geometryStats
+    if handler.styles is not None:
+        result['styles'] = handler.styles.lateAttributes()
+    for name, spool in zip(SPOOL_NAMES, spools):
+        result[name] = spool.detach()
+    return(result)
+
+class FeatureSpool():
+    '''Compact temporary store of features. Each feature is pickled to a temporary
+    file as its WKB geometry and attribute list. A named spool can be passed to another
+    process by calling detach() and then reopened there with FeatureSpool(filename, count).'''
+    def __init__(self, filename=None, count=0, named=False, remove=True):
+        self.filename = filename
+        self.count = count
+        # Remove the spool file when it is closed
+        self.remove = remove
+        if filename:
+            self.file = open(filename, 'rb')
+        elif named:
+            self.file = tempfile.NamedTemporaryFile(suffix='.spool', delete=False)
+            self.filename = self.file.name
+        else:
+            self.file = tempfile.TemporaryFile()
+
+    def addFeatures(self, features):
+        for feature in features:
+            pickle.dump((feature.geometry().asWkb().data(), feature.attributes()), self.file, pickle.HIGHEST_PROTOCOL)
+        self.count += len(features)
+
+    def addRecords(self, records):
+        '''Add features given as (WKB, attributes) tuples.'''
+        for record in records:
+            pickle.dump(record, self.file, pickle.HIGHEST_PROTOCOL)
+        self.count += len(records)
+
+    def features(self):
+        self.file.seek(0)
+        for i in range(self.count):
+            (wkb, attr) = pickle.load(self.file)
+            geom = QgsGeometry()
+            geom.fromWkb(wkb)
+            feature = QgsFeature()
+            feature.setGeometry(geom)
+            feature.setAttributes(attr)
+            yield feature
+
+    def detach(self):
+        '''Close a named spool without removing it and return its filename and feature count.'''
+        self.file.close()
+        return(self.filename, self.count)
+
+    def close(self):
+        self.file.close()
+        if self.filename and self.remove:
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass
+
+class PreProcessHandler(xml.sax.handler.ContentHandler, QObject):
+    def __init__(self, fieldTypes=None, styles=None):
         QObject.__init__(self)
         xml.sax.handler.ContentHandler.__init__(self)
 
         self.extendedData = set()
         self.inExtendedData = False
+        self.inNetworkLink = False
+        self.href = None
+        self.networkLinks = []
+        # FieldTypes collecting the ExtendedData field types or None
+        self.fieldTypes = fieldTypes
+        self.sampleValues = fieldTypes is not None and fieldTypes.infer
+        self.dataName = None
+        self.value = None
+        # StyleIndex collecting the shared styles or None
+        self.styles = styles
+        self.styleReader = None
+        self.inPlacemark = False
 
     def startElement(self, name, attr):
-
+        if self.styleReader is not None:
+            self.styleReader.startElement(name, attr)
+            return
         if name == "Data" and self.inExtendedData:
             self.dataName = None
             for (k, v) in list(attr.items()):
                 if k == 'name':
                     if v:
                         self.extendedData.add(v)
+                        self.dataName = v
         elif name == "SimpleData" and self.inExtendedData:
             self.dataName = None
             for (k, v) in list(attr.items()):
                 if k == 'name':
                     if v:
                         self.extendedData.add(v)
+                        self.dataName = v
+            if self.sampleValues:
+                self.value = []
+        elif name == "value" and self.inExtendedData and self.sampleValues:
+            self.value = []
+        elif name == "SimpleField" and self.fieldTypes is not None:
+            self.fieldTypes.declare(attr.get('name'), attr.get('type'))
         elif name == "ExtendedData":
             self.inExtendedData = True
+        elif name == "NetworkLink":
+            self.inNetworkLink = True
+        elif name == "href" and self.inNetworkLink:
+            self.href = []
+        elif name == "Placemark":
+            self.inPlacemark = True
+        elif self.styles is not None and (name == "StyleMap" or (name == "Style" and not self.inPlacemark)):
+            # The inline styles of the placemarks are read by the main pass
+            self.styleReader = StyleReader(name, attr)
+
+    def characters(self, data):
+        if self.href is not None:
+            self.href.append(data)
+        elif self.value is not None:
+            self.value.append(data)
+        elif self.styleReader is not None:
+            self.styleReader.characters(data)
 
     def endElement(self, name):
-        if name == 'ExtendedData':
+        if self.styleReader is not None:
+            if self.styleReader.endElement(name):
+                self.styles.add(self.styleReader)
+                self.styleReader = None
+            return
+        if self.value is not None and (name == 'value' or name == 'SimpleData'):
+            if self.dataName:
+                self.fieldTypes.sample(self.dataName, "".join(self.value).strip())
+            self.value = None
+        elif name == 'ExtendedData':
             self.inExtendedData = False
+        elif name == 'NetworkLink':
+            self.inNetworkLink = False
+        elif name == 'Placemark':
+            self.inPlacemark = False
+        elif name == 'href' and self.href is not None:
+            href = "".join(self.href).strip()
+            if href:
+                self.networkLinks.append(href)
+            self.href = None
 
     def getExtendedDataFields(self):
         return(list(self.extendedData))
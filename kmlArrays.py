@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Conversion of KML coordinates and gx:Track values to arrays. This does not use QGIS
+so it can be run and tested on its own.
+"""
+
+import re
+from itertools import repeat
+import math
+import struct
+import warnings
+from datetime import datetime, timedelta, timezone
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+
+# Number of characters of coordinates text collected before they are converted to arrays
+COORD_CHUNK_SIZE = 262144
+# Number of gx:Track fixes collected before they are converted to arrays
+TRACK_CHUNK_SIZE = 65536
+# The characters that separate coordinate tuples
+WHITESPACE_RE = re.compile('[ \n\r\t]')
+# Little endian ISO WKB of a PointZM: byte order, geometry type and x, y, z, m
+POINT_ZM_FORMAT = '<BIdddd'
+POINT_ZM_SIZE = struct.calcsize(POINT_ZM_FORMAT)
+
+def parseTime(value, periodEnd=False):
+    '''Convert a KML dateTime, date, gYearMonth or gYear string to a UTC datetime.
+    Partial dates are the start of the period or the end of the period if periodEnd is
+    True. None is returned if it is not valid.'''
+    value = value.strip()
+    if not value:
+        return(None)
+    try:
+        if len(value) == 4:
+            t = datetime(int(value), 1, 1)
+            if periodEnd:
+                t = datetime(t.year + 1, 1, 1) - timedelta(microseconds=1)
+        elif len(value) == 7:
+            t = datetime(int(value[0:4]), int(value[5:7]), 1)
+            if periodEnd:
+                t = (t + timedelta(days=31)).replace(day=1) - timedelta(microseconds=1)
+        elif len(value) == 10:
+            t = datetime.strptime(value, '%Y-%m-%d')
+            if periodEnd:
+                t += timedelta(days=1, microseconds=-1)
+        else:
+            if value.endswith(('Z', 'z')):
+                value = value[:-1] + '+00:00'
+            t = datetime.fromisoformat(value)
+    except ValueError:
+        return(None)
+    if t.tzinfo is None:
+        return(t.replace(tzinfo=timezone.utc))
+    return(t.astimezone(timezone.utc))
+
+def coordArrays(coords):
+    """Parse a KML coordinate string into separate x, y and z sequences. These are
+    numpy arrays if numpy is available; otherwise, they are lists of floats.
+    Coordinate strings where every tuple has the same number of values are converted
+    in one call. Anything else is parsed point by point."""
+    coords = coords.strip()
+    tuples = coords.split()
+    num = len(tuples)
+    commas = set(map(str.count, tuples, repeat(',')))
+    if commas == {2}:
+        dim = 3
+    elif commas == {1}:
+        dim = 2
+    elif num == 1 and coords.count(',') >= 5 and coords.count(',') % 3 == 2:
+        # Invalid KML where the points are only separated by commas (lon,lat,alt,lon,lat,alt...)
+        dim = 3
+        num = (coords.count(',') + 1) // 3
+    else:
+        return(coordArraysByPoint(coords))
+    values = coords.replace(',', ' ').split()
+    if len(values) != dim * num:
+        # There were empty values
+        return(coordArraysByPoint(coords))
+    try:
+        if HAS_NUMPY:
+            values = np.array(values, dtype=np.float64)
+        else:
+            values = list(map(float, values))
+    except ValueError:
+        # Fall back to the point by point parser which substitutes 0 for bad values
+        return(coordArraysByPoint(coords))
+    x = values[0::dim]
+    y = values[1::dim]
+    if dim == 3:
+        z = values[2::3]
+    elif HAS_NUMPY:
+        z = np.zeros(num)
+    else:
+        z = [0.0] * num
+    return(x, y, z)
+
+class CoordinateBuffer():
+    '''Collects the character data of a coordinates element. Once COORD_CHUNK_SIZE
+    characters are waiting, the complete coordinate tuples are converted to arrays so
+    the text of very long lines and rings is never held in memory all at once.'''
+    def __init__(self):
+        self.chunks = []
+        self.size = 0  # Characters appended since the chunks were last searched
+        self.scanned = 0  # Number of chunks already searched for whitespace
+        self.parts = []  # Coordinate arrays of the text that has already been converted
+        self.result = None
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= COORD_CHUNK_SIZE:
+            self.convert()
+
+    def convert(self):
+        '''Convert everything up to the last whitespace. The text following it may be
+        the start of a tuple that continues in the next chunk. Only the chunks added
+        since the last call are searched, so text without any whitespace, such as
+        coordinates only separated by commas, is not joined again on every call.'''
+        chunks = self.chunks[self.scanned:]
+        self.scanned = len(self.chunks)
+        self.size = 0
+        if not any(map(WHITESPACE_RE.search, chunks)):
+            return
+        text = "".join(self.chunks)
+        end = max(text.rfind(' '), text.rfind('\n'), text.rfind('\r'), text.rfind('\t'))
+        head = text[:end]
+        if head.strip():
+            self.parts.append(coordArrays(head))
+        text = text[end + 1:]
+        self.chunks = [text]
+        self.scanned = 1
+
+    def value(self):
+        '''Return the text that has not been converted. This is all of the text unless
+        it was longer than COORD_CHUNK_SIZE.'''
+        return("".join(self.chunks))
+
+    def arrays(self):
+        '''Return the x, y and z arrays of all of the coordinates.'''
+        if self.result is None:
+            text = self.value()
+            self.chunks = []
+            if not self.parts:
+                self.result = coordArrays(text)
+            else:
+                if text.strip():
+                    self.parts.append(coordArrays(text))
+                self.result = joinArrays(self.parts)
+                self.parts = []
+        return(self.result)
+
+class TrackBuffer():
+    '''Collects the text of the gx:coord or when values of a gx:Track. Every
+    TRACK_CHUNK_SIZE values are converted to arrays by the convert function in one call.'''
+    def __init__(self, convert):
+        self.convert = convert
+        self.chunks = []
+        self.count = 0
+        self.parts = []
+
+    def append(self, data):
+        self.chunks.append(data)
+
+    def endValue(self):
+        # XML text cannot contain a NUL character so it safely separates the values
+        self.chunks.append('\x00')
+        self.count += 1
+        if self.count >= TRACK_CHUNK_SIZE:
+            self.convertChunks()
+
+    def convertChunks(self):
+        if self.count:
+            self.parts.append(self.convert("".join(self.chunks), self.count))
+        self.chunks = []
+        self.count = 0
+
+    def arrays(self):
+        '''Return the tuple of arrays of all of the values.'''
+        self.convertChunks()
+        if not self.parts:
+            return(self.convert("", 0))
+        result = joinArrays(self.parts)
+        self.parts = []
+        return(result)
+
+def joinArrays(parts):
+    '''Concatenate a list of tuples of coordinate arrays into one tuple of arrays.'''
+    if len(parts) == 1:
+        return(parts[0])
+    if HAS_NUMPY:
+        return(tuple(np.concatenate([part[i] for part in parts]) for i in range(len(parts[0]))))
+    return(tuple([v for part in parts for v in part[i]] for i in range(len(parts[0]))))
+
+def trackCoordArrays(text, count):
+    '''Convert the text of count gx:coord values separated by NUL characters to x, y
+    and z arrays.'''
+    values = text.replace('\x00', ' ').split()
+    if len(values) == 3 * count:
+        try:
+            if HAS_NUMPY:
+                values = np.array(values, dtype=np.float64)
+            else:
+                values = list(map(float, values))
+            return(values[0::3], values[1::3], values[2::3])
+        except ValueError:
+            pass
+    # Parse each position substituting 0 for missing or bad values
+    x = []
+    y = []
+    z = []
+    for coord in text.split('\x00')[:count]:
+        c = coord.replace(',', ' ').split()
+        values = []
+        for i in range(3):
+            try:
+                values.append(float(c[i]))
+            except (IndexError, ValueError):
+                values.append(0.0)
+        x.append(values[0])
+        y.append(values[1])
+        z.append(values[2])
+    if HAS_NUMPY:
+        return(np.array(x, dtype=np.float64), np.array(y, dtype=np.float64), np.array(z, dtype=np.float64))
+    return(x, y, z)
+
+def trackTimeArray(text, count):
+    '''Convert the text of count when values separated by NUL characters to a tuple
+    holding an array of seconds since 1970-01-01T00:00:00Z. Invalid times are NaN.'''
+    if HAS_NUMPY:
+        # numpy parses UTC times without the Z. Anything else, such as a time zone
+        # offset, falls back to parsing each time.
+        values = text.replace('Z', '').replace('\x00', ' ').split()
+        if len(values) == count:
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('error')
+                    times = np.array(values, dtype='datetime64[ms]')
+                m = times.astype(np.int64) / 1000.0
+                m[np.isnat(times)] = np.nan
+                return((m,))
+            except (ValueError, Warning):
+                pass
+    m = []
+    for value in text.split('\x00')[:count]:
+        t = parseTime(value)
+        if t is None:
+            m.append(math.nan)
+        else:
+            m.append(t.timestamp())
+    if HAS_NUMPY:
+        return((np.array(m, dtype=np.float64),))
+    return((m,))
+
+def timeString(t):
+    '''Format seconds since 1970-01-01T00:00:00Z as a KML dateTime.'''
+    if math.isnan(t):
+        return('')
+    dt = datetime(1970, 1, 1) + timedelta(seconds=float(t))
+    if dt.microsecond:
+        return(dt.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z')
+    return(dt.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+def timeStrings(m):
+    '''Format an array of seconds since 1970-01-01T00:00:00Z as a list of KML dateTime
+    strings. These are the same as the strings of timeString but numpy formats all of
+    them in one call.'''
+    if not HAS_NUMPY:
+        return([timeString(t) for t in m])
+    valid = ~np.isnan(m)
+    us = np.zeros(len(m), dtype=np.int64)
+    us[valid] = np.round(m[valid] * 1e6)
+    times = us.astype('datetime64[us]')
+    text = np.where(us % 1000000 == 0, np.datetime_as_string(times, unit='s'),
+        np.datetime_as_string(times, unit='ms'))
+    text = np.char.add(text, 'Z')
+    text[~valid] = ''
+    return(text.tolist())
+
+def pointZMWkb(x, y, z, m):
+    '''Return a list of the WKB of a PointZM at each position of the x, y, z and m
+    arrays. With numpy the WKB of all of the points is packed in one call.'''
+    if not HAS_NUMPY:
+        return([struct.pack(POINT_ZM_FORMAT, 1, 3001, *p) for p in zip(x, y, z, m)])
+    records = np.empty(len(x), dtype=[
+        ('order', 'u1'), ('type', '<u4'), ('x', '<f8'), ('y', '<f8'), ('z', '<f8'), ('m', '<f8')])
+    records['order'] = 1
+    records['type'] = 3001
+    records['x'] = x
+    records['y'] = y
+    records['z'] = z
+    records['m'] = m
+    data = records.tobytes()
+    return([data[i:i + POINT_ZM_SIZE] for i in range(0, len(data), POINT_ZM_SIZE)])
+
+def resize(values, size):
+    '''Truncate values or pad it with NaN to the length size.'''
+    if len(values) >= size:
+        return(values[:size])
+    if HAS_NUMPY:
+        return(np.concatenate([values, np.full(size - len(values), np.nan)]))
+    return(values + [math.nan] * (size - len(values)))
+
+def coordArraysByPoint(coords):
+    x = []
+    y = []
+    z = []
+    clist = re.split(r'\s+', coords)
+
+    for pt in clist:
+        c = pt.split(',')
+        if len(c) >= 6:
+            '''This is invalid KML syntax, but given some KMLs have been formatted
+            this way the invalid exception is looked for. There should be a space
+            between line string coordinates. This looks for a comma between them and
+            also assumes it is formatted as lat,lon,altitude,lat,lon,altitude...'''
+            i = 0
+            while i < len(c) - 1:
+                try:
+                    lon = float(c[i])
+                    lat = float(c[i + 1])
+                except Exception:
+                    lon = 0.0
+                    lat = 0.0
+                try:
+                    altitude = float(c[i + 2])
+                except Exception:
+                    altitude = 0.0
+                x.append(lon)
+                y.append(lat)
+                z.append(altitude)
+                i += 3
+        else:
+            altitude = 0.0
+            try:
+                lon = float(c[0])
+                lat = float(c[1])
+                if len(c) >= 3:
+                    altitude = float(c[2])
+            except Exception:
+                lon = 0.0
+                lat = 0.0
+
+            x.append(lon)
+            y.append(lat)
+            z.append(altitude)
+
+    if HAS_NUMPY:
+        return(np.array(x, dtype=np.float64), np.array(y, dtype=np.float64), np.array(z, dtype=np.float64))
+    return(x, y, z)
+
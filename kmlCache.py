@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import re
+import stat
+import time
+import pickle
+import shutil
+import hashlib
+import tempfile
+
+# Increment this when the format of the cached results changes
+CACHE_VERSION = 4
+# Names of the feature spools returned for each document
+SPOOL_NAMES = ('points', 'lines', 'polygons', 'tracks', 'trackPoints', 'overlays')
+# Default maximum size of the cache in MB
+DEFAULT_CACHE_SIZE = 1024
+
+ENTRY_FILE = 'entry.pickle'
+STAT_PREFIX = 'stat-'
+# Entries are named by the SHA-256 hex digest of the document
+KEY_RE = re.compile(r'[0-9a-f]{64}$')
+
+def defaultCacheDirectory():
+    '''Return the cache folder in the QGIS profile of the current user.'''
+    from qgis.core import QgsApplication
+    return(os.path.join(QgsApplication.qgisSettingsDirPath(), 'kmltools', 'cache'))
+
+def isOwned(st):
+    '''Return True if the os.stat result st is of a file owned by the current user.
+    File ownership is not checked on Windows.'''
+    return(os.name != 'posix' or st.st_uid == os.getuid())
+
+def checkDirectory(directory):
+    '''Raise OSError unless the cache folder belongs to the current user. Others are
+    denied access to it since the cached entries are unpickled, which can run code.'''
+    st = os.stat(directory)
+    if not isOwned(st):
+        raise OSError('The cache folder {} belongs to another user'.format(directory))
+    if os.name == 'posix' and stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+
+def removeSpools(result):
+    '''Remove the feature spool files of result.'''
+    for name in SPOOL_NAMES:
+        (filename, count) = result[name]
+        if filename:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+class ParseCache():
+    '''Disk cache of the parsed results of KML documents. Each entry is a folder named
+    by the content hash of the document holding its feature spools and a pickled
+    dictionary of the rest of the result. A small index file maps the path, modification
+    time and size of a document to its content hash so an unchanged file is not read
+    to find its entry. Entries are evicted least recently used first. The folder must
+    belong to the current user and only entries that the user wrote are read.'''
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        checkDirectory(directory)
+
+    def key(self, source, options):
+        '''Return the cache key of the documents of the KmlSource source imported
+        with options.'''
+        options = 'kmltools {} {}'.format(CACHE_VERSION, options)
+        members = None
+        if source.kmz:
+            members = [info.filename for info in source.documents]
+        st = os.stat(source.filename)
+        stat_key = hashlib.sha256(repr((
+            os.path.normcase(os.path.abspath(source.filename)), members,
+            st.st_mtime_ns, st.st_size, options)).encode('utf-8')).hexdigest()
+        index = os.path.join(self.directory, STAT_PREFIX + stat_key)
+        try:
+            with open(index, 'r') as f:
+                key = f.read().strip()
+            if KEY_RE.match(key) and os.path.isdir(os.path.join(self.directory, key)):
+                return(key)
+        except OSError:
+            pass
+        key = source.contentHash(options)
+        try:
+            with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as f:
+                f.write(key)
+            os.replace(f.name, index)
+        except OSError:
+            pass
+        return(key)
+
+    def get(self, key):
+        '''Return the cached result for key or None if there is none.'''
+        folder = os.path.join(self.directory, key)
+        entry = os.path.join(folder, ENTRY_FILE)
+        try:
+            # An entry left by another user, such as in a folder that others could
+            # once write to, is ignored
+            if not isOwned(os.stat(folder)):
+                return(None)
+            with open(entry, 'rb') as f:
+                if not isOwned(os.fstat(f.fileno())):
+                    return(None)
+                result = pickle.load(f)
+            # Mark the entry as recently used
+            os.utime(entry)
+        except Exception:
+            return(None)
+        return(self.entryResult(folder, result))
+
+    def entryResult(self, folder, entry):
+        '''Return the result of the cache entry in folder from its pickled dictionary.'''
+        result = dict(entry)
+        for name in SPOOL_NAMES:
+            (filename, count) = entry[name]
+            result[name] = (os.path.join(folder, filename), count)
+        result['cached'] = True
+        return(result)
+
+    def put(self, key, result):
+        '''Move the feature spools of result into the cache and return the cached result.
+        If it cannot be added to the cache, then OSError is raised and the spools are
+        moved back so that result can still be used.'''
+        folder = tempfile.mkdtemp(dir=self.directory)
+        entry = dict(result)
+        moved = []
+        try:
+            for name in SPOOL_NAMES:
+                (filename, count) = result[name]
+                spool = os.path.join(folder, name + '.spool')
+                if filename:
+                    shutil.move(filename, spool)
+                    moved.append((spool, filename))
+                else:
+                    open(spool, 'wb').close()
+                entry[name] = (name + '.spool', count)
+            with open(os.path.join(folder, ENTRY_FILE), 'wb') as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(folder, os.path.join(self.directory, key))
+        except OSError:
+            for (spool, filename) in moved:
+                shutil.move(spool, filename)
+            shutil.rmtree(folder, ignore_errors=True)
+            # Another import may have added the same document
+            cached = self.get(key)
+            if cached is None:
+                raise
+            removeSpools(result)
+            return(cached)
+        return(self.entryResult(os.path.join(self.directory, key), entry))
+
+    def evict(self, maxSize):
+        '''Remove the least recently used entries until the cache is no larger than
+        maxSize bytes and return the number of entries removed.'''
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            items = list(it)
+        for item in items:
+            if not item.is_dir():
+                continue
+            size = 0
+            used = None
+            for root, dirs, files in os.walk(item.path):
+                for name in files:
+                    try:
+                        st = os.stat(os.path.join(root, name))
+                    except OSError:
+                        continue
+                    size += st.st_size
+                    if name == ENTRY_FILE:
+                        used = st.st_mtime
+            if used is None:
+                # Left behind by an interrupted import. Keep it a while in case it
+                # is still being written.
+                try:
+                    used = item.stat().st_mtime
+                except OSError:
+                    continue
+                if time.time() - used > 3600:
+                    used = 0
+            entries.append((used, size, item.name))
+            total += size
+        entries.sort()
+        removed = set()
+        for used, size, name in entries:
+            if total <= maxSize:
+                break
+            shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+            removed.add(name)
+            total -= size
+        # Remove the index files of entries that no longer exist
+        names = set([name for used, size, name in entries]) - removed
+        for item in items:
+            if item.name.startswith(STAT_PREFIX) and item.is_file():
+                try:
+                    with open(item.path, 'r') as f:
+                        key = f.read().strip()
+                    if key not in names:
+                        os.remove(item.path)
+                except OSError:
+                    pass
+        return(len(removed))
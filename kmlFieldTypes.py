@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import re
+from qgis.PyQt.QtCore import QVariant, QDateTime, Qt
+
+# How the types of the ExtendedData fields are chosen
+TYPES_TEXT = 0
+TYPES_SCHEMA = 1
+TYPES_INFER = 2
+FIELD_TYPE_MODES = ['All fields are text', 'Use the Schema SimpleField types',
+    'Use the Schema types and infer the other types from a sample of values']
+
+# Number of values of each field used to infer its type. The later values are only
+# checked against the inferred type.
+SAMPLE_SIZE = 1000
+
+# KML SimpleField types to field types
+SCHEMA_TYPES = {
+    'string': 'string',
+    'int': 'int',
+    'short': 'int',
+    'ushort': 'int',
+    'uint': 'longlong',
+    'float': 'double',
+    'double': 'double',
+    'bool': 'bool'
+}
+
+FIELD_TYPES = {
+    'string': QVariant.String,
+    'int': QVariant.Int,
+    'longlong': QVariant.LongLong,
+    'double': QVariant.Double,
+    'bool': QVariant.Bool,
+    'datetime': QVariant.DateTime
+}
+
+# The numeric types from narrowest to widest
+NUMERIC_TYPES = ('int', 'longlong', 'double')
+MAX_INT = 2147483647
+MAX_LONGLONG = 9223372036854775807
+
+# Numbers with leading zeros such as postal codes are kept as text
+INT_RE = re.compile(r'[+-]?(0|[1-9]\d*)$')
+DOUBLE_RE = re.compile(r'[+-]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?$')
+DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:?\d{2})?)?$')
+
+def valueType(value):
+    '''Return the narrowest field type that can hold the text value.'''
+    if INT_RE.match(value):
+        n = abs(int(value))
+        if n > MAX_LONGLONG:
+            return('string')
+        if n > MAX_INT:
+            return('longlong')
+        return('int')
+    if DOUBLE_RE.match(value):
+        return('double')
+    if DATETIME_RE.match(value):
+        return('datetime')
+    return('string')
+
+def widerType(type1, type2):
+    '''Return the field type that can hold the values of both types. None is the
+    type of a field without any values.'''
+    if type1 is None or type1 == type2:
+        return(type2)
+    if type2 is None:
+        return(type1)
+    if type1 in NUMERIC_TYPES and type2 in NUMERIC_TYPES:
+        return(max(type1, type2, key=NUMERIC_TYPES.index))
+    return('string')
+
+def mergeTypes(types, other):
+    '''Add the field types of other to the dictionary types.'''
+    for name, fieldtype in other.items():
+        types[name] = widerType(types.get(name), fieldtype)
+
+def toInt(value):
+    try:
+        n = int(value)
+    except ValueError:
+        return(None)
+    if abs(n) > MAX_INT:
+        return(None)
+    return(n)
+
+def toLongLong(value):
+    try:
+        n = int(value)
+    except ValueError:
+        return(None)
+    if abs(n) > MAX_LONGLONG:
+        return(None)
+    return(n)
+
+def toDouble(value):
+    try:
+        return(float(value))
+    except ValueError:
+        return(None)
+
+def toBool(value):
+    value = value.lower()
+    if value in ('1', 'true'):
+        return(True)
+    if value in ('0', 'false'):
+        return(False)
+    return(None)
+
+def toDateTime(value):
+    dt = QDateTime.fromString(value, Qt.ISODate)
+    if dt.isValid():
+        return(dt)
+    return(None)
+
+CONVERTERS = {
+    'int': toInt,
+    'longlong': toLongLong,
+    'double': toDouble,
+    'bool': toBool,
+    'datetime': toDateTime
+}
+
+def fieldType(types, name):
+    '''Return the QVariant type of the field name.'''
+    return(FIELD_TYPES[types.get(name) or 'string'])
+
+def converters(types, names):
+    '''Return the list of functions that convert the text values of the fields
+    names. Text fields have None.'''
+    return([CONVERTERS.get(types.get(name)) for name in names])
+
+class FieldTypes():
+    '''Chooses the types of the ExtendedData fields from their Schema SimpleField
+    declarations and, with TYPES_INFER, from the first sampleSize values of the
+    other fields. A later value that does not fit the inferred type widens the field
+    to the type that holds it.'''
+    def __init__(self, mode, sampleSize=SAMPLE_SIZE):
+        self.infer = mode == TYPES_INFER
+        self.sampleSize = sampleSize
+        self.declared = {}
+        self.inferred = {}
+        self.counts = {}
+
+    def declare(self, name, kmltype):
+        if name and kmltype and name not in self.declared:
+            self.declared[name] = SCHEMA_TYPES.get(kmltype.strip().lower(), 'string')
+
+    def sample(self, name, value):
+        if not self.infer or not value or name in self.declared:
+            return
+        current = self.inferred.get(name)
+        if current == 'string':
+            return
+        count = self.counts.get(name, 0)
+        if count < self.sampleSize:
+            self.counts[name] = count + 1
+            self.inferred[name] = widerType(current, valueType(value))
+        elif CONVERTERS[current](value) is None:
+            self.inferred[name] = widerType(current, valueType(value))
+
+    def types(self):
+        '''Return the dictionary of field names to their types.'''
+        types = dict(self.inferred)
+        types.update(self.declared)
+        return(types)
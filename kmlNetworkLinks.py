@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import posixpath
+from urllib.parse import urlparse, unquote
+from urllib.request import url2pathname
+from concurrent.futures import ThreadPoolExecutor
+
+from .kmlReader import KmlSource
+
+def linkLocation(href, source, base=None):
+    '''Return the (filename, member) location of a NetworkLink href found in the
+    KmlSource source. member is the name of a KML document within a KMZ file or None.
+    base is the name of the KMZ member containing the link. None is returned if the
+    href does not refer to a local file.'''
+    href = href.strip()
+    if not href:
+        return(None)
+    url = urlparse(href)
+    if url.scheme == 'file':
+        path = url.path
+        if url.netloc:
+            path = '//' + url.netloc + path
+        return((url2pathname(path), None))
+    if len(url.scheme) > 1:
+        # A remote link. A single letter is a Windows drive letter.
+        return(None)
+    if len(url.scheme) == 1:
+        path = href
+    else:
+        path = unquote(url.path)
+    if not path:
+        return(None)
+    if source.kmz is not None and not os.path.isabs(path):
+        # Look for the file within the KMZ first
+        if base is None:
+            base = source.documents[0].filename
+        member = posixpath.normpath(posixpath.join(posixpath.dirname(base), path.replace('\\', '/')))
+        if member in source.memberNames():
+            return((source.filename, member))
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(source.filename), path)
+    return((os.path.normpath(path), None))
+
+def locationKey(location):
+    (filename, member) = location
+    return((os.path.normcase(os.path.abspath(filename)), member))
+
+class NetworkLinkResolver():
+    '''Follows the NetworkLinks to local KML/KMZ files. The linked documents are parsed
+    by parseDocument(source) on a thread pool one level of links at a time up to a depth
+    of maxDepth. parseDocument returns a dictionary with the named feature spools of
+    SPOOL_NAMES and the 'extData' names, 'links' hrefs and 'groundOverlay' flag. If
+    cache is a ParseCache, then unchanged documents are not parsed again.'''
+    def __init__(self, parseDocument, options, maxDepth, cache=None, feedback=None, workers=None):
+        self.parseDocument = parseDocument
+        # The import options that change the result are part of the cache key
+        self.options = options
+        self.maxDepth = maxDepth
+        self.cache = cache
+        self.feedback = feedback
+        self.workers = workers or min(8, os.cpu_count() or 1)
+        self.visited = set()
+        self.numCached = 0
+        self.numRemote = 0
+        self.missing = []
+        self.cacheErrors = []
+
+    def resolve(self, source, links):
+        '''Return the results of the documents linked to by the hrefs in links found in
+        the KmlSource source. The documents of source are never imported again.'''
+        for doc in source.documents:
+            if source.kmz:
+                self.visited.add(locationKey((source.filename, doc.filename)))
+            else:
+                self.visited.add(locationKey((doc, None)))
+        if source.kmz:
+            self.visited.add(locationKey((source.filename, None)))
+        results = []
+        level = self.unvisited([linkLocation(href, source) for href in links])
+        depth = 1
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while level and depth <= self.maxDepth:
+                if self.feedback and self.feedback.isCanceled():
+                    break
+                next_level = []
+                for result in executor.map(self.load, level):
+                    if 'missing' in result:
+                        self.missing.append(result['missing'])
+                        continue
+                    if result['hit']:
+                        self.numCached += 1
+                    if 'cacheError' in result:
+                        self.cacheErrors.append(result['cacheError'])
+                    results.append(result)
+                    next_level.extend(self.unvisited(result['childLocations']))
+                level = next_level
+                depth += 1
+        return(results)
+
+    def unvisited(self, locations):
+        '''Return the locations that have not already been visited. A location of
+        None is a link to a remote file.'''
+        remaining = []
+        for location in locations:
+            if location is None:
+                self.numRemote += 1
+                continue
+            key = locationKey(location)
+            if key in self.visited:
+                continue
+            self.visited.add(key)
+            remaining.append(location)
+        return(remaining)
+
+    def load(self, location):
+        '''Parse, or fetch from the cache, the document at location. This runs on the
+        thread pool so it does not change the state of the resolver. The result has
+        'cached' set if its spools belong to the cache, 'hit' set if it was found
+        in the cache and 'cacheError' set if it could not be added to the cache.'''
+        (filename, member) = location
+        try:
+            source = KmlSource(filename, False, member)
+        except Exception:
+            return({'missing': filename if member is None else '{} ({})'.format(filename, member)})
+        try:
+            result = None
+            if self.cache:
+                key = self.cache.key(source, self.options)
+                result = self.cache.get(key)
+            hit = result is not None
+            if result is None:
+                result = self.parseDocument(source)
+                if self.cache and not result.get('error'):
+                    try:
+                        result = self.cache.put(key, result)
+                    except OSError as e:
+                        # The spools of the result were left in place so it is used uncached
+                        result['cacheError'] = str(e)
+            result['hit'] = hit
+            result['location'] = location
+            # Relative links are resolved from the location of this document
+            result['childLocations'] = [linkLocation(href, source, member) for href in result['links']]
+        finally:
+            source.close()
+        return(result)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import xml.sax
+import xml.sax.xmlreader
+import xml.parsers.expat
+try:
+    from lxml import etree
+    HAS_LXML = True
+except Exception:
+    HAS_LXML = False
+
+# The parser backends that can drive a SAX ContentHandler
+SAX_BACKEND = 0
+EXPAT_BACKEND = 1
+LXML_BACKEND = 2
+PARSER_BACKENDS = ['Python SAX', 'Expat', 'lxml iterparse (if installed)']
+
+BUFFER_SIZE = 65536
+
+def parseKml(stream, handler, backend=EXPAT_BACKEND):
+    '''Parse a KML stream calling the startElement, characters, endElement and endDocument
+    methods of the SAX ContentHandler. The stream is closed when parsing is finished.'''
+    if backend == LXML_BACKEND and HAS_LXML:
+        parseLxml(stream, handler)
+    elif backend == SAX_BACKEND:
+        parseSax(stream, handler)
+    else:
+        parseExpat(stream, handler)
+
+def parseSax(stream, handler):
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+    input_source = xml.sax.xmlreader.InputSource()
+    input_source.setByteStream(stream)
+    input_source.setEncoding('utf-8')
+    try:
+        parser.parse(input_source)
+    finally:
+        stream.close()
+
+def parseExpat(stream, handler):
+    '''Drive the handler directly from pyexpat without the xml.sax layers. Character
+    data is buffered by expat so long text is delivered in fewer calls.'''
+    parser = xml.parsers.expat.ParserCreate('utf-8')
+    parser.buffer_text = True
+    parser.buffer_size = BUFFER_SIZE
+    parser.StartElementHandler = handler.startElement
+    parser.EndElementHandler = handler.endElement
+    parser.CharacterDataHandler = handler.characters
+    try:
+        handler.startDocument()
+        while True:
+            data = stream.read(BUFFER_SIZE)
+            if not data:
+                break
+            parser.Parse(data, False)
+        parser.Parse(b'', True)
+        handler.endDocument()
+    finally:
+        stream.close()
+
+class Utf8Reader():
+    '''lxml needs bytes so text streams are encoded back to UTF-8.'''
+    def __init__(self, stream):
+        self.stream = stream
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if isinstance(data, str):
+            return(data.encode('utf-8', errors='backslashreplace'))
+        return(data)
+
+def parseLxml(stream, handler):
+    '''Use lxml iterparse. Text is delivered to the handler in document order and each
+    Placemark subtree is cleared once it has been processed to keep memory bounded.'''
+    qnames = {}
+    try:
+        handler.startDocument()
+        context = etree.iterparse(
+            Utf8Reader(stream), events=('start', 'end'), encoding='utf-8',
+            remove_comments=True, remove_pis=True, huge_tree=True, resolve_entities=False)
+        for event, elem in context:
+            key = (elem.tag, elem.prefix)
+            name = qnames.get(key)
+            if name is None:
+                name = etree.QName(elem).localname
+                if elem.prefix:
+                    name = elem.prefix + ':' + name
+                qnames[key] = name
+            if event == 'start':
+                # Send the text that precedes this element within its parent
+                previous = elem.getprevious()
+                if previous is not None:
+                    if previous.tail:
+                        handler.characters(previous.tail)
+                else:
+                    parent = elem.getparent()
+                    if parent is not None and parent.text:
+                        handler.characters(parent.text)
+                handler.startElement(name, elem.attrib)
+            else:
+                # Send the text that follows the last child element
+                if len(elem):
+                    text = elem[-1].tail
+                else:
+                    text = elem.text
+                if text:
+                    handler.characters(text)
+                handler.endElement(name)
+                if name.endswith('Placemark'):
+                    elem.clear(keep_tail=True)
+                    parent = elem.getparent()
+                    if parent is not None:
+                        while elem.getprevious() is not None:
+                            del parent[0]
+        handler.endDocument()
+    finally:
+        stream.close()
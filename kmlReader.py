@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import io
+import sys
+import time
+import hashlib
+import tempfile
+from zipfile import ZipFile
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Size of the chunks handed to the XML parser
+BUFFER_SIZE = 65536
+
+class ImportCanceled(Exception):
+    '''Raised from within the parse of a document when the import is canceled.'''
+    pass
+
+class CountingReader(io.RawIOBase):
+    '''Raw binary stream wrapper that keeps track of the number of bytes read. It is
+    below any decompression or decoding so progress is the offset into the document.'''
+    def __init__(self, stream, source):
+        io.RawIOBase.__init__(self)
+        self.stream = stream
+        self.source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        data = self.stream.read(len(b))
+        n = len(data)
+        b[:n] = data
+        self.source.bytesRead += n
+        if self.source.feedback is not None:
+            self.source.reportProgress()
+        return n
+
+    def close(self):
+        self.stream.close()
+        io.RawIOBase.close(self)
+
+class CopyingReader():
+    '''Reads a stream and writes a copy of the data to a temporary file. Once the end
+    of the stream is reached the copy is registered with the KmlSource so the next pass
+    reads it instead of decompressing the KMZ member again.'''
+    def __init__(self, stream, source, name):
+        self.stream = stream
+        self.source = source
+        self.name = name
+        self.copy = tempfile.NamedTemporaryFile(suffix='.kml', delete=False)
+
+    def read(self, size):
+        data = self.stream.read(size)
+        if self.copy is not None:
+            if data:
+                self.copy.write(data)
+            else:
+                self.copy.close()
+                self.source.copies[self.name] = self.copy.name
+                self.copy = None
+        return(data)
+
+    def close(self):
+        self.stream.close()
+        if self.copy is not None:
+            # The document was not read to the end so the copy is incomplete
+            self.copy.close()
+            os.remove(self.copy.name)
+            self.copy = None
+
+class KmlSource():
+    '''Opens a KML or KMZ file for reading. A KMZ archive is only opened once and
+    its KML documents are decompressed as a stream when they are read. If member is
+    given, then only that KML document within the KMZ file is read.'''
+    def __init__(self, filename, allDocuments=False, member=None):
+        self.filename = filename
+        f, extension = os.path.splitext(filename)
+        self.extension = extension.lower()
+        self.kmz = None
+        self.bytesRead = 0
+        self.startTime = time.time()
+        self.feedback = None
+        self.copies = {}  # Temporary files holding the decompressed KMZ documents
+        if self.extension == '.kmz':
+            self.kmz = ZipFile(filename, 'r')
+            if member:
+                self.documents = [self.kmz.getinfo(member)]
+            else:
+                self.documents = self.kmzDocuments(allDocuments)
+            self.totalBytes = sum([info.file_size for info in self.documents])
+        else:
+            self.documents = [filename]
+            self.totalBytes = os.path.getsize(filename)
+
+    def kmzDocuments(self, allDocuments):
+        '''Return the ZipInfo of doc.kml followed by the other KML documents. If
+        allDocuments is False, then only the first of these is returned.'''
+        docs = []
+        for info in self.kmz.infolist():
+            if info.filename == 'doc.kml':
+                docs.insert(0, info)
+            elif info.filename.endswith('.kml'):
+                docs.append(info)
+        if not docs:
+            raise ValueError("Couldn't find kml document in kmz file")
+        if allDocuments:
+            return(docs)
+        return(docs[:1])
+
+    def streams(self, keep=False):
+        '''Generator returning a new stream for each KML document. This can be called
+        more than once when multiple passes through the documents are needed. If keep is
+        True, then the decompressed KMZ documents are kept in temporary files so that
+        the next pass does not decompress them again.'''
+        for doc in self.documents:
+            if self.kmz:
+                if doc.filename in self.copies:
+                    stream = open(self.copies[doc.filename], 'rb')
+                else:
+                    stream = self.kmz.open(doc, 'r')
+                    if keep:
+                        stream = CopyingReader(stream, self, doc.filename)
+                raw = CountingReader(stream, self)
+                yield io.BufferedReader(raw, BUFFER_SIZE)
+            else:
+                raw = CountingReader(open(doc, 'rb'), self)
+                yield io.TextIOWrapper(io.BufferedReader(raw, BUFFER_SIZE), encoding="utf-8", errors="backslashreplace")
+
+    def setFeedback(self, feedback, passes=1):
+        '''Report the progress of reading the documents passes times to feedback. Once
+        the import is canceled reading raises ImportCanceled.'''
+        self.feedback = feedback
+        self.progressStart = self.bytesRead
+        self.progressTotal = max(self.totalBytes * passes, 1)
+
+    def reportProgress(self):
+        if self.feedback.isCanceled():
+            raise ImportCanceled()
+        self.feedback.setProgress(min(100.0, (self.bytesRead - self.progressStart) * 100.0 / self.progressTotal))
+
+    def contentHash(self, prefix=''):
+        '''Return the SHA-256 hex digest of prefix followed by the content of the KML
+        documents that will be read.'''
+        digest = hashlib.sha256(prefix.encode('utf-8'))
+        for doc in self.documents:
+            if self.kmz:
+                stream = self.kmz.open(doc, 'r')
+            else:
+                stream = open(doc, 'rb')
+            with stream:
+                while True:
+                    data = stream.read(BUFFER_SIZE)
+                    if not data:
+                        break
+                    digest.update(data)
+        return(digest.hexdigest())
+
+    def memberNames(self):
+        '''Return the set of file names within a KMZ file.'''
+        if self.kmz:
+            return(set(self.kmz.namelist()))
+        return(set())
+
+    def throughput(self):
+        '''Return a string describing the number of bytes read and the read rate.'''
+        elapsed = time.time() - self.startTime
+        mb = self.bytesRead / 1048576.0
+        if elapsed > 0:
+            rate = mb / elapsed
+        else:
+            rate = 0
+        return('{:.1f} MB read in {:.1f} seconds ({:.1f} MB/s)'.format(mb, elapsed, rate))
+
+    def close(self):
+        if self.kmz:
+            self.kmz.close()
+            self.kmz = None
+        for name in self.copies.values():
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+        self.copies = {}
+
+def peakMemory():
+    '''Return a string describing the peak resident memory use of this process or None
+    if it is not available on this platform.'''
+    if resource is None:
+        return(None)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # macOS reports bytes rather than kilobytes
+        peak /= 1024.0
+    return('Peak memory use {:.1f} MB'.format(peak / 1024.0))
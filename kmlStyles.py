@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+from qgis.PyQt.QtGui import QColor
+from qgis.core import (
+    QgsCategorizedSymbolRenderer, QgsFeatureRequest, QgsProcessingLayerPostProcessorInterface,
+    QgsRendererCategory, QgsSymbol, QgsUnitTypes, QgsWkbTypes)
+
+# Style attributes added after the standard placemark attributes
+STYLE_FIELDS = ('style_id', 'line_color', 'line_width', 'fill_color', 'icon_href', 'icon_color', 'icon_scale')
+NUMERIC_STYLE_FIELDS = ('line_width', 'icon_scale')
+
+# The style values collected from each (parent, element) pair
+STYLE_ELEMENTS = {
+    ('LineStyle', 'color'): 'line_color',
+    ('LineStyle', 'width'): 'line_width',
+    ('PolyStyle', 'color'): 'fill_color',
+    ('PolyStyle', 'fill'): 'fill',
+    ('IconStyle', 'color'): 'icon_color',
+    ('IconStyle', 'scale'): 'icon_scale',
+    ('Icon', 'href'): 'icon_href'
+}
+# Number of StyleMaps followed before a styleUrl is treated as unresolved
+MAX_STYLE_DEPTH = 8
+
+def kmlColor(value):
+    '''Convert a KML aabbggrr color to #aarrggbb as used by QColor. An empty string
+    is returned if it is not a valid color.'''
+    value = value.strip().lstrip('#')
+    if len(value) != 8:
+        return('')
+    try:
+        int(value, 16)
+    except ValueError:
+        return('')
+    return('#' + value[0:2] + value[6:8] + value[4:6] + value[2:4])
+
+def styleId(url):
+    '''Return the style id referred to by a styleUrl. An empty string is returned for
+    a style in another document since only the styles of this document are known.'''
+    url = url.strip()
+    if '#' in url:
+        (document, styleid) = url.rsplit('#', 1)
+        if document:
+            return('')
+        return(styleid)
+    return(url)
+
+class StyleReader():
+    '''Collects the values of a Style or StyleMap element. The handler forwards the
+    events of the child elements until endElement returns True.'''
+    def __init__(self, tag, attr):
+        self.isMap = tag == 'StyleMap'
+        self.id = attr.get('id')
+        self.path = []
+        self.text = None
+        self.values = {}  # Style values
+        self.pairs = {}  # StyleMap key to its styleUrl or values of its inline Style
+        self.pair = None
+
+    def startElement(self, tag, attr):
+        self.path.append(tag)
+        if tag == 'Pair':
+            self.pair = {'key': 'normal', 'url': None, 'values': {}}
+        self.text = []
+
+    def characters(self, data):
+        if self.text is not None:
+            self.text.append(data)
+
+    def endElement(self, tag):
+        '''Return True when the Style or StyleMap element ends.'''
+        if not self.path:
+            return(True)
+        self.path.pop()
+        if self.text is not None:
+            value = ''.join(self.text).strip()
+            self.text = None
+            self.setValue(tag, value)
+        if tag == 'Pair' and self.pair is not None:
+            self.pairs[self.pair['key']] = self.pair
+            self.pair = None
+        return(False)
+
+    def setValue(self, tag, value):
+        parent = self.path[-1] if self.path else None
+        if self.pair is not None:
+            if parent == 'Pair':
+                if tag == 'key':
+                    self.pair['key'] = value
+                elif tag == 'styleUrl':
+                    self.pair['url'] = value
+                return
+            values = self.pair['values']
+        else:
+            values = self.values
+        name = STYLE_ELEMENTS.get((parent, tag))
+        if name is None or not value:
+            return
+        if name.endswith('color'):
+            value = kmlColor(value)
+        elif name in NUMERIC_STYLE_FIELDS:
+            try:
+                value = float(value)
+            except ValueError:
+                return
+        values[name] = value
+
+def styleAttributes(styleid, values):
+    '''Return the style attribute list of the style values.'''
+    attr = [styleid]
+    for name in STYLE_FIELDS[1:]:
+        attr.append(values.get(name, None if name in NUMERIC_STYLE_FIELDS else ''))
+    fill_color = attr[3]
+    if fill_color and values.get('fill') == '0':
+        # Not filled so make the fill color transparent
+        attr[3] = '#00' + fill_color[3:]
+    return(attr)
+
+class StyleIndex():
+    '''Index of the shared Style and StyleMap elements by their id. The style
+    attributes of each styleUrl are resolved once and then looked up. A style may be
+    defined after the placemarks that use it, so once the document has been read
+    lateAttributes returns the attributes of the styles that were missing when they
+    were looked up.'''
+    def __init__(self):
+        self.styles = {}
+        self.maps = {}
+        self.resolved = {}  # styleUrl to its style attributes
+        self.inline = {}  # Values of an inline style to its generated style id
+        self.missing = set()  # Style ids that were looked up before they were defined
+        self.lateInline = {}  # Generated style id to the styleUrl and inline values of a missing style
+
+    def add(self, reader):
+        if not reader.id:
+            return
+        if reader.isMap:
+            self.maps[reader.id] = reader.pairs
+        else:
+            self.styles[reader.id] = reader.values
+        # A style added after a styleUrl was resolved may change its result
+        self.resolved.clear()
+
+    def lookup(self, styleid, depth=0):
+        '''Return the id and values of the Style referred to by styleid following
+        the normal Pair of StyleMaps.'''
+        values = self.styles.get(styleid)
+        if values is not None:
+            return(styleid, values)
+        pairs = self.maps.get(styleid)
+        if pairs is None:
+            if styleid:
+                self.missing.add(styleid)
+            return(styleid, {})
+        if depth >= MAX_STYLE_DEPTH:
+            return(styleid, {})
+        pair = pairs.get('normal')
+        if pair is None:
+            return(styleid, {})
+        if pair['values']:
+            return(styleid, pair['values'])
+        if pair['url']:
+            return(self.lookup(styleId(pair['url']), depth + 1))
+        return(styleid, {})
+
+    def attributes(self, url, inline=None):
+        '''Return the style attributes of a placemark with styleUrl url and the
+        values of its inline Style if it has one.'''
+        attr = self.resolved.get(url)
+        if attr is None:
+            styleid = styleId(url)
+            if styleid:
+                (styleid, values) = self.lookup(styleid)
+            else:
+                values = {}
+            attr = styleAttributes(styleid, values)
+            self.resolved[url] = attr
+        if not inline:
+            return(attr)
+        # The inline style overrides the values of the shared style
+        if attr[0]:
+            (styleid, values) = self.lookup(attr[0])
+            values = dict(values)
+            values.update(inline)
+        else:
+            values = inline
+        # An inline style over a style that is not defined yet gets an id of its own
+        # so that it can be resolved again later
+        late = attr[0] if self.isMissing(attr[0]) else ''
+        key = (late, tuple(sorted(values.items())))
+        styleid = self.inline.get(key)
+        if styleid is None:
+            styleid = 'inline{}'.format(len(self.inline) + 1)
+            self.inline[key] = styleid
+            if late:
+                self.lateInline[styleid] = (url, inline)
+        return(styleAttributes(styleid, values))
+
+    def isMissing(self, styleid):
+        '''Return True if styleid is not the id of a Style or StyleMap.'''
+        return(bool(styleid) and styleid not in self.styles and styleid not in self.maps)
+
+    def lateAttributes(self):
+        '''Return a dictionary from the style_id of the placemarks whose style was
+        missing when they were read to their style attributes now that the style has
+        been defined.'''
+        late = {}
+        for styleid in self.missing:
+            if not self.isMissing(styleid):
+                late[styleid] = self.attributes('#' + styleid)
+        for styleid, (url, inline) in self.lateInline.items():
+            attr = self.attributes(url, inline)
+            if attr[0] != styleid:
+                late[styleid] = attr
+        return(late)
+
+def categorizedRenderer(layer):
+    '''Return a categorized renderer on style_id using the style attributes of the
+    first feature of each style. None is returned if the layer has no style_id.'''
+    fields = layer.fields()
+    indices = [fields.indexOf(name) for name in STYLE_FIELDS]
+    if min(indices) < 0:
+        return(None)
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(indices)
+    styles = {}
+    for feature in layer.getFeatures(request):
+        styleid = feature[indices[0]]
+        if styleid not in styles:
+            styles[styleid] = dict(zip(STYLE_FIELDS, [feature[i] for i in indices]))
+    geometry_type = layer.geometryType()
+    categories = []
+    for styleid in sorted(styles, key=str):
+        values = styles[styleid]
+        symbol = QgsSymbol.defaultSymbol(geometry_type)
+        if geometry_type == QgsWkbTypes.PointGeometry:
+            if values['icon_color']:
+                symbol.setColor(QColor(values['icon_color']))
+            if values['icon_scale']:
+                symbol.setSize(symbol.size() * values['icon_scale'])
+        elif geometry_type == QgsWkbTypes.LineGeometry:
+            if values['line_color']:
+                symbol.setColor(QColor(values['line_color']))
+            if values['line_width']:
+                symbol.setWidth(values['line_width'])
+                symbol.setWidthUnit(QgsUnitTypes.RenderPixels)
+        elif geometry_type == QgsWkbTypes.PolygonGeometry:
+            if values['fill_color']:
+                symbol.setColor(QColor(values['fill_color']))
+            layer0 = symbol.symbolLayer(0)
+            if values['line_color']:
+                layer0.setStrokeColor(QColor(values['line_color']))
+            if values['line_width']:
+                layer0.setStrokeWidth(values['line_width'])
+                layer0.setStrokeWidthUnit(QgsUnitTypes.RenderPixels)
+        label = styleid if styleid else 'No style'
+        categories.append(QgsRendererCategory(styleid, symbol, label))
+    return(QgsCategorizedSymbolRenderer('style_id', categories))
+
+class StyleRenderer(QgsProcessingLayerPostProcessorInterface):
+    '''Applies the categorized style renderer to an output layer once it is loaded.'''
+    # QGIS does not keep a reference to the post processors so they are kept here
+    # by the id of their output layer until they have run
+    instances = {}
+
+    def __init__(self, dest_id):
+        super().__init__()
+        self.dest_id = dest_id
+
+    def postProcessLayer(self, layer, context, feedback):
+        StyleRenderer.instances.pop(self.dest_id, None)
+        renderer = categorizedRenderer(layer)
+        if renderer is not None:
+            layer.setRenderer(renderer)
+            layer.triggerRepaint()
+
+    @staticmethod
+    def create(dest_id):
+        StyleRenderer.instances[dest_id] = StyleRenderer(dest_id)
+        return(StyleRenderer.instances[dest_id])
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import struct
+from collections import deque
+import simplekml
+from simplekml.base import Kmlable
+from simplekml.coordinates import Coordinates
+from .kmzWriter import KmlIndenter
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except Exception:
+    HAS_NUMPY = False
+try:
+    from pyproj import Transformer
+    HAS_PYPROJ = True
+except Exception:
+    HAS_PYPROJ = False
+
+# Number of placemarks sent to a worker process at a time
+CHUNK_SIZE = 500
+# Fewer points than this are read into tuples even when NumPy is available
+MIN_ARRAY_POINTS = 8
+
+# WKB geometry types
+WKB_POINT = 1
+WKB_LINESTRING = 2
+WKB_POLYGON = 3
+WKB_MULTI_TYPES = (4, 5, 6, 7)
+
+GEOMETRY_CLASSES = {
+    WKB_POINT: simplekml.Point,
+    WKB_LINESTRING: simplekml.LineString,
+    WKB_POLYGON: simplekml.Polygon
+}
+
+# pyproj Transformers to WGS 84 of the CRS definitions used in this process
+TRANSFORMERS = {}
+
+def wkbGeometries(wkb):
+    '''Return the list of the points, lines and polygons of the WKB geometry as
+    (type, coordinates) tuples. The coordinates of a point or a line are its points,
+    as returned by readPoints, and those of a polygon are the list of its rings.'''
+    geometries = []
+    readWkb(memoryview(wkb), 0, geometries)
+    return(geometries)
+
+def readWkb(wkb, offset, geometries):
+    order = '<' if wkb[offset] == 1 else '>'
+    (wkbtype,) = struct.unpack_from(order + 'I', wkb, offset + 1)
+    offset += 5
+    # Both ISO and the older extended WKB Z and M flags
+    hasz = bool(wkbtype & 0x80000000)
+    hasm = bool(wkbtype & 0x40000000)
+    wkbtype &= 0x0fffffff
+    dims = wkbtype // 1000
+    wkbtype %= 1000
+    hasz = hasz or dims in (1, 3)
+    hasm = hasm or dims in (2, 3)
+    fmt = order + ('d' * (2 + hasz + hasm))
+    if wkbtype == WKB_POINT:
+        (points, offset) = readPoints(wkb, offset, 1, fmt, hasz)
+        geometries.append((WKB_POINT, points))
+    elif wkbtype == WKB_LINESTRING:
+        (count,) = struct.unpack_from(order + 'I', wkb, offset)
+        (points, offset) = readPoints(wkb, offset + 4, count, fmt, hasz)
+        geometries.append((WKB_LINESTRING, points))
+    elif wkbtype == WKB_POLYGON:
+        (num_rings,) = struct.unpack_from(order + 'I', wkb, offset)
+        offset += 4
+        rings = []
+        for i in range(num_rings):
+            (count,) = struct.unpack_from(order + 'I', wkb, offset)
+            (points, offset) = readPoints(wkb, offset + 4, count, fmt, hasz)
+            rings.append(points)
+        geometries.append((WKB_POLYGON, rings))
+    elif wkbtype in WKB_MULTI_TYPES:
+        (num_parts,) = struct.unpack_from(order + 'I', wkb, offset)
+        offset += 4
+        for i in range(num_parts):
+            offset = readWkb(wkb, offset, geometries)
+    else:
+        raise ValueError('Unsupported WKB geometry type {}'.format(wkbtype))
+    return(offset)
+
+def readPoints(wkb, offset, count, fmt, hasz):
+    '''Return count points and the offset after them. The points are a NumPy array
+    of (x, y, z) rows if there are enough of them to be worth it, otherwise a list of
+    (x, y, z) tuples. z is 0.0 if the WKB has none.'''
+    size = struct.calcsize(fmt)
+    end = offset + count * size
+    if HAS_NUMPY and count >= MIN_ARRAY_POINTS:
+        dims = len(fmt) - 1
+        values = np.frombuffer(wkb, np.dtype(fmt[0] + 'f8'), count * dims, offset).reshape(count, dims)
+        points = np.zeros((count, 3))
+        points[:, :2 + hasz] = values[:, :2 + hasz]
+        return(points, end)
+    points = struct.iter_unpack(fmt, wkb[offset:end])
+    if hasz:
+        if size == 24:
+            return(list(points), end)
+        return([p[:3] for p in points], end)
+    return([(p[0], p[1], 0.0) for p in points], end)
+
+def wgs84Transformer(crs):
+    '''Return the pyproj Transformer from the CRS definition crs to WGS 84 longitude
+    and latitude. Each process creates it once.'''
+    transformer = TRANSFORMERS.get(crs)
+    if transformer is None:
+        transformer = Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+        TRANSFORMERS[crs] = transformer
+    return(transformer)
+
+def transformGeometries(crs, features):
+    '''Transform the x and y of the points of features, each a list returned by
+    wkbGeometries, from the CRS definition crs to WGS 84 in a single pyproj call.
+    The points of the geometries are replaced by arrays of the transformed points.'''
+    parts = []
+    for geometries in features:
+        for (wkbtype, coords) in geometries:
+            if wkbtype == WKB_POLYGON:
+                parts.extend(coords)
+            else:
+                parts.append(coords)
+    if not parts:
+        return
+    arrays = [np.array(part, float).reshape(-1, 3) if isinstance(part, list) else part for part in parts]
+    points = np.concatenate(arrays)
+    (points[:, 0], points[:, 1]) = wgs84Transformer(crs).transform(points[:, 0], points[:, 1])
+    transformed = iter(np.split(points, np.cumsum([len(array) for array in arrays])[:-1]))
+    for geometries in features:
+        for i, (wkbtype, coords) in enumerate(geometries):
+            if wkbtype == WKB_POLYGON:
+                geometries[i] = (wkbtype, [next(transformed) for ring in coords])
+            else:
+                geometries[i] = (wkbtype, next(transformed))
+
+class ArrayCoordinates(Coordinates):
+    '''simplekml Coordinates of the points read by readPoints, a NumPy array of
+    (x, y, z) rows or a list of (x, y, z) tuples. An array is formatted in one pass
+    and the values are rounded to precision decimal places unless it is None.'''
+    def __init__(self, points, precision=None):
+        self.points = points
+        self.precision = precision
+
+    @property
+    def _coords(self):
+        # The list of tuples of simplekml Coordinates, so adding coordinates still works
+        if isinstance(self.points, list):
+            return(self.points)
+        return(list(map(tuple, self.points.tolist())))
+
+    @_coords.setter
+    def _coords(self, coords):
+        self.points = coords
+
+    def __str__(self):
+        points = self.points
+        if not len(points) or (self.precision is None and isinstance(points, list)):
+            return(Coordinates.__str__(self))
+        if self.precision is None:
+            values = points.ravel().tolist()
+        elif HAS_NUMPY:
+            values = np.asarray(points, float).round(self.precision).ravel().tolist()
+        else:
+            values = [round(value, self.precision) for point in points for value in point]
+        return(' '.join(map('{0},{1},{2}'.format, values[0::3], values[1::3], values[2::3])))
+
+def kmlCoordinates(points, hasz, altitude, altitude_addend, precision=None):
+    '''Return the ArrayCoordinates of points read by readPoints written with
+    precision decimal places. An array of points is changed in place.'''
+    if not isinstance(points, list):
+        if hasz:
+            points[:, 2] += altitude_addend
+        else:
+            points[:, 2] = altitude + altitude_addend
+    elif hasz:
+        points = [(x, y, z + altitude_addend) for x, y, z in points]
+    else:
+        points = [(x, y, altitude + altitude_addend) for x, y, z in points]
+    return(ArrayCoordinates(points, precision))
+
+def labelCoordinates(point, precision=None):
+    '''Return the ArrayCoordinates of the x and y of a hidden polygon label point.'''
+    return(ArrayCoordinates([(point[0], point[1], 0.0)], precision))
+
+def addGeometry(placemark, geometries, multi, label, extrude, altitude_mode, altitude, hasz, altitude_addend,
+        precision):
+    '''Convert the wkbGeometries geometries to simplekml geometry in the placemark.
+    This creates the same KML as ExportKmzAlgorithm does from the QGIS geometry.
+    label is None or the coordinates and name of the hidden label point of a polygon.'''
+    if multi or len(geometries) > 1:
+        container = simplekml.MultiGeometry()
+        placemark.geometry = container
+        if label:
+            container.newpoint(coords=labelCoordinates(label[0], precision), name=label[1])
+    else:
+        container = None
+    for (wkbtype, coords) in geometries:
+        if container is None:
+            part = GEOMETRY_CLASSES[wkbtype]()
+            placemark.geometry = part
+        elif wkbtype == WKB_POINT:
+            part = container.newpoint()
+        elif wkbtype == WKB_LINESTRING:
+            part = container.newlinestring()
+        else:
+            part = container.newpolygon()
+        if extrude:
+            part.extrude = extrude
+        if altitude_mode:
+            part.altitudemode = altitude_mode
+        if wkbtype == WKB_POLYGON:
+            part.outerboundaryis = kmlCoordinates(coords[0], hasz, altitude, altitude_addend, precision)
+            if len(coords) > 1:
+                part.innerboundaryis = [
+                    kmlCoordinates(ring, hasz, altitude, altitude_addend, precision) for ring in coords[1:]]
+        else:
+            part.coords = kmlCoordinates(coords, hasz, altitude, altitude_addend, precision)
+
+def placemarksKml(records, id_prefix, hasz, altitude_addend, depth, precision, crs=None):
+    '''Return the KML of the placemarks of records. This runs in a worker process.
+    Each record holds a simplekml Placemark without its geometry and its WKB geometry
+    followed by the other arguments of addGeometry. The ids of the objects created
+    here begin with id_prefix so that they are unique within the document. The KML
+    is indented for depth unless it is None and the coordinates are rounded to
+    precision decimal places unless it is None. If crs is not None, then the
+    coordinates of all of the records are transformed from it to WGS 84 at once.'''
+    features = [wkbGeometries(record[1]) for record in records]
+    if crs is not None:
+        transformGeometries(crs, features)
+    simplekml.Kml.setidprefix(id_prefix)
+    simplekml.Kml.resetidcounter()
+    root = simplekml.Kml()
+    root._outputkmz = True
+    Kmlable._currentroot = root
+    Kmlable._compiling = True
+    indenter = None if depth is None else KmlIndenter(depth)
+    out = []
+    try:
+        for record, geometries in zip(records, features):
+            placemark = record[0]
+            addGeometry(placemark, geometries, *record[2:], hasz, altitude_addend, precision)
+            text = str(placemark)
+            if indenter:
+                out.extend(indenter.indent(text))
+            else:
+                out.append(text)
+    finally:
+        Kmlable._compiling = False
+        simplekml.Kml.setidprefix()
+    return(''.join(out))
+
+class PlacemarkPool():
+    '''Converts placemarks to KML in worker processes and writes them with the
+    KmzWriter writer in the order they were added. The features are sent to the
+    workers CHUNK_SIZE at a time and only a few chunks per worker are waiting at
+    any time so memory stays bounded. The workers transform the coordinates from the
+    CRS definition crs to WGS 84 unless it is None.'''
+    def __init__(self, writer, executor, workers, hasz, altitude_addend, depth, precision, crs=None):
+        self.writer = writer
+        self.executor = executor
+        self.options = (hasz, altitude_addend, depth, precision, crs)
+        self.maxPending = workers * 2
+        # Futures of the chunks sent to the workers and the names of the subfolders
+        # that start between them
+        self.pending = deque()
+        self.records = []
+        self.chunks = 0
+        self.subfolder = False
+
+    def add(self, placemark, wkb, multi, label, extrude, altitude_mode, altitude):
+        self.records.append((placemark, wkb, multi, label, extrude, altitude_mode, altitude))
+        if len(self.records) >= CHUNK_SIZE:
+            self.submit()
+
+    def startFolder(self, name):
+        '''Start a subfolder after the placemarks added so far.'''
+        self.submit()
+        self.pending.append(name)
+
+    def submit(self):
+        if self.records:
+            self.chunks += 1
+            self.pending.append(self.executor.submit(
+                placemarksKml, self.records, 'w{}_'.format(self.chunks), *self.options))
+            self.records = []
+        while len(self.pending) > self.maxPending:
+            self.writeNext()
+
+    def writeNext(self):
+        item = self.pending.popleft()
+        if isinstance(item, str):
+            if self.subfolder:
+                self.writer.endFolder()
+            self.writer.startFolder(item)
+            self.subfolder = True
+        else:
+            self.writer.writeFragment(item.result())
+
+    def close(self):
+        '''Write the rest of the placemarks.'''
+        self.submit()
+        while self.pending:
+            self.writeNext()
+
+    def cancel(self):
+        '''Cancel the chunks that the workers have not started. The executor then
+        only waits for the chunks being converted when it is shut down.'''
+        for item in self.pending:
+            if not isinstance(item, str):
+                item.cancel()
+        self.pending.clear()
+        self.records = []
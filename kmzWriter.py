@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import re
+import zipfile
+from xml.sax.saxutils import escape
+import simplekml
+from simplekml.base import Kmlable
+from simplekml.featgeom import Geometry
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+KML_NAMESPACES = 'xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2"'
+# Number of characters collected before they are compressed into the KMZ
+BUFFER_SIZE = 1048576
+INDENT = '    '
+
+# CDATA sections, tags and the text between them
+TOKEN_RE = re.compile(r'<!\[CDATA\[.*?\]\]>|<[^>]*>|[^<]+', re.DOTALL)
+
+class KmlIndenter():
+    '''Indents KML without parsing it into a DOM. The text is given in pieces
+    holding whole elements, as simplekml produces it, and each element starts on
+    a line of its own unless it only holds text. depth is the number of elements
+    the text is within.'''
+    def __init__(self, depth=0):
+        self.depth = depth
+        # Kind of the last token written: None at the start of the document, then
+        # 'start', 'end' or 'text'
+        self.last = 'end' if depth else None
+
+    def indent(self, text):
+        '''Return the list of strings of the indented text.'''
+        out = []
+        for token in TOKEN_RE.findall(text):
+            if token[0] != '<' or token.startswith('<![CDATA['):
+                out.append(token)
+                self.last = 'text'
+            elif token[1] == '/':
+                self.depth -= 1
+                if self.last == 'end':
+                    out.append('\n' + INDENT * self.depth)
+                out.append(token)
+                self.last = 'end'
+            elif token[1] == '?' or token.endswith('/>'):
+                if self.last is not None:
+                    out.append('\n' + INDENT * self.depth)
+                out.append(token)
+                self.last = 'end'
+            else:
+                if self.last is not None:
+                    out.append('\n' + INDENT * self.depth)
+                out.append(token)
+                self.depth += 1
+                self.last = 'start'
+        return(out)
+
+class KmzWriter():
+    '''Writes the doc.kml of a KMZ file, compact or indented, without building it
+    in memory first. With startDocument the features can be written as they are
+    exported. Each feature is created in a simplekml container of its own, written
+    with writeFeatures and then dropped so memory does not grow with the size of
+    the layer. The shared styles are written once at the start of the document.'''
+    def __init__(self, filename, indent=False):
+        self.filename = filename
+        # Holds the simplekml settings used while the features are converted to KML
+        self.root = simplekml.Kml()
+        self.root._outputkmz = True
+        self.root.resetidcounter()
+        self.indenter = KmlIndenter() if indent else None
+        self.files = []
+        self.buffer = []
+        self.size = 0
+        self.document = False
+        self.folders = 0
+        self.kmz = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+        # doc.kml can be larger than 2 GB on big layers
+        self.stream = self.kmz.open('doc.kml', 'w', force_zip64=True)
+        self.write(XML_DECLARATION)
+        if not indent:
+            self.write('\n')
+
+    def addfile(self, path):
+        '''Include the file path in the KMZ and return its path within the KMZ.
+        This is the same as simplekml.Kml.addfile.'''
+        self.files.append(path)
+        return('files/' + os.path.basename(path))
+
+    def write(self, text):
+        if self.indenter:
+            self.buffer.extend(self.indenter.indent(text))
+        else:
+            self.buffer.append(text)
+        self.size += len(text)
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def writeFragment(self, text):
+        '''Write KML that is already indented for the current depth, as it is by
+        KmlIndenter(depth()).'''
+        self.buffer.append(text)
+        self.size += len(text)
+        if self.indenter:
+            self.indenter.last = 'end'
+        if self.size >= BUFFER_SIZE:
+            self.flush()
+
+    def depth(self):
+        '''Return the indentation depth of the KML written next or None if the KML
+        is not indented.'''
+        if self.indenter:
+            return(self.indenter.depth)
+        return(None)
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer).encode('utf-8'))
+            self.buffer = []
+            self.size = 0
+
+    def writeKml(self, kml):
+        '''Write the whole simplekml document kml.'''
+        Kmlable._currentroot = kml
+        kml._outputkmz = True
+        self.write(kml._genkml(False))
+        self.files.extend(kml._images)
+        self.files.extend(kml._foundimages)
+
+    def startDocument(self):
+        self.document = True
+        self.write('<kml {}><Document>'.format(KML_NAMESPACES))
+
+    def writeStyles(self, styles):
+        for style in styles:
+            self.write(str(style))
+
+    def startFolder(self, name):
+        self.folders += 1
+        self.write('<Folder><name>{}</name>'.format(escape(name)))
+
+    def endFolder(self):
+        self.folders -= 1
+        self.write('</Folder>')
+
+    def writeFeatures(self, container):
+        '''Write the features of the simplekml container.'''
+        Kmlable._currentroot = self.root
+        Kmlable._compiling = True
+        try:
+            for feature in container.features:
+                if isinstance(feature, Geometry):
+                    feature = feature.placemark
+                self.write(str(feature))
+        finally:
+            Kmlable._compiling = False
+
+    def close(self):
+        while self.folders:
+            self.endFolder()
+        if self.document:
+            self.write('</Document></kml>')
+        self.write('\n')
+        self.flush()
+        self.stream.close()
+        for path in self.files + self.root._foundimages:
+            self.kmz.write(path, 'files/' + os.path.basename(path))
+        self.kmz.close()
+
+    def discard(self):
+        '''Close and remove the KMZ file. This is also used after a write failed so
+        errors closing the file are ignored.'''
+        for f in (self.stream, self.kmz):
+            try:
+                f.close()
+            except Exception:
+                pass
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
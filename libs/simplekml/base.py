@@ -29,12 +29,13 @@ from simplekml.makeunicode import u
 class Kmlable(object):
     """Enables a subclass to be converted into KML."""
     _globalid = 0
+    _idprefix = ''
     _currentroot = None
     _compiling = False
     _namespaces = ['xmlns="http://www.opengis.net/kml/2.2"', 'xmlns:gx="http://www.google.com/kml/ext/2.2"']
     
     def __init__(self):
-        self._id = str(Kmlable._globalid)
+        self._id = Kmlable._idprefix + str(Kmlable._globalid)
         Kmlable._globalid += 1
         try:
             from collections import OrderedDict
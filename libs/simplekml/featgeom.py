@@ -1062,8 +1062,11 @@ class PointGeometry(Geometry):
     def __init__(self,
                  coords=(), **kwargs):
         super(PointGeometry, self).__init__(**kwargs)
-        self._kml['coordinates'] = Coordinates()
-        self._kml['coordinates'].addcoordinates(list(coords))
+        if isinstance(coords, Coordinates):
+            self._kml['coordinates'] = coords
+        else:
+            self._kml['coordinates'] = Coordinates()
+            self._kml['coordinates'].addcoordinates(list(coords))
 
     @property
     def coords(self):
@@ -1083,8 +1086,11 @@ class PointGeometry(Geometry):
 
     @coords.setter
     def coords(self, coords):
-        self._kml['coordinates'] = Coordinates()
-        self._kml['coordinates'].addcoordinates(coords)
+        if isinstance(coords, Coordinates):
+            self._kml['coordinates'] = coords
+        else:
+            self._kml['coordinates'] = Coordinates()
+            self._kml['coordinates'].addcoordinates(coords)
 
 
 class LinearRing(PointGeometry):
@@ -1108,7 +1114,7 @@ class LinearRing(PointGeometry):
                  gxaltitudemode=None,
                  gxaltitudeoffset=None,
                  **kwargs):
-        super(LinearRing, self).__init__(list(coords), **kwargs)
+        super(LinearRing, self).__init__(coords, **kwargs)
         self._kml['extrude'] = extrude
         self._kml['tessellate'] = tessellate
         self._kml['altitudeMode'] = altitudemode
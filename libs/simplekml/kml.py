@@ -517,3 +517,11 @@ class Kml(Kmlable):
         *New in version 1.3.1*
         """
         Kmlable._globalid = 0
+
+    @staticmethod
+    def setidprefix(prefix=''):
+        """Sets a prefix for the ids given to new objects.
+
+        This keeps the ids unique when parts of one document are created in separate processes.
+        """
+        Kmlable._idprefix = prefix
@@ -11,8 +11,12 @@
 import os
 from qgis.core import QgsProcessingProvider, Qgis
 from qgis.PyQt.QtGui import QIcon
+from processing.core.ProcessingConfig import ProcessingConfig, Setting
+from .settings import CACHE_DIRECTORY, CACHE_SIZE
+from .kmlCache import DEFAULT_CACHE_SIZE, defaultCacheDirectory
 from .htmlExpansionAlgorithm import HTMLExpansionAlgorithm
 from .importKml import ImportKmlAlgorithm
+from .batchImportKml import BatchImportKmlAlgorithm
 from .exportKmz import ExportKmzAlgorithm
 if Qgis.QGIS_VERSION_INT >= 31400:
     from .convertGroundOverlays import ConvertGroundOverlayAlgorithm
@@ -20,12 +24,27 @@ if Qgis.QGIS_VERSION_INT >= 31400:
 
 class KmlToolsProvider(QgsProcessingProvider):
 
+    def load(self):
+        ProcessingConfig.settingIcons[self.name()] = self.icon()
+        ProcessingConfig.addSetting(Setting(
+            self.name(), CACHE_DIRECTORY, 'Import cache folder',
+            defaultCacheDirectory(), valuetype=Setting.FOLDER))
+        ProcessingConfig.addSetting(Setting(
+            self.name(), CACHE_SIZE, 'Maximum size of the import cache in MB',
+            DEFAULT_CACHE_SIZE, valuetype=Setting.INT))
+        ProcessingConfig.readSettings()
+        self.refreshAlgorithms()
+        return True
+
     def unload(self):
+        ProcessingConfig.removeSetting(CACHE_DIRECTORY)
+        ProcessingConfig.removeSetting(CACHE_SIZE)
         QgsProcessingProvider.unload(self)
 
     def loadAlgorithms(self):
         self.addAlgorithm(HTMLExpansionAlgorithm())
         self.addAlgorithm(ImportKmlAlgorithm())
+        self.addAlgorithm(BatchImportKmlAlgorithm())
         self.addAlgorithm(ExportKmzAlgorithm())
         if Qgis.QGIS_VERSION_INT >= 31400:
             self.addAlgorithm(ConvertGroundOverlayAlgorithm())
@@ -8,8 +8,35 @@
  *                                                                         *
  ***************************************************************************/
 """
+from .kmlCache import DEFAULT_CACHE_SIZE, defaultCacheDirectory
+
+# Names of the settings shown in the Processing options
+CACHE_DIRECTORY = 'KMLTOOLS_CACHE_DIRECTORY'
+CACHE_SIZE = 'KMLTOOLS_CACHE_SIZE'
+
 class Settings():
     def __init__(self):
         self.canvas = None
-    
+
+    def processingSetting(self, name, default):
+        try:
+            from processing.core.ProcessingConfig import ProcessingConfig
+            value = ProcessingConfig.getSetting(name)
+        except Exception:
+            value = None
+        if value is None or value == '':
+            return(default)
+        return(value)
+
+    def cacheDirectory(self):
+        return(self.processingSetting(CACHE_DIRECTORY, defaultCacheDirectory()))
+
+    def cacheSize(self):
+        '''Return the maximum size of the import cache in bytes.'''
+        try:
+            size = int(self.processingSetting(CACHE_SIZE, DEFAULT_CACHE_SIZE))
+        except (TypeError, ValueError):
+            size = DEFAULT_CACHE_SIZE
+        return(max(size, 0) * 1048576)
+
 settings = Settings()
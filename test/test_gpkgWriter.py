@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+from utilities import pluginModule, requiresQgis, HAS_QGIS
+
+if HAS_QGIS:
+    gpkgWriter = pluginModule('gpkgWriter')
+
+@requiresQgis
+class TestGpkgDatabase(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.filename = os.path.join(folder.name, 'test.gpkg')
+
+    def testClose(self):
+        db = gpkgWriter.GpkgDatabase(self.filename)
+        db.close()
+        with sqlite3.connect(self.filename) as check:
+            self.assertEqual(check.execute('SELECT count(*) FROM gpkg_spatial_ref_sys').fetchone(), (3,))
+
+    def testDiscard(self):
+        db = gpkgWriter.GpkgDatabase(self.filename)
+        db.discard()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def testCloseFails(self):
+        # A GeoPackage that could not be finished is removed rather than left half written
+        db = gpkgWriter.GpkgDatabase(self.filename)
+        layer = mock.Mock()
+        layer.finish.side_effect = sqlite3.OperationalError('disk I/O error')
+        db.layers.append(layer)
+        with self.assertRaises(sqlite3.OperationalError):
+            db.close()
+        self.assertFalse(os.path.exists(self.filename))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import math
+import struct
+import unittest
+from unittest import mock
+from utilities import pluginModule
+
+kmlArrays = pluginModule('kmlArrays')
+
+def floats(arrays):
+    '''Return the coordinate arrays as lists of floats so numpy arrays and lists
+    compare the same.'''
+    return([[float(v) for v in values] for values in arrays])
+
+class WithoutNumpy():
+    '''Runs the tests of a test case with the code used when numpy is not installed.'''
+    def setUp(self):
+        patcher = mock.patch.object(kmlArrays, 'HAS_NUMPY', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+class TestCoordArrays(unittest.TestCase):
+    def test3d(self):
+        self.assertEqual(floats(kmlArrays.coordArrays(' 1,2,3\n4.5,-5,6 ')),
+            [[1, 4.5], [2, -5], [3, 6]])
+
+    def test2d(self):
+        self.assertEqual(floats(kmlArrays.coordArrays('1,2 3,4')), [[1, 3], [2, 4], [0, 0]])
+
+    def testMixedDimensions(self):
+        self.assertEqual(floats(kmlArrays.coordArrays('1,2 3,4,5')), [[1, 3], [2, 4], [0, 5]])
+
+    def testCommaOnly(self):
+        # Invalid KML where the points are only separated by commas
+        self.assertEqual(floats(kmlArrays.coordArrays('1,2,3,4,5,6,7,8,9')),
+            [[1, 4, 7], [2, 5, 8], [3, 6, 9]])
+
+    def testBadValues(self):
+        # A point with a bad value is replaced by 0,0,0
+        self.assertEqual(floats(kmlArrays.coordArrays('1,2,3 x,5,6')), [[1, 0], [2, 0], [3, 0]])
+
+    def testEmpty(self):
+        self.assertEqual(floats(kmlArrays.coordArrays('')), [[0], [0], [0]])
+
+class TestCoordinateBuffer(unittest.TestCase):
+    def collect(self, text, size, chunkSize=16):
+        '''Append text to a CoordinateBuffer in pieces of size characters.'''
+        buffer = kmlArrays.CoordinateBuffer()
+        with mock.patch.object(kmlArrays, 'COORD_CHUNK_SIZE', chunkSize):
+            for i in range(0, len(text), size):
+                buffer.append(text[i:i + size])
+        return(buffer)
+
+    def testSplitMidTuple(self):
+        points = [(i * 1.5, -i * 0.25, i) for i in range(50)]
+        text = ' '.join('{},{},{}'.format(*p) for p in points)
+        expected = [[p[i] for p in points] for i in range(3)]
+        for size in (1, 3, 7, 10, 64):
+            buffer = self.collect(text, size)
+            self.assertTrue(buffer.parts, 'the text was not converted in chunks')
+            self.assertEqual(floats(buffer.arrays()), expected)
+
+    def testShortText(self):
+        buffer = self.collect('1,2,3 4,5,6', 4, kmlArrays.COORD_CHUNK_SIZE)
+        self.assertEqual(buffer.value(), '1,2,3 4,5,6')
+        self.assertEqual(floats(buffer.arrays()), [[1, 4], [2, 5], [3, 6]])
+
+    def testCommaOnly(self):
+        text = ','.join(str(v) for v in range(30))
+        buffer = self.collect(text, 5)
+        # Text without whitespace is not joined until the end
+        self.assertEqual(len(buffer.chunks), (len(text) + 4) // 5)
+        self.assertEqual(floats(buffer.arrays()),
+            [list(range(0, 30, 3)), list(range(1, 30, 3)), list(range(2, 30, 3))])
+
+    def testCommaOnlyThenWhitespace(self):
+        text = ','.join(str(v) for v in range(30)) + ' 30,31,32 33,34,35'
+        buffer = self.collect(text, 5)
+        self.assertEqual(floats(buffer.arrays()),
+            [list(range(0, 36, 3)), list(range(1, 36, 3)), list(range(2, 36, 3))])
+
+    def testTrailingWhitespace(self):
+        buffer = self.collect('1,2,3 4,5,6 7,8,9 10,11,12 \n\t ', 2, 8)
+        self.assertEqual(floats(buffer.arrays()), [[1, 4, 7, 10], [2, 5, 8, 11], [3, 6, 9, 12]])
+
+class TestTrackBuffer(unittest.TestCase):
+    def collect(self, convert, values, chunkSize=2):
+        buffer = kmlArrays.TrackBuffer(convert)
+        with mock.patch.object(kmlArrays, 'TRACK_CHUNK_SIZE', chunkSize):
+            for value in values:
+                # The text of a value may arrive in more than one piece
+                buffer.append(value[:3])
+                buffer.append(value[3:])
+                buffer.endValue()
+        return(buffer.arrays())
+
+    def testCoords(self):
+        arrays = self.collect(kmlArrays.trackCoordArrays, ['1 2 3', '4 5 6', '7 8 9'])
+        self.assertEqual(floats(arrays), [[1, 4, 7], [2, 5, 8], [3, 6, 9]])
+
+    def testBadCoords(self):
+        arrays = self.collect(kmlArrays.trackCoordArrays, ['1 2', '4 x 6', '7 8 9'], 10)
+        self.assertEqual(floats(arrays), [[1, 4, 7], [2, 0, 8], [0, 6, 9]])
+
+    def testEmpty(self):
+        self.assertEqual(floats(self.collect(kmlArrays.trackCoordArrays, [])), [[], [], []])
+
+    def testTimes(self):
+        (m,) = self.collect(kmlArrays.trackTimeArray,
+            ['2020-01-01T00:00:00Z', '2020-01-01T00:00:01.5Z', '2020-01-01T01:00:00+01:00'])
+        self.assertEqual(floats([m]), [[1577836800, 1577836801.5, 1577836800]])
+
+    def testBadTimes(self):
+        (m,) = kmlArrays.trackTimeArray('2020-01-01T00:00:00Z\x00not a time\x00\x00', 3)
+        self.assertEqual(float(m[0]), 1577836800)
+        self.assertTrue(math.isnan(m[1]))
+        self.assertTrue(math.isnan(m[2]))
+
+class TestTrackPoints(unittest.TestCase):
+    def array(self, values):
+        if kmlArrays.HAS_NUMPY:
+            return(kmlArrays.np.array(values, dtype=float))
+        return(values)
+
+    def testTimeStrings(self):
+        times = [1577836800, 1577836800.25, 1577836800.0004, -0.5, math.nan, 1583020799.999]
+        self.assertEqual(kmlArrays.timeStrings(self.array(times)), [kmlArrays.timeString(t) for t in times])
+
+    def testPointZMWkb(self):
+        wkb = kmlArrays.pointZMWkb(self.array([1, 2]), self.array([3, 4]), self.array([5, 6]), self.array([7, 8]))
+        self.assertEqual(wkb, [struct.pack('<BIdddd', 1, 3001, 1, 3, 5, 7), struct.pack('<BIdddd', 1, 3001, 2, 4, 6, 8)])
+        self.assertEqual(kmlArrays.pointZMWkb(self.array([]), self.array([]), self.array([]), self.array([])), [])
+
+class TestCoordArraysWithoutNumpy(WithoutNumpy, TestCoordArrays):
+    pass
+
+class TestCoordinateBufferWithoutNumpy(WithoutNumpy, TestCoordinateBuffer):
+    pass
+
+class TestTrackBufferWithoutNumpy(WithoutNumpy, TestTrackBuffer):
+    pass
+
+class TestTrackPointsWithoutNumpy(WithoutNumpy, TestTrackPoints):
+    pass
+
+class TestTimes(unittest.TestCase):
+    def testParseTime(self):
+        self.assertEqual(kmlArrays.parseTime('2020').timestamp(), 1577836800)
+        self.assertEqual(kmlArrays.parseTime('2020', True).timestamp(), 1609459200 - 1e-6)
+        self.assertEqual(kmlArrays.parseTime('2020-02', True).day, 29)
+        self.assertIsNone(kmlArrays.parseTime('2020-13-01'))
+
+    def testTimeString(self):
+        self.assertEqual(kmlArrays.timeString(1577836800), '2020-01-01T00:00:00Z')
+        self.assertEqual(kmlArrays.timeString(1577836800.25), '2020-01-01T00:00:00.250Z')
+        self.assertEqual(kmlArrays.timeString(math.nan), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import stat
+import tempfile
+import unittest
+from unittest import mock
+from utilities import pluginModule
+
+kmlCache = pluginModule('kmlCache')
+
+KEY = 'a' * 64
+
+def result(folder):
+    '''Return a parse result with an empty spool of each name.'''
+    result = {'names': ['index'], 'links': []}
+    for name in kmlCache.SPOOL_NAMES:
+        filename = os.path.join(folder, name)
+        open(filename, 'wb').close()
+        result[name] = (filename, 0)
+    return(result)
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.directory = os.path.join(self.folder.name, 'cache')
+
+    def testPutGet(self):
+        cache = kmlCache.ParseCache(self.directory)
+        self.assertIsNone(cache.get(KEY))
+        cached = cache.put(KEY, result(self.folder.name))
+        self.assertTrue(cached['cached'])
+        self.assertEqual(cached['names'], ['index'])
+        self.assertEqual(cached['points'], (os.path.join(self.directory, KEY, 'points.spool'), 0))
+
+    def assertSpools(self, result, exist):
+        for name in kmlCache.SPOOL_NAMES:
+            self.assertEqual(os.path.exists(result[name][0]), exist)
+
+    def testPutFails(self):
+        cache = kmlCache.ParseCache(self.directory)
+        spooled = result(self.folder.name)
+        with mock.patch.object(kmlCache.os, 'rename', side_effect=OSError('No space left on device')):
+            with self.assertRaises(OSError):
+                cache.put(KEY, spooled)
+        # The spools are moved back so the result can be used without the cache
+        self.assertSpools(spooled, True)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def testPutTwice(self):
+        # A second import of the same document uses the entry of the first one
+        cache = kmlCache.ParseCache(self.directory)
+        cache.put(KEY, result(self.folder.name))
+        spooled = result(self.folder.name)
+        cached = cache.put(KEY, spooled)
+        self.assertEqual(cached['points'], (os.path.join(self.directory, KEY, 'points.spool'), 0))
+        self.assertSpools(spooled, False)
+
+    @unittest.skipUnless(os.name == 'posix', 'file modes are only checked on POSIX')
+    def testPrivateFolder(self):
+        kmlCache.ParseCache(self.directory)
+        self.assertEqual(stat.S_IMODE(os.stat(self.directory).st_mode), 0o700)
+        os.chmod(self.directory, 0o777)
+        kmlCache.ParseCache(self.directory)
+        self.assertEqual(stat.S_IMODE(os.stat(self.directory).st_mode), 0o700)
+
+    @unittest.skipUnless(os.name == 'posix', 'file owners are only checked on POSIX')
+    def testOtherUser(self):
+        cache = kmlCache.ParseCache(self.directory)
+        cache.put(KEY, result(self.folder.name))
+        with mock.patch.object(kmlCache.os, 'getuid', return_value=os.getuid() + 1):
+            # Neither the folder nor the entries of another user are used
+            with self.assertRaises(OSError):
+                kmlCache.ParseCache(self.directory)
+            self.assertIsNone(cache.get(KEY))
+            # The entry of another user is not used in place of a result that could not be added
+            spooled = result(self.folder.name)
+            with self.assertRaises(OSError):
+                cache.put(KEY, spooled)
+            self.assertSpools(spooled, True)
+        self.assertIsNotNone(cache.get(KEY))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import unittest
+from utilities import pluginModule, requiresQgis, HAS_QGIS
+
+if HAS_QGIS:
+    kmlFieldTypes = pluginModule('kmlFieldTypes')
+
+@requiresQgis
+class TestValueType(unittest.TestCase):
+    def testTypes(self):
+        for (value, expected) in (
+                ('42', 'int'), ('-7', 'int'), ('0', 'int'),
+                ('2147483648', 'longlong'), ('99999999999999999999', 'string'),
+                ('1.5', 'double'), ('.5', 'double'), ('1e10', 'double'), ('-2.', 'double'),
+                ('00501', 'string'), ('1,5', 'string'), ('abc', 'string'),
+                ('2020-01-02', 'datetime'), ('2020-01-02T03:04:05Z', 'datetime'),
+                ('2020-01-02 03:04:05.25+01:00', 'datetime')):
+            self.assertEqual(kmlFieldTypes.valueType(value), expected, value)
+
+    def testWiderType(self):
+        self.assertEqual(kmlFieldTypes.widerType(None, 'int'), 'int')
+        self.assertEqual(kmlFieldTypes.widerType('int', None), 'int')
+        self.assertEqual(kmlFieldTypes.widerType('int', 'longlong'), 'longlong')
+        self.assertEqual(kmlFieldTypes.widerType('double', 'int'), 'double')
+        self.assertEqual(kmlFieldTypes.widerType('int', 'datetime'), 'string')
+
+@requiresQgis
+class TestFieldTypes(unittest.TestCase):
+    def sample(self, fieldTypes, values):
+        for (name, value) in values:
+            fieldTypes.sample(name, value)
+        return(fieldTypes.types())
+
+    def testInfer(self):
+        fieldTypes = kmlFieldTypes.FieldTypes(kmlFieldTypes.TYPES_INFER)
+        types = self.sample(fieldTypes, [('a', '1'), ('a', '2.5'), ('b', '1'), ('b', 'x'), ('b', '2'),
+            ('c', ''), ('d', '2020-01-01')])
+        self.assertEqual(types, {'a': 'double', 'b': 'string', 'd': 'datetime'})
+
+    def testSchemaWins(self):
+        fieldTypes = kmlFieldTypes.FieldTypes(kmlFieldTypes.TYPES_INFER)
+        fieldTypes.declare('a', ' Float ')
+        fieldTypes.declare('b', 'unknown')
+        fieldTypes.declare('a', 'int')
+        types = self.sample(fieldTypes, [('a', 'x'), ('b', '1'), ('c', '1')])
+        self.assertEqual(types, {'a': 'double', 'b': 'string', 'c': 'int'})
+
+    def testSchemaOnly(self):
+        fieldTypes = kmlFieldTypes.FieldTypes(kmlFieldTypes.TYPES_SCHEMA)
+        fieldTypes.declare('a', 'uint')
+        self.assertEqual(self.sample(fieldTypes, [('b', '1')]), {'a': 'longlong'})
+
+    def testSampleSize(self):
+        # Values after the sample that do not fit the inferred type widen the field
+        fieldTypes = kmlFieldTypes.FieldTypes(kmlFieldTypes.TYPES_INFER, sampleSize=2)
+        types = self.sample(fieldTypes, [('a', '1'), ('a', '2'), ('a', '3'), ('b', '1'), ('b', '2'), ('b', 'x'),
+            ('c', '1'), ('c', '2'), ('c', '2147483648'), ('d', '1'), ('d', '2'), ('d', '2.5'),
+            ('e', '1.5'), ('e', '2'), ('e', '1e400')])
+        self.assertEqual(types, {'a': 'int', 'b': 'string', 'c': 'longlong', 'd': 'double', 'e': 'double'})
+
+    def testMergeTypes(self):
+        types = {'a': 'int', 'b': 'double'}
+        kmlFieldTypes.mergeTypes(types, {'a': 'longlong', 'b': 'datetime', 'c': 'bool'})
+        self.assertEqual(types, {'a': 'longlong', 'b': 'string', 'c': 'bool'})
+
+    def testConverters(self):
+        types = {'a': 'int', 'b': 'double', 'c': 'bool'}
+        (a, b, c, d) = kmlFieldTypes.converters(types, ['a', 'b', 'c', 'd'])
+        self.assertEqual((a('12'), a('x'), b('2.5'), c('TRUE'), c('0'), c('maybe'), d), (12, None, 2.5, True, False, None, None))
+
+    def testIntegerRange(self):
+        (a, b) = kmlFieldTypes.converters({'a': 'int', 'b': 'longlong'}, ['a', 'b'])
+        self.assertEqual((a('-2147483647'), a('2147483648'), b('2147483648')), (-2147483647, None, 2147483648))
+        self.assertIsNone(b('9223372036854775808'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+from utilities import pluginModule
+
+kmlNetworkLinks = pluginModule('kmlNetworkLinks')
+kmlCache = pluginModule('kmlCache')
+
+class TestNetworkLinkResolver(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.filename = os.path.join(self.folder, 'linked.kml')
+        with open(self.filename, 'w') as f:
+            f.write('<kml><Document/></kml>')
+        self.cache = kmlCache.ParseCache(os.path.join(self.folder, 'cache'))
+
+    def parseDocument(self, source):
+        '''Return a result with a spool of each name as spoolKml would.'''
+        result = {'extData': [], 'links': [], 'groundOverlay': False, 'error': None}
+        for name in kmlCache.SPOOL_NAMES:
+            with tempfile.NamedTemporaryFile(suffix='.spool', dir=self.folder, delete=False) as f:
+                result[name] = (f.name, 0)
+        return(result)
+
+    def testCached(self):
+        resolver = kmlNetworkLinks.NetworkLinkResolver(self.parseDocument, '', 1, self.cache)
+        result = resolver.load((self.filename, None))
+        self.assertTrue(result['cached'])
+        self.assertFalse(result['hit'])
+        self.assertTrue(resolver.load((self.filename, None))['hit'])
+
+    def testCacheFails(self):
+        # A document that cannot be added to the cache is imported without it
+        resolver = kmlNetworkLinks.NetworkLinkResolver(self.parseDocument, '', 1, self.cache)
+        with mock.patch.object(kmlCache.os, 'rename', side_effect=OSError('No space left on device')):
+            result = resolver.load((self.filename, None))
+        self.assertNotIn('cached', result)
+        self.assertEqual(result['cacheError'], 'No space left on device')
+        for name in kmlCache.SPOOL_NAMES:
+            self.assertTrue(os.path.exists(result[name][0]))
+
+if __name__ == '__main__':
+    unittest.main()
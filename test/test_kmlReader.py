@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import zipfile
+import tempfile
+import unittest
+from unittest import mock
+from utilities import pluginModule
+
+kmlReader = pluginModule('kmlReader')
+
+DOCUMENT = b'<kml><Document>' + b'<Placemark/>' * 20000 + b'</Document></kml>'
+
+class TestKmlSource(unittest.TestCase):
+    def setUp(self):
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.filename = os.path.join(folder.name, 'test.kmz')
+        with zipfile.ZipFile(self.filename, 'w', zipfile.ZIP_DEFLATED) as kmz:
+            kmz.writestr('doc.kml', DOCUMENT)
+        self.source = kmlReader.KmlSource(self.filename)
+        self.addCleanup(self.source.close)
+
+    def read(self, keep=False):
+        data = []
+        for stream in self.source.streams(keep):
+            with stream:
+                data.append(stream.read())
+        return(data)
+
+    def testTwoPasses(self):
+        self.assertEqual(self.read(True), [DOCUMENT])
+        copy = self.source.copies['doc.kml']
+        # The second pass reads the decompressed copy instead of the archive
+        with mock.patch.object(self.source.kmz, 'open') as kmzOpen:
+            self.assertEqual(self.read(), [DOCUMENT])
+            kmzOpen.assert_not_called()
+        self.assertEqual(self.source.bytesRead, 2 * len(DOCUMENT))
+        self.source.close()
+        self.assertFalse(os.path.exists(copy))
+
+    def testPartialRead(self):
+        # A copy of a document that was not read to the end is not used
+        stream = next(self.source.streams(True))
+        stream.read(100)
+        stream.close()
+        self.assertEqual(self.source.copies, {})
+        self.assertEqual(self.read(), [DOCUMENT])
+
+if __name__ == '__main__':
+    unittest.main()
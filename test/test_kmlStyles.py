@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import unittest
+from unittest import mock
+from utilities import pluginModule, requiresQgis, HAS_QGIS
+
+if HAS_QGIS:
+    kmlStyles = pluginModule('kmlStyles')
+
+def readStyle(tag, id, children):
+    '''Return the StyleReader of a Style or StyleMap element given as nested
+    (tag, text or list of children) tuples.'''
+    reader = kmlStyles.StyleReader(tag, {'id': id})
+    def feed(elements):
+        for (child, content) in elements:
+            reader.startElement(child, {})
+            if isinstance(content, list):
+                feed(content)
+            else:
+                reader.characters(content)
+            reader.endElement(child)
+    feed(children)
+    assert reader.endElement(tag)
+    return(reader)
+
+def pair(key, content):
+    if isinstance(content, str):
+        return(('Pair', [('key', key), ('styleUrl', content)]))
+    return(('Pair', [('key', key), ('Style', content)]))
+
+LINE = [('LineStyle', [('color', 'ff0000ff'), ('width', '2.5')])]
+HIGHLIGHT = [('LineStyle', [('color', 'ffffffff'), ('width', '4')])]
+
+@requiresQgis
+class TestStyleIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = kmlStyles.StyleIndex()
+
+    def add(self, tag, id, children):
+        self.index.add(readStyle(tag, id, children))
+
+    def testStyle(self):
+        self.add('Style', 'line', LINE)
+        self.assertEqual(self.index.attributes('#line'),
+            ['line', '#ffff0000', 2.5, '', '', '', None])
+
+    def testStyleMap(self):
+        self.add('Style', 'line', LINE)
+        self.add('Style', 'highlight', HIGHLIGHT)
+        self.add('StyleMap', 'map', [pair('highlight', '#highlight'), pair('normal', '#line')])
+        # The id of the normal Style is used so placemarks of the map and the style share it
+        self.assertEqual(self.index.attributes('#map'),
+            ['line', '#ffff0000', 2.5, '', '', '', None])
+
+    def testExternalStyle(self):
+        # A style in another document is not matched against the styles of this one
+        self.add('Style', 'line', LINE)
+        self.assertEqual(self.index.attributes('other.kml#line'), ['', '', None, '', '', '', None])
+        self.add('StyleMap', 'map', [pair('normal', 'other.kml#line')])
+        self.assertEqual(self.index.attributes('#map')[:3], ['', '', None])
+        self.assertEqual(self.index.lateAttributes(), {})
+
+    def testNestedStyleMaps(self):
+        self.add('StyleMap', 'outer', [pair('normal', '#inner')])
+        self.add('StyleMap', 'inner', [pair('normal', '#line')])
+        self.add('Style', 'line', LINE)
+        self.assertEqual(self.index.attributes('#outer')[:3], ['line', '#ffff0000', 2.5])
+
+    def testInlinePairStyle(self):
+        self.add('StyleMap', 'map', [pair('normal', LINE)])
+        self.assertEqual(self.index.attributes('#map')[:3], ['map', '#ffff0000', 2.5])
+
+    def testStyleMapLoop(self):
+        self.add('StyleMap', 'a', [pair('normal', '#b')])
+        self.add('StyleMap', 'b', [pair('normal', '#a')])
+        # Following the loop stops after MAX_STYLE_DEPTH StyleMaps without any values
+        self.assertEqual(self.index.attributes('#a')[1:], ['', None, '', '', '', None])
+
+    def testMissing(self):
+        self.assertEqual(self.index.attributes('#missing'), ['missing', '', None, '', '', '', None])
+        self.assertEqual(self.index.attributes(''), ['', '', None, '', '', '', None])
+
+    def testLateStyle(self):
+        # A style added after a styleUrl was looked up replaces the unresolved result
+        self.assertEqual(self.index.attributes('#line')[1], '')
+        self.add('Style', 'line', LINE)
+        self.assertEqual(self.index.attributes('#line')[1], '#ffff0000')
+
+    def testLateAttributes(self):
+        # The placemarks read before their Style or StyleMap was defined are resolved afterwards
+        self.assertEqual(self.index.attributes('#map'), ['map', '', None, '', '', '', None])
+        self.assertEqual(self.index.attributes('#line', {'line_width': 6.0})[:3], ['inline1', '', 6.0])
+        self.assertEqual(self.index.attributes('#undefined')[0], 'undefined')
+        self.add('StyleMap', 'map', [pair('normal', '#line')])
+        self.add('Style', 'line', LINE)
+        self.assertEqual(self.index.lateAttributes(), {
+            'map': ['line', '#ffff0000', 2.5, '', '', '', None],
+            'line': ['line', '#ffff0000', 2.5, '', '', '', None],
+            'inline1': ['inline2', '#ffff0000', 6.0, '', '', '', None]})
+
+    def testInlineStyle(self):
+        self.add('Style', 'line', LINE)
+        attr = self.index.attributes('#line', {'line_width': 6.0})
+        self.assertEqual(attr, ['inline1', '#ffff0000', 6.0, '', '', '', None])
+        self.assertEqual(self.index.attributes('#line', {'line_width': 6.0})[0], 'inline1')
+        self.assertEqual(self.index.attributes('#line', {'line_width': 7.0})[0], 'inline2')
+
+    def testUnfilled(self):
+        self.add('Style', 'poly', [('PolyStyle', [('color', '7f00ff00'), ('fill', '0')])])
+        self.assertEqual(self.index.attributes('#poly')[3], '#0000ff00')
+
+@requiresQgis
+class TestKmlColor(unittest.TestCase):
+    def testColor(self):
+        self.assertEqual(kmlStyles.kmlColor(' 7f112233 '), '#7f332211')
+        self.assertEqual(kmlStyles.kmlColor('112233'), '')
+        self.assertEqual(kmlStyles.kmlColor('zz112233'), '')
+
+@requiresQgis
+class TestStyleRenderer(unittest.TestCase):
+    def testReferences(self):
+        points = kmlStyles.StyleRenderer.create('points')
+        lines = kmlStyles.StyleRenderer.create('lines')
+        self.assertIs(kmlStyles.StyleRenderer.instances['points'], points)
+        self.assertIs(kmlStyles.StyleRenderer.instances['lines'], lines)
+        # A layer without the style fields is left as it is
+        layer = mock.Mock()
+        layer.fields.return_value.indexOf.return_value = -1
+        points.postProcessLayer(layer, None, None)
+        layer.setRenderer.assert_not_called()
+        self.assertNotIn('points', kmlStyles.StyleRenderer.instances)
+        self.assertIs(kmlStyles.StyleRenderer.instances.pop('lines'), lines)
+
+if __name__ == '__main__':
+    unittest.main()
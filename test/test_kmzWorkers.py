@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import struct
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+from utilities import pluginModule
+
+kmzWorkers = pluginModule('kmzWorkers')
+
+def pointWkb(x, y, z):
+    return(b'\x01' + struct.pack('<Iddd', 1001, x, y, z))
+
+class TestPlacemarkPool(unittest.TestCase):
+    def pool(self, writer, executor):
+        return(kmzWorkers.PlacemarkPool(writer, executor, 1, True, 0.0, None, None))
+
+    def add(self, pool, count):
+        for i in range(count):
+            placemark = kmzWorkers.simplekml.featgeom.Placemark(name='p{}'.format(i))
+            pool.add(placemark, pointWkb(i, 2, 3), False, None, False, None, 0)
+
+    def testOrder(self):
+        writer = mock.Mock()
+        with ThreadPoolExecutor(2) as executor:
+            pool = self.pool(writer, executor)
+            self.add(pool, 3)
+            pool.startFolder('sub')
+            self.add(pool, 2)
+            pool.close()
+        calls = writer.method_calls
+        self.assertEqual([call[0] for call in calls], ['writeFragment', 'startFolder', 'writeFragment'])
+        self.assertEqual(calls[0][1][0].count('<Placemark'), 3)
+        self.assertIn('<coordinates>2.0,2.0,3.0</coordinates>', calls[0][1][0])
+        self.assertEqual(calls[1][1], ('sub',))
+        self.assertIn('<name>p1</name>', calls[2][1][0])
+
+    def testCancel(self):
+        executor = mock.Mock()
+        pool = self.pool(mock.Mock(), executor)
+        self.add(pool, 3)
+        pool.startFolder('sub')
+        self.add(pool, 1)
+        pool.cancel()
+        executor.submit.return_value.cancel.assert_called_once_with()
+        self.assertFalse(pool.pending)
+        self.assertFalse(pool.records)
+
+class TestArrayCoordinates(unittest.TestCase):
+    def coordinates(self, precision=None):
+        points = [(1.123456789, -2.987654321, 3.25), (0.1, 0.2, 0.0)]
+        return(kmzWorkers.ArrayCoordinates(points, precision))
+
+    def testList(self):
+        self.assertEqual(str(self.coordinates()), '1.123456789,-2.987654321,3.25 0.1,0.2,0.0')
+        self.assertEqual(str(self.coordinates(3)), '1.123,-2.988,3.25 0.1,0.2,0.0')
+        with mock.patch.object(kmzWorkers, 'HAS_NUMPY', False):
+            self.assertEqual(str(self.coordinates(2)), '1.12,-2.99,3.25 0.1,0.2,0.0')
+
+    @unittest.skipUnless(kmzWorkers.HAS_NUMPY, 'NumPy is not installed')
+    def testArray(self):
+        points = kmzWorkers.np.array([[1.23456, 2.5, 0.0], [3.0, 4.0, 5.0]])
+        coords = kmzWorkers.ArrayCoordinates(points)
+        self.assertEqual(str(coords), '1.23456,2.5,0.0 3.0,4.0,5.0')
+        coords.precision = 3
+        self.assertEqual(str(coords), '1.235,2.5,0.0 3.0,4.0,5.0')
+        # The coordinates are simplekml's list of tuples
+        self.assertEqual(coords._coords, [(1.23456, 2.5, 0.0), (3.0, 4.0, 5.0)])
+        coords.addcoordinates([(6, 7)])
+        self.assertEqual(str(coords), '1.235,2.5,0.0 3.0,4.0,5.0 6.0,7.0,0.0')
+
+    def testPolygon(self):
+        polygon = kmzWorkers.simplekml.Polygon()
+        ring = [(0.0, 0.0, 0.0), (0.0, 1.0, 0.0), (1.0, 1.0, 0.0), (0.0, 0.0, 0.0)]
+        polygon.outerboundaryis = kmzWorkers.kmlCoordinates(ring, False, 10.0, 0.5, 1)
+        polygon.innerboundaryis = [kmzWorkers.ArrayCoordinates([(0.25, 0.25, 0.0)] * 4, 1)]
+        text = polygon.__str__()
+        self.assertIn('<coordinates>0.0,0.0,10.5 0.0,1.0,10.5 1.0,1.0,10.5 0.0,0.0,10.5</coordinates>', text)
+        self.assertIn('<coordinates>0.2,0.2,0.0 0.2,0.2,0.0 0.2,0.2,0.0 0.2,0.2,0.0</coordinates>', text)
+
+@unittest.skipUnless(kmzWorkers.HAS_NUMPY and kmzWorkers.HAS_PYPROJ, 'NumPy and pyproj are not installed')
+class TestTransformGeometries(unittest.TestCase):
+    def testTransform(self):
+        # Web Mercator to WGS 84 with points read as tuples and as arrays
+        x = 20037508.342789244
+        line = b'\x01' + struct.pack('<II', 2, 8) + struct.pack('<16d', *([x / 2, 0.0] * 8))
+        polygon = b'\x01' + struct.pack('<III', 3, 1, 4) + struct.pack('<8d', 0, 0, x, 0, x, x / 4, 0, 0)
+        features = [kmzWorkers.wkbGeometries(pointWkb(-x, 0, 5)), kmzWorkers.wkbGeometries(line),
+            kmzWorkers.wkbGeometries(polygon)]
+        kmzWorkers.transformGeometries('EPSG:3857', features)
+        (point, line, polygon) = [geometries[0] for geometries in features]
+        self.assertEqual(point[0], kmzWorkers.WKB_POINT)
+        self.assertEqual(point[1].round(6).tolist(), [[-180.0, 0.0, 5.0]])
+        self.assertEqual(line[1].shape, (8, 3))
+        self.assertEqual(line[1][:, 0].round(6).tolist(), [90.0] * 8)
+        self.assertEqual(polygon[0], kmzWorkers.WKB_POLYGON)
+        self.assertEqual(polygon[1][0][:, 0].round(6).tolist(), [0.0, 180.0, 180.0, 0.0])
+        self.assertAlmostEqual(polygon[1][0][2, 1], 40.979898, 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import zipfile
+import tempfile
+import unittest
+from utilities import pluginModule
+
+kmzWriter = pluginModule('kmzWriter')
+
+class TestKmlIndenter(unittest.TestCase):
+    def indent(self, indenter, text):
+        return(''.join(indenter.indent(text)))
+
+    def testDocument(self):
+        indenter = kmzWriter.KmlIndenter()
+        self.assertEqual(self.indent(indenter, '<?xml version="1.0"?><kml><Document><name>A &amp; B</name>'),
+            '<?xml version="1.0"?>\n<kml>\n    <Document>\n        <name>A &amp; B</name>')
+        # The next piece continues at the depth the last one ended at
+        self.assertEqual(self.indent(indenter, '<Placemark><Point><coordinates>1,2,0</coordinates></Point>'
+            '<br/></Placemark></Document></kml>'),
+            '\n        <Placemark>\n            <Point>\n                <coordinates>1,2,0</coordinates>'
+            '\n            </Point>\n            <br/>\n        </Placemark>\n    </Document>\n</kml>')
+        self.assertEqual(indenter.depth, 0)
+
+    def testCdata(self):
+        indenter = kmzWriter.KmlIndenter()
+        self.assertEqual(self.indent(indenter, '<description><![CDATA[<b>x</b>\n<i>y</i>]]></description>'),
+            '<description><![CDATA[<b>x</b>\n<i>y</i>]]></description>')
+
+    def testDepth(self):
+        indenter = kmzWriter.KmlIndenter(2)
+        self.assertEqual(self.indent(indenter, '<Placemark><name>x</name></Placemark>'),
+            '\n        <Placemark>\n            <name>x</name>\n        </Placemark>')
+
+class TestKmzWriter(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.filename = os.path.join(self.folder.name, 'test.kmz')
+
+    def testStreaming(self):
+        writer = kmzWriter.KmzWriter(self.filename)
+        writer.startDocument()
+        writer.startFolder('Layer <1>')
+        folder = kmzWriter.simplekml.Folder()
+        folder.newpoint(name='a', coords=[(1, 2)])
+        writer.writeFeatures(folder)
+        writer.close()
+        with zipfile.ZipFile(self.filename) as kmz:
+            doc = kmz.read('doc.kml').decode('utf-8')
+        self.assertTrue(doc.startswith('<?xml version="1.0" encoding="UTF-8"?>\n<kml '))
+        self.assertIn('<Folder><name>Layer &lt;1&gt;</name><Placemark', doc)
+        self.assertIn('<coordinates>1,2,0.0</coordinates>', doc)
+        self.assertTrue(doc.endswith('</Folder></Document></kml>\n'))
+
+    def testDiscard(self):
+        writer = kmzWriter.KmzWriter(self.filename)
+        writer.startDocument()
+        writer.discard()
+        self.assertFalse(os.path.exists(self.filename))
+
+if __name__ == '__main__':
+    unittest.main()
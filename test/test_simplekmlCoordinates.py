@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import unittest
+from utilities import pluginModule
+
+# The plugin package adds its bundled simplekml to the path
+simplekml = pluginModule('kmzWriter').simplekml
+coordinates = simplekml.coordinates
+
+class TestCoordinates(unittest.TestCase):
+    def testFormat(self):
+        # The values are written as they were given
+        self.assertEqual(str(coordinates.Coordinates([(1, 2, 0), (1.5, 2.25, 3.0)])), '1,2,0 1.5,2.25,3.0')
+        self.assertEqual(str(coordinates.Coordinates([(1, 2), (0.1, 0.2)])), '1,2,0.0 0.1,0.2,0.0')
+
+    def testCoords(self):
+        point = simplekml.Point(coords=[(1, 2)])
+        self.assertEqual(point.coords._coords, [(1, 2, 0.0)])
+        point.coords = [(3, 4, 5)]
+        self.assertEqual(point.coords._coords, [(3, 4, 5)])
+        self.assertIn('<coordinates>3,4,5</coordinates>', point.__str__())
+
+    def testCoordinatesObject(self):
+        # A Coordinates object given as the coordinates is kept as it is
+        coords = coordinates.Coordinates([(1, 2, 3)])
+        self.assertIs(simplekml.LineString(coords=coords).coords, coords)
+        line = simplekml.LineString()
+        line.coords = coords
+        self.assertIs(line.coords, coords)
+
+    def testInnerBoundary(self):
+        kml = simplekml.Kml()
+        polygon = kml.newpolygon(outerboundaryis=[(0, 0), (0, 9), (9, 9), (0, 0)])
+        polygon.innerboundaryis = [[(1.23, 1.23), (1.23, 2.34), (2.34, 2.34), (1.23, 1.23)]]
+        self.assertIn('<coordinates>1.23,1.23,0.0 1.23,2.34,0.0 2.34,2.34,0.0 1.23,1.23,0.0</coordinates>'
+            '</LinearRing></innerBoundaryIs>', kml.kml(False))
+
+    def testEmpty(self):
+        self.assertEqual(str(coordinates.Coordinates()), '0.0, 0.0, 0.0')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+
+Shared code of the unit tests. Run them from the plugin folder with
+
+    python3 -m pytest test
+
+or python3 -m unittest discover -s test. The tests of modules that use QGIS are
+skipped unless the qgis module can be imported.
+"""
+import os
+import sys
+import importlib
+import unittest
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_NAME = os.path.basename(PLUGIN_DIR)
+
+try:
+    import qgis.core
+    HAS_QGIS = True
+except Exception:
+    HAS_QGIS = False
+
+requiresQgis = unittest.skipUnless(HAS_QGIS, 'QGIS is not installed')
+
+def pluginModule(name):
+    '''Import and return the plugin module name. Importing the plugin package adds
+    the bundled libraries such as simplekml to the path.'''
+    parent = os.path.dirname(PLUGIN_DIR)
+    if parent not in sys.path:
+        sys.path.insert(0, parent)
+    return(importlib.import_module('{}.{}'.format(PLUGIN_NAME, name)))
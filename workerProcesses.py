@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import os
+import sys
+
+def pythonExecutable():
+    '''Return the Python interpreter used to start worker processes. Within QGIS
+    sys.executable is usually the QGIS application rather than Python.'''
+    executable = sys.executable
+    if executable and os.path.basename(executable).lower().startswith('python'):
+        return(executable)
+    if sys.platform == 'win32':
+        names = [os.path.join(sys.exec_prefix, 'pythonw.exe'), os.path.join(sys.exec_prefix, 'python.exe')]
+    else:
+        names = [os.path.join(sys.exec_prefix, 'bin', 'python3'), os.path.join(sys.exec_prefix, 'bin', 'python')]
+    for name in names:
+        if os.path.isfile(name):
+            return(name)
+    return(None)